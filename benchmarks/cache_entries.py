@@ -0,0 +1,152 @@
+"""
+Compares the cache entry schema from 0001_initial (pickled, base64
+headers and a plain text body, looked up by url) with the current one
+(JSON headers, optionally compressed body, looked up by hashed key).
+Each schema gets its own sqlite file, so file sizes can be compared too.
+
+Usage: python benchmarks/cache_entries.py [number of entries]
+"""
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import zlib
+from base64 import b64encode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+DIRECTORY = tempfile.mkdtemp()
+
+from django.conf import settings
+settings.configure(INSTALLED_APPS=["spotseeker_restclient"],
+                   DATABASES={
+                       "default": {
+                           "ENGINE": "django.db.backends.sqlite3",
+                           "NAME": os.path.join(DIRECTORY, "new.db")},
+                       "old": {
+                           "ENGINE": "django.db.backends.sqlite3",
+                           "NAME": os.path.join(DIRECTORY, "old.db")}},
+                   USE_TZ=True)
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connections, transaction
+from spotseeker_restclient.models import CacheEntry, cache_key
+
+RESOURCES = os.path.join(os.path.dirname(__file__), "..",
+                         "spotseeker_restclient", "resources", "spotseeker",
+                         "file", "api", "v1", "spot")
+HEADERS = {"Content-Type": "application/json",
+           "ETag": '"f573702e9e71197ff3eaa3c6357845d614580930"',
+           "Date": "Mon, 07 Nov 1994 01:49:37 GMT"}
+LOOKUPS = 2000
+
+
+def bodies():
+    spot = open(os.path.join(RESOURCES, "1")).read()
+    spots = json.loads(open(os.path.join(RESOURCES, "all")).read())
+    # A single spot, the fixture's spot/all, and a 100 spot search
+    return [spot, json.dumps(spots), json.dumps(spots * 34)]
+
+
+def entries(count):
+    data = bodies()
+    for i in range(count):
+        url = "/api/v1/spot?limit=0&extended_info:app_type=food&page=%s" % i
+        yield url, data[i % len(data)]
+
+
+def fill_old(count):
+    cursor = connections["old"].cursor()
+    size = 0
+    with transaction.atomic(using="old"):
+        for url, data in entries(count):
+            header_pickle = b64encode(pickle.dumps(HEADERS))
+            cursor.execute("INSERT INTO spotseeker_restclient_cacheentry "
+                           "(service, url, status, header_pickle, content) "
+                           "VALUES (%s, %s, %s, %s, %s)",
+                           ["spotseeker", url, 200, header_pickle, data])
+            size += len(url) + len(header_pickle) + len(data)
+    return size
+
+
+def fill_new(count):
+    size = 0
+    with transaction.atomic():
+        for url, data in entries(count):
+            entry = CacheEntry(service="spotseeker", url=url, status=200)
+            entry.content = data
+            entry.headers = HEADERS
+            entry.save()
+            size += (len(entry.key) + len(url) + len(entry.header_json) +
+                     len(entry.body))
+    return size
+
+
+def timed(label, function, count):
+    start = time.time()
+    for i in range(LOOKUPS):
+        function("/api/v1/spot?limit=0&extended_info:app_type=food&page=%s" %
+                 (i * 7919 % count))
+    elapsed = (time.time() - start) / LOOKUPS
+    print("  %-28s %7.1f us" % (label, elapsed * 1000000))
+
+
+def run(count):
+    call_command("migrate", "spotseeker_restclient", "0001", database="old",
+                 verbosity=0)
+    call_command("migrate", verbosity=0)
+
+    old_size = fill_old(count)
+    new_size = fill_new(count)
+    print("%d entries" % count)
+    print("  stored bytes per row          old %7d  new %7d" %
+          (old_size / count, new_size / count))
+    print("  database file                 old %6dK  new %6dK" %
+          (os.path.getsize(os.path.join(DIRECTORY, "old.db")) / 1024,
+           os.path.getsize(os.path.join(DIRECTORY, "new.db")) / 1024))
+
+    old_cursor = connections["old"].cursor()
+
+    def old_lookup(url):
+        old_cursor.execute("SELECT id, service, url, status, header_pickle, "
+                           "content FROM spotseeker_restclient_cacheentry "
+                           "WHERE service = %s AND url = %s",
+                           ["spotseeker", url])
+        row = old_cursor.fetchone()
+        pickle.loads(row[4].decode("base64"))
+        return row[5]
+
+    new_cursor = connections["default"].cursor()
+
+    def new_sql_lookup(url):
+        new_cursor.execute("SELECT id, service, url, status, header_json, "
+                           "body, compressed FROM "
+                           "spotseeker_restclient_cacheentry WHERE key = %s",
+                           [cache_key("spotseeker", url)])
+        row = new_cursor.fetchone()
+        json.loads(row[4])
+        return zlib.decompress(row[5]) if row[6] else row[5]
+
+    def new_lookup(url):
+        entry = CacheEntry.objects.for_url("spotseeker", url).get()
+        entry.getHeaders()
+        return entry.content
+
+    def new_metadata(url):
+        entry = CacheEntry.objects.for_url("spotseeker",
+                                           url).defer("body").get()
+        return entry.getHeaders()
+
+    timed("old lookup, SQL", old_lookup, count)
+    timed("new lookup, SQL", new_sql_lookup, count)
+    timed("new lookup, ORM", new_lookup, count)
+    timed("new lookup, ORM headers only", new_metadata, count)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,75 @@
+"""
+Measures the per-call overhead of resolving the DAO and cache classes,
+with and without the memoized lookup, and of a full getURL through
+SPOTSEEKER_DAO with a DAO that does no work, without and with a metrics
+hook registered.
+
+Usage: python benchmarks/dao_overhead.py [number of calls]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings
+settings.configure(
+    INSTALLED_APPS=["spotseeker_restclient"],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3",
+                           "NAME": ":memory:"}},
+    SPOTSEEKER_DAO_CLASS="__main__.NullDAO",
+    DAO_CACHE_CLASS="spotseeker_restclient.cache_implementation.NoCache")
+
+import django
+django.setup()
+
+from spotseeker_restclient.dao import SPOTSEEKER_DAO
+from spotseeker_restclient.mock_http import MockHTTP
+from spotseeker_restclient.cache_implementation import NoCache
+from spotseeker_restclient.instrumentation import register_hook, \
+    clear_hooks, HistogramExporter
+
+
+class NullDAO(object):
+    def getURL(self, url, headers):
+        response = MockHTTP()
+        response.status = 200
+        return response
+
+
+def uncached():
+    dao = SPOTSEEKER_DAO()
+    dao._loadModule("SPOTSEEKER_DAO_CLASS", NullDAO)
+    dao._loadModule("DAO_CACHE_CLASS", NoCache)
+
+
+def cached():
+    dao = SPOTSEEKER_DAO()
+    dao._getDAO()
+    dao._getCache()
+
+
+def get_url():
+    SPOTSEEKER_DAO().getURL("/api/v1/spot/1", {})
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = []
+    for name, func in (("resolve, import_module", uncached),
+                       ("resolve, memoized", cached),
+                       ("getURL, memoized", get_url)):
+        results.append((name, timeit.timeit(func, number=count)))
+
+    register_hook(HistogramExporter())
+    results.append(("getURL, with a hook", timeit.timeit(get_url,
+                                                         number=count)))
+    clear_hooks()
+
+    # The full call path as it was before resolution was memoized
+    SPOTSEEKER_DAO._getModule = SPOTSEEKER_DAO._loadModule
+    results.append(("getURL, import_module",
+                    timeit.timeit(get_url, number=count)))
+
+    for name, seconds in results:
+        print("%-24s %8.2f us/call" % (name, seconds / count * 1000000))
@@ -0,0 +1,103 @@
+"""
+Times nearest, radius and bounding box queries over SpotGeoIndex against
+a linear scan of every spot.
+
+Usage: python benchmarks/geo_index.py [number of spots]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings
+settings.configure(INSTALLED_APPS=["spotseeker_restclient"],
+                   DATABASES={"default": {
+                       "ENGINE": "django.db.backends.sqlite3",
+                       "NAME": ":memory:"}},
+                   USE_TZ=True)
+
+import django
+django.setup()
+
+from spotseeker_restclient.geo_index import SpotGeoIndex, distance
+from spotseeker_restclient.models.lightweight import Spot
+
+QUERIES = 200
+
+
+def build_spots(count):
+    generator = random.Random(1)
+    # Spread over about 4km by 3km, around a campus
+    return [Spot(spot_id=spot_id,
+                 latitude=47.64 + generator.random() * 0.04,
+                 longitude=-122.33 + generator.random() * 0.04)
+            for spot_id in range(count)]
+
+
+def scan_nearest(spots, latitude, longitude, count):
+    return sorted((distance(latitude, longitude, spot.latitude,
+                            spot.longitude), spot.spot_id)
+                  for spot in spots)[:count]
+
+
+def scan_radius(spots, latitude, longitude, meters):
+    return [spot for spot in spots
+            if distance(latitude, longitude, spot.latitude,
+                        spot.longitude) <= meters]
+
+
+def scan_box(spots, south, west, north, east):
+    return [spot for spot in spots
+            if south <= spot.latitude <= north and
+            west <= spot.longitude <= east]
+
+
+def timed(label, function, points):
+    found = 0
+    start = time.time()
+    for point in points:
+        found += len(function(*point))
+    elapsed = (time.time() - start) / len(points)
+    print("  %-24s %9.3f ms/query %8d spots/query" % (
+        label, elapsed * 1000, found / len(points)))
+
+
+def run(count):
+    spots = build_spots(count)
+    generator = random.Random(2)
+    points = [(47.64 + generator.random() * 0.04,
+               -122.33 + generator.random() * 0.04) for i in range(QUERIES)]
+    scan_points = points[:max(1, QUERIES * 1000 / count)]
+
+    start = time.time()
+    index = SpotGeoIndex(spots)
+    print("%d spots, index built in %.3fs" % (count, time.time() - start))
+
+    timed("nearest(10)", lambda lat, lon: index.nearest(lat, lon, 10),
+          points)
+    timed("scan nearest(10)",
+          lambda lat, lon: scan_nearest(spots, lat, lon, 10), scan_points)
+    timed("radius(500m)", lambda lat, lon: index.radius(lat, lon, 500),
+          points)
+    timed("radius(500m, limit=10)",
+          lambda lat, lon: index.radius(lat, lon, 500, limit=10), points)
+    timed("radius(100m)", lambda lat, lon: index.radius(lat, lon, 100),
+          points)
+    timed("scan radius(500m)",
+          lambda lat, lon: scan_radius(spots, lat, lon, 500), scan_points)
+    timed("bounding_box",
+          lambda lat, lon: index.bounding_box(lat, lon, lat + 0.005,
+                                              lon + 0.005), points)
+    timed("scan bounding_box",
+          lambda lat, lon: scan_box(spots, lat, lon, lat + 0.005,
+                                    lon + 0.005), scan_points)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        for count in (10000, 100000):
+            run(count)
@@ -0,0 +1,70 @@
+"""
+Compares parsing spots into the Django model instances with the
+lightweight __slots__ classes.  Each variant runs in its own process so
+that peak RSS can be compared.
+
+Usage: python benchmarks/spot_models.py [number of spots]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings
+settings.configure(INSTALLED_APPS=["spotseeker_restclient"],
+                   DATABASES={"default": {
+                       "ENGINE": "django.db.backends.sqlite3",
+                       "NAME": ":memory:"}},
+                   USE_TZ=True)
+
+import django
+django.setup()
+
+from spotseeker_restclient.spotseeker import Spotseeker
+
+SPOT_FILE = os.path.join(os.path.dirname(__file__), "..",
+                         "spotseeker_restclient", "resources", "spotseeker",
+                         "file", "api", "v1", "spot", "1")
+
+
+def build_content(count):
+    spot = json.loads(open(SPOT_FILE).read())
+    spots = []
+    for spot_id in range(count):
+        spot["id"] = spot_id
+        spot["uri"] = "/api/v1/spot/%s" % spot_id
+        spots.append(json.dumps(spot))
+    return "[%s]" % ",".join(spots)
+
+
+def run(variant, count):
+    content = build_content(count)
+    client = Spotseeker(lightweight=(variant == "lightweight"))
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    spots = [client.spot_from_data(data) for data in json.loads(content)]
+    parse_time = time.time() - start
+
+    # Touching every nested collection includes the deferred parsing.
+    for spot in spots:
+        spot.images, spot.items, spot.spot_availability, spot.extended_info
+    total_time = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+
+    print("%-12s %8d spots  parse %7.3fs  with nested %7.3fs  "
+          "peak RSS +%d KB" % (variant, len(spots), parse_time, total_time,
+                               rss))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        run(sys.argv[1], int(sys.argv[2]))
+    else:
+        count = sys.argv[1] if len(sys.argv) > 1 else "5000"
+        for variant in ("django", "lightweight"):
+            subprocess.check_call([sys.executable, __file__, variant, count])
@@ -0,0 +1,196 @@
+"""
+An inverted index over spot extended_info and item attributes, for
+filtering on them without comparing strings spot by spot.
+"""
+from binascii import hexlify
+from django.utils.encoding import force_text
+
+
+EXTENDED_INFO = "extended_info"
+ITEM = "item"
+ITEM_EXTENDED_INFO = "item:extended_info"
+
+ITEM_FIELDS = {
+    "id": "item_id",
+    "name": "name",
+    "category": "category",
+    "subcategory": "subcategory",
+}
+
+
+def _spot_attributes(spot):
+    """
+    Returns the set of (field, key, value) attributes of a spot.
+    """
+    attributes = set()
+    for info in spot.extended_info:
+        attributes.add((EXTENDED_INFO, force_text(info.key),
+                        force_text(info.value)))
+    for item in spot.items:
+        for key, attr in ITEM_FIELDS.items():
+            attributes.add((ITEM, key, force_text(getattr(item, attr))))
+        for info in item.extended_info:
+            attributes.add((ITEM_EXTENDED_INFO, force_text(info.key),
+                            force_text(info.value)))
+    return attributes
+
+
+def _bitmap(slots):
+    """
+    Returns the int with the bits for the slots set.  Quicker than
+    or-ing the bits in one at a time for more than a few slots.
+    """
+    slots = list(slots)
+    if not slots:
+        return 0
+    bits = bytearray(max(slots) // 8 + 1)
+    for slot in slots:
+        bits[slot // 8] |= 1 << (slot % 8)
+    bits.reverse()
+    return int(hexlify(bits), 16)
+
+
+def _bits(bitmap):
+    """
+    Yields the slots set in a bitmap.
+    """
+    bits = bin(bitmap)[:1:-1]
+    slot = bits.find("1")
+    while slot != -1:
+        yield slot
+        slot = bits.find("1", slot + 1)
+
+
+class AttributeIndex(object):
+    """
+    Maps (field, key) to value to a bitmap of the spots with that
+    attribute.  field is "extended_info", "item:extended_info", or "item"
+    for the item id, name, category and subcategory.  Bitmaps are ints
+    with one bit per spot, so they combine with & and |; spot_ids() turns
+    one back into spot ids.
+    """
+    def __init__(self, spots=()):
+        self._slots = {}
+        self._spot_ids = []
+        self._free = []
+        self._attributes = {}
+        self._postings = {}
+
+        slots_by_attribute = {}
+        for spot in spots:
+            slot = self._add_spot(spot)
+            for attribute in self._attributes[slot]:
+                slots_by_attribute.setdefault(attribute, []).append(slot)
+
+        for (field, key, value), slots in slots_by_attribute.items():
+            self._postings.setdefault((field, key), {})[value] = \
+                _bitmap(slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _add_spot(self, spot):
+        spot_id = str(spot.spot_id)
+        if spot_id in self._slots:
+            self.remove(spot_id)
+
+        if self._free:
+            slot = self._free.pop()
+            self._spot_ids[slot] = spot_id
+        else:
+            slot = len(self._spot_ids)
+            self._spot_ids.append(spot_id)
+
+        self._slots[spot_id] = slot
+        self._attributes[slot] = _spot_attributes(spot)
+        return slot
+
+    def add(self, spot):
+        """
+        Adds a spot, replacing any spot with the same spot_id.
+        """
+        slot = self._add_spot(spot)
+        bit = 1 << slot
+        for field, key, value in self._attributes[slot]:
+            values = self._postings.setdefault((field, key), {})
+            values[value] = values.get(value, 0) | bit
+
+    def remove(self, spot_id):
+        slot = self._slots.pop(str(spot_id), None)
+        if slot is None:
+            return
+
+        mask = ~(1 << slot)
+        for field, key, value in self._attributes.pop(slot):
+            values = self._postings[(field, key)]
+            values[value] &= mask
+            if not values[value]:
+                del values[value]
+                if not values:
+                    del self._postings[(field, key)]
+
+        self._spot_ids[slot] = None
+        self._free.append(slot)
+
+    def update(self, changes):
+        """
+        Applies a list of SpotChanges from a SpotReplica.
+        """
+        for change in changes:
+            if change.spot is None:
+                self.remove(change.spot_id)
+            else:
+                self.add(change.spot)
+
+    def lookup(self, key, values, field=EXTENDED_INFO):
+        """
+        Returns the bitmap of spots whose key has any of the values.  Keys
+        and values are compared as text, so UTF-8 encoded strings match.
+        """
+        postings = self._postings.get((field, force_text(key)), {})
+        bitmap = 0
+        for value in values:
+            bitmap |= postings.get(force_text(value), 0)
+        return bitmap
+
+    def any_true(self, keys, field=EXTENDED_INFO):
+        """
+        Returns the bitmap of spots with any of the keys set to "true",
+        like the server's extended_info:or_group parameters.
+        """
+        bitmap = 0
+        for key in keys:
+            postings = self._postings.get((field, force_text(key)), {})
+            for value, spots in postings.items():
+                if value.lower() == "true":
+                    bitmap |= spots
+        return bitmap
+
+    def find(self, *groups):
+        """
+        Returns the bitmap of spots that match every group, where a group
+        is a list of (key, value) extended_info pairs and a spot matches
+        a group if it has any of them.
+        """
+        bitmap = None
+        for group in groups:
+            matches = 0
+            for key, value in group:
+                matches |= self.lookup(key, [value])
+            bitmap = matches if bitmap is None else bitmap & matches
+        if bitmap is None:
+            return self.all()
+        return bitmap
+
+    def all(self):
+        """
+        Returns the bitmap of every spot in the index.
+        """
+        return _bitmap(self._slots.values())
+
+    def spot_ids(self, bitmap):
+        """
+        Returns the set of spot ids in a bitmap.
+        """
+        spot_ids = self._spot_ids
+        return set(spot_ids[slot] for slot in _bits(bitmap))
@@ -0,0 +1,201 @@
+"""
+A weekly schedule of spot hours, for answering open at, open between and
+closing soon for every spot at once instead of scanning each spot's
+available hours.
+"""
+from bisect import bisect_left, bisect_right
+
+
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday",
+        "saturday", "sunday"]
+MINUTES_PER_DAY = 60 * 24
+MINUTES_PER_WEEK = MINUTES_PER_DAY * 7
+
+
+def week_minute(day, time):
+    """
+    Returns the minute of the week, counting from Monday 00:00, for a day
+    name and a datetime.time.
+    """
+    return DAYS.index(day.lower()) * MINUTES_PER_DAY + \
+        time.hour * 60 + time.minute
+
+
+def spot_hours(spot):
+    """
+    Returns the (start, end) minutes of the week that a spot is open.
+    """
+    hours = []
+    for available in spot.spot_availability:
+        start = week_minute(available.day, available.start_time)
+        end = week_minute(available.day, available.end_time)
+        if available.end_time.hour == 23 and available.end_time.minute == 59:
+            # 23:59 is how the server says "until midnight"
+            end += 1
+        hours.append((start, end))
+    return hours
+
+
+def merge_hours(hours):
+    """
+    Returns the sorted (start, end) intervals that a spot is open, with
+    overlapping and touching hours joined, so that a spot open until
+    midnight and from midnight is open across it.
+    """
+    merged = []
+    for start, end in sorted(hours):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def is_open_at(spot, minute):
+    for start, end in spot_hours(spot):
+        if start <= minute < end:
+            return True
+    return False
+
+
+def is_open_between(spot, start_minute, end_minute):
+    """
+    Matches the server's fuzzy_hours_start/end search: the spot is open at
+    some point in the range.  Ranges that pass the end of the week wrap
+    around to Monday.
+    """
+    if end_minute < start_minute:
+        return (is_open_between(spot, start_minute, MINUTES_PER_WEEK) or
+                is_open_between(spot, 0, end_minute))
+
+    for start, end in spot_hours(spot):
+        if start <= end_minute and end > start_minute:
+            return True
+    return False
+
+
+class AvailabilityIndex(object):
+    """
+    Keeps each spot's hours as minutes of the week, parsed once when the
+    spot is added.  For queries, the week is cut into segments at every
+    opening and closing time of every spot; each segment holds the spots
+    open throughout it, ordered by when they next close.  The segments
+    are rebuilt on the first query after spots are added or removed.
+
+    Minutes are minutes of the week from Monday 00:00; see week_minute.
+    """
+    def __init__(self, spots=()):
+        self._hours = {}
+        self._schedule = None
+        for spot in spots:
+            self.add(spot)
+
+    def __len__(self):
+        return len(self._hours)
+
+    def add(self, spot):
+        """
+        Adds a spot, replacing any spot with the same spot_id.
+        """
+        self._hours[str(spot.spot_id)] = tuple(sorted(spot_hours(spot)))
+        self._schedule = None
+
+    def remove(self, spot_id):
+        if self._hours.pop(str(spot_id), None) is not None:
+            self._schedule = None
+
+    def update(self, changes):
+        """
+        Applies a list of SpotChanges from a SpotReplica.
+        """
+        for change in changes:
+            if change.spot is None:
+                self.remove(change.spot_id)
+            else:
+                self.add(change.spot)
+
+    def hours(self, spot_id):
+        """
+        Returns a spot's (start, end) hours, as listed by the server.
+        """
+        return self._hours.get(str(spot_id), ())
+
+    def _get_schedule(self):
+        schedule = self._schedule
+        if schedule is None:
+            schedule = self._schedule = self._build()
+        return schedule
+
+    def _build(self):
+        merged = {}
+        boundaries = set([0, MINUTES_PER_WEEK])
+        for spot_id, hours in self._hours.items():
+            intervals = merge_hours(hours)
+            merged[spot_id] = intervals
+            for start, end in intervals:
+                boundaries.add(start)
+                boundaries.add(end)
+
+        boundaries = sorted(boundaries)
+        segments = [[] for i in range(len(boundaries) - 1)]
+        for spot_id, intervals in merged.items():
+            for start, end in intervals:
+                closes = end
+                if end == MINUTES_PER_WEEK and intervals[0][0] == 0:
+                    # Open through the end of the week into Monday
+                    closes += intervals[0][1]
+                for segment in range(bisect_left(boundaries, start),
+                                     bisect_left(boundaries, end)):
+                    segments[segment].append((closes, spot_id))
+
+        built = []
+        for segment in segments:
+            segment.sort()
+            built.append((tuple(closes for closes, spot_id in segment),
+                          tuple(spot_id for closes, spot_id in segment),
+                          frozenset(spot_id for closes, spot_id in segment)))
+        return boundaries, built
+
+    def _segment(self, boundaries, minute):
+        return bisect_right(boundaries, minute % MINUTES_PER_WEEK) - 1
+
+    def open_at(self, minute):
+        """
+        Returns the frozenset of spot_ids open at the minute.
+        """
+        boundaries, segments = self._get_schedule()
+        return segments[self._segment(boundaries, minute)][2]
+
+    def open_between(self, start_minute, end_minute):
+        """
+        Returns the set of spot_ids open at some point from start_minute
+        through end_minute, like is_open_between.
+        """
+        if end_minute < start_minute:
+            return (self.open_between(start_minute, MINUTES_PER_WEEK - 1) |
+                    self.open_between(0, end_minute))
+
+        boundaries, segments = self._get_schedule()
+        first = self._segment(boundaries, start_minute)
+        last = self._segment(boundaries, min(end_minute,
+                                             MINUTES_PER_WEEK - 1))
+        spot_ids = set()
+        for segment in segments[first:last + 1]:
+            spot_ids.update(segment[2])
+        return spot_ids
+
+    def closing_soon(self, minute, within):
+        """
+        Returns (minutes until closing, spot_id) for the spots open at the
+        minute that close within the given number of minutes, soonest
+        first.
+        """
+        minute = minute % MINUTES_PER_WEEK
+        boundaries, segments = self._get_schedule()
+        closes, spot_ids, open_ids = segments[self._segment(boundaries,
+                                                            minute)]
+        count = bisect_right(closes, minute + within)
+        return [(closes[i] - minute, spot_ids[i]) for i in range(count)]
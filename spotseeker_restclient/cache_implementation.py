@@ -6,6 +6,16 @@ from spotseeker_restclient.models import CacheEntry, CacheEntryTimed
 from spotseeker_restclient.cache_manager import store_cache_entry
 from datetime import datetime, timedelta
 from django.utils.timezone import make_aware, get_current_timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from collections import OrderedDict
+from hashlib import sha1
+import threading
+import time
+import zlib
+import re
 
 
 class NoCache(object):
@@ -34,9 +44,8 @@ class TimedCache(object):
         now = make_aware(datetime.now(), get_current_timezone())
         time_limit = now - timedelta(seconds=max_age_in_seconds)
 
-        query = CacheEntryTimed.objects.filter(service=service,
-                                               url=url,
-                                               time_saved__gte=time_limit)
+        query = CacheEntryTimed.objects.for_url(service, url).filter(
+            time_saved__gte=time_limit)
 
         if len(query):
             hit = query[0]
@@ -44,6 +53,36 @@ class TimedCache(object):
             if hit.status != 200 and (
                     now - timedelta(seconds=max_error_age) > hit.time_saved):
                 return None
+            hit.touch()
+
+            response = MockHTTP()
+            response.status = hit.status
+            response.data = hit.content
+            response.headers = hit.getHeaders()
+
+            return {
+                "response": response,
+            }
+        return None
+
+    def _stale_response_from_cache(self, service, url, headers,
+                                   max_age_in_seconds):
+        """
+        Returns a successful response that is past max_age_in_seconds, but
+        not by more than the DAO_CACHE_MAX_STALE_AGE setting (1 day by
+        default).
+        """
+        max_stale_age = getattr(settings, "DAO_CACHE_MAX_STALE_AGE",
+                                60 * 60 * 24)
+        now = make_aware(datetime.now(), get_current_timezone())
+        time_limit = now - timedelta(seconds=max_age_in_seconds +
+                                     max_stale_age)
+
+        query = CacheEntryTimed.objects.for_url(service, url).filter(
+            status=200, time_saved__gte=time_limit)
+        if len(query):
+            hit = query[0]
+            hit.touch()
 
             response = MockHTTP()
             response.status = hit.status
@@ -58,8 +97,8 @@ class TimedCache(object):
     def _process_response(self, service, url, response,
                           overwrite_success_with_error_at=60 * 60 * 8):
         now = make_aware(datetime.now(), get_current_timezone())
-        query = CacheEntryTimed.objects.filter(service=service,
-                                               url=url)
+        # The body is only loaded if an error doesn't replace it
+        query = CacheEntryTimed.objects.for_url(service, url).defer("body")
 
         cache_entry = None
         if len(query):
@@ -112,6 +151,9 @@ class TimeSimpleCache(TimedCache):
     def getCache(self, service, url, headers):
         return self._response_from_cache(service, url, headers, 60)
 
+    def getStaleCache(self, service, url, headers):
+        return self._stale_response_from_cache(service, url, headers, 60)
+
     def processResponse(self, service, url, response):
         return self._process_response(service, url, response)
 
@@ -125,61 +167,374 @@ class FourHourCache(TimedCache):
     def getCache(self, service, url, headers):
         return self._response_from_cache(service, url, headers,  60 * 60 * 4)
 
+    def getStaleCache(self, service, url, headers):
+        return self._stale_response_from_cache(service, url, headers,
+                                               60 * 60 * 4)
+
     def processResponse(self, service, url, response):
         return self._process_response(service, url, response)
 
 
-class ETagCache(object):
+class MemoryStore(object):
     """
-    This caches objects just based on ETags.
+    A thread-safe LRU of decoded responses, bounded by total bytes, where
+    each entry expires ttl seconds after it was stored.
     """
-    def getCache(self, service, url, headers):
-        now = make_aware(datetime.now(), get_current_timezone())
-        time_limit = now - timedelta(seconds=60)
+    def __init__(self, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry["expires"] < time.time():
+                self.size -= entry["size"]
+                self.expirations += 1
+                self.misses += 1
+                return None
 
-        query = CacheEntry.objects.filter(service=service,
-                                          url=url)
+            # Re-insert so the entry moves to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
 
-        if len(query):
-            hit = query[0]
+        response = MockHTTP()
+        response.status = entry["status"]
+        response.data = entry["data"]
+        response.headers = dict(entry["headers"])
+        return response
 
-            response = MockHTTP()
-            response.status = hit.status
-            response.data = hit.content
+    def set(self, key, response):
+        headers = {}
+        for header in response.headers:
+            headers[header] = response.getheader(header)
 
-            hit_headers = hit.getHeaders()
+        size = len(response.data or "")
+        for header in headers:
+            size += len(header) + len(str(headers[header]))
 
-            if "ETag" in hit_headers:
-                headers["If-None-Match"] = hit_headers["ETag"]
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old["size"]
+
+            self._entries[key] = {
+                "status": response.status,
+                "data": response.data,
+                "headers": headers,
+                "size": size,
+                "expires": time.time() + self.ttl,
+            }
+            self.size += size
+
+            while self.size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= evicted["size"]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class MemoryCache(object):
+    """
+    Serves successful responses from an in-process LRU for ttl seconds,
+    falling back to the database-backed FourHourCache on a miss.  The
+    memory tier is shared by every instance in the process, and is sized
+    with the SPOTSEEKER_MEMORY_CACHE_TTL and
+    SPOTSEEKER_MEMORY_CACHE_MAX_BYTES settings.
+    """
+    fallback_class = FourHourCache
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    @classmethod
+    def get_store(cls):
+        store = cls._stores.get(cls)
+        if store is None:
+            with cls._stores_lock:
+                store = cls._stores.get(cls)
+                if store is None:
+                    store = MemoryStore(
+                        getattr(settings, "SPOTSEEKER_MEMORY_CACHE_TTL", 60),
+                        getattr(settings, "SPOTSEEKER_MEMORY_CACHE_MAX_BYTES",
+                                1024 * 1024 * 10))
+                    cls._stores[cls] = store
+        return store
+
+    @classmethod
+    def reset(cls):
+        with cls._stores_lock:
+            cls._stores.pop(cls, None)
+
+    def getCache(self, service, url, headers):
+        store = self.get_store()
+        response = store.get((service, url))
+        if response is not None:
+            return {"response": response}
 
+        cache_response = self.fallback_class().getCache(service, url, headers)
+        if cache_response is not None and "response" in cache_response:
+            if cache_response["response"].status == 200:
+                store.set((service, url), cache_response["response"])
+        return cache_response
+
+    def getStaleCache(self, service, url, headers):
+        fallback = self.fallback_class()
+        if hasattr(fallback, "getStaleCache"):
+            return fallback.getStaleCache(service, url, headers)
         return None
 
     def processResponse(self, service, url, response):
-        query = CacheEntryTimed.objects.filter(service=service,
-                                               url=url)
+        cache_post_response = self.fallback_class().processResponse(
+            service, url, response)
+
+        if cache_post_response is not None and \
+                "response" in cache_post_response:
+            response = cache_post_response["response"]
+
+        if response.status == 200:
+            self.get_store().set((service, url), response)
+
+        return cache_post_response
+
+
+class DjangoCache(object):
+    """
+    Caches responses in one of Django's configured CACHES, so any of its
+    backends (locmem, filebased, memcached, ...) can be used.  Settings:
+
+    SPOTSEEKER_CACHE_ALIAS: the CACHES alias to use, "default" by default.
+    SPOTSEEKER_CACHE_TTLS: a list of (url regex, seconds) pairs; the first
+        matching pattern sets how long a url is cached.
+    SPOTSEEKER_CACHE_DEFAULT_TTL: seconds for urls matching no pattern,
+        4 hours by default.
+    SPOTSEEKER_CACHE_COMPRESS_MIN_BYTES: bodies at least this long are
+        stored zlib compressed, 16KB by default.
+    """
+    max_error_age = 60 * 5
+
+    def _cache(self):
+        return caches[getattr(settings, "SPOTSEEKER_CACHE_ALIAS", "default")]
+
+    def _key(self, service, url):
+        # Hashed, as memcached keys are limited to 250 characters
+        return "spotseeker_restclient:%s:%s" % (service, sha1(url).hexdigest())
+
+    def _ttl(self, url):
+        for pattern, ttl in getattr(settings, "SPOTSEEKER_CACHE_TTLS", []):
+            if re.search(pattern, url):
+                return ttl
+        return getattr(settings, "SPOTSEEKER_CACHE_DEFAULT_TTL", 60 * 60 * 4)
 
-        cache_entry = CacheEntryTimed()
+    def _get_entry(self, service, url):
+        entry = self._cache().get(self._key(service, url))
+        if entry is None or entry["url"] != url:
+            return None
+
+        response = MockHTTP()
+        response.status = entry["status"]
+        response.headers = entry["headers"]
+        if entry["compressed"]:
+            response.data = zlib.decompress(entry["data"])
+        else:
+            response.data = entry["data"]
+        return response
+
+    def getCache(self, service, url, headers):
+        response = self._get_entry(service, url)
+        if response is None:
+            return None
+        return {"response": response}
+
+    def processResponse(self, service, url, response):
+        ttl = self._ttl(url)
+        if not ttl:
+            return
+
+        if response.status != 200:
+            # Don't replace a cached success with an error
+            cached = self._get_entry(service, url)
+            if cached is not None and cached.status == 200:
+                return {"response": cached}
+            ttl = min(ttl, self.max_error_age)
+
+        header_data = {}
+        for header in response.headers:
+            header_data[header] = response.getheader(header)
+
+        data = response.data or ""
+        compressed = len(data) >= getattr(
+            settings, "SPOTSEEKER_CACHE_COMPRESS_MIN_BYTES", 1024 * 16)
+        if compressed:
+            data = zlib.compress(data)
+
+        self._cache().set(self._key(service, url), {
+            "url": url,
+            "status": response.status,
+            "headers": header_data,
+            "data": data,
+            "compressed": compressed,
+        }, ttl)
+
+
+@receiver(setting_changed)
+def _memory_settings_changed(sender, setting, **kwargs):
+    if setting in ("SPOTSEEKER_MEMORY_CACHE_TTL",
+                   "SPOTSEEKER_MEMORY_CACHE_MAX_BYTES"):
+        with MemoryCache._stores_lock:
+            MemoryCache._stores.clear()
+
+
+class ETagCache(object):
+    """
+    This caches objects just based on ETags and Last-Modified dates.
+    Requests for a cached url are sent with If-None-Match and
+    If-Modified-Since, and a 304 is answered with the cached body.
+
+    The counters from stats() are process-wide: "misses" are requests sent
+    without a cached validator, "revalidations" are conditional requests,
+    and "hits" are revalidations answered by a 304.
+    """
+    _counts = {"hits": 0, "revalidations": 0, "misses": 0}
+    _counts_lock = threading.Lock()
+
+    @classmethod
+    def _count(cls, name):
+        with cls._counts_lock:
+            cls._counts[name] += 1
+
+    @classmethod
+    def stats(cls):
+        with cls._counts_lock:
+            return dict(cls._counts)
+
+    @classmethod
+    def reset_stats(cls):
+        with cls._counts_lock:
+            for name in cls._counts:
+                cls._counts[name] = 0
+
+    def _get_entry(self, service, url, defer_body=False):
+        query = CacheEntry.objects.for_url(service, url)
+        if defer_body:
+            query = query.defer("body")
         if len(query):
-            cache_entry = query[0]
+            return query[0]
+        return None
+
+    def _response_from_entry(self, entry):
+        response = MockHTTP()
+        response.status = entry.status
+        response.data = entry.content
+        response.headers = entry.getHeaders()
+        return response
+
+    def getCache(self, service, url, headers):
+        entry = self._get_entry(service, url, defer_body=True)
+        if entry is None:
+            self._count("misses")
+            return None
+
+        cached = MockHTTP()
+        cached.headers = entry.getHeaders()
+        etag = cached.getheader("ETag")
+        last_modified = cached.getheader("Last-Modified")
+        if not etag and not last_modified:
+            self._count("misses")
+            return None
+
+        headers = dict(headers)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        self._count("revalidations")
+        return {"headers": headers}
+
+    def getStaleCache(self, service, url, headers):
+        """
+        Returns the cached response without revalidating it, if it was
+        stored within the DAO_CACHE_MAX_STALE_AGE setting (1 day by
+        default).
+        """
+        entry = self._get_entry(service, url)
+        if entry is None or entry.time_stored is None:
+            return None
+
+        max_stale_age = getattr(settings, "DAO_CACHE_MAX_STALE_AGE",
+                                60 * 60 * 24)
+        now = make_aware(datetime.now(), get_current_timezone())
+        if entry.time_stored < now - timedelta(seconds=max_stale_age):
+            return None
+        return {"response": self._response_from_entry(entry)}
+
+    def processResponse(self, service, url, response):
+        entry = self._get_entry(service, url)
 
         if response.status == 304:
-            if cache_entry is None:
+            if entry is None:
                 raise Exception("304, but no content??")
 
-            response = MockHTTP()
-            response.status = cache_entry.status
-            response.data = cache_entry.content
-            response.headers = cache_entry.headers
-            return {"response": response}
-        else:
-            now = make_aware(datetime.now(), get_current_timezone())
-            cache_entry.service = service
-            cache_entry.url = url
-            cache_entry.status = response.status
-            cache_entry.content = response.data
-
-            cache_entry.headers = response.headers
-            cache_entry.time_saved = now
-            store_cache_entry(cache_entry)
+            self._count("hits")
+            entry.touch()
+            return {"response": self._response_from_entry(entry)}
+
+        if response.status != 200:
+            return
+
+        header_data = {}
+        for header in response.headers:
+            header_data[header] = response.getheader(header)
+
+        if not (response.getheader("ETag") or
+                response.getheader("Last-Modified")):
+            # Nothing to revalidate with, so don't keep the body
+            if entry is not None:
+                entry.delete()
+            return
+
+        if entry is None:
+            entry = CacheEntry()
+
+        entry.service = service
+        entry.url = url
+        entry.status = response.status
+        entry.content = response.data
+        entry.headers = header_data
+
+        try:
+            store_cache_entry(entry)
+        except Exception as ex:
+            # If someone beat us in to saving a cache entry, that's ok.
+            return
 
         return
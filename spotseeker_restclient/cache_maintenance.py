@@ -0,0 +1,139 @@
+"""
+Keeps the database cache tables bounded: entries past a maximum age are
+expired, then the least recently used entries are evicted until the
+tables are within a row and byte budget.
+
+Run it with the sweep_cache management command, or in-process every
+SPOTSEEKER_CACHE_SWEEP_INTERVAL seconds; the sweeper thread starts with
+the first cache write once that is set.
+"""
+from spotseeker_restclient.models import CacheEntry
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import threading
+import time
+
+
+DELETE_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def sweep(max_age=None, max_entries=None, max_bytes=None, dry_run=False):
+    """
+    Removes cache entries stored more than max_age seconds ago, then the
+    least recently read entries until at most max_entries entries and
+    max_bytes bytes remain.  Each limit defaults to the
+    SPOTSEEKER_CACHE_MAX_AGE, SPOTSEEKER_CACHE_MAX_ENTRIES and
+    SPOTSEEKER_CACHE_MAX_BYTES setting; None means no limit.
+
+    Returns a dict reporting the entries and bytes expired and evicted,
+    and what remains.  With dry_run, nothing is deleted.
+    """
+    if max_age is None:
+        max_age = getattr(settings, "SPOTSEEKER_CACHE_MAX_AGE", None)
+    if max_entries is None:
+        max_entries = getattr(settings, "SPOTSEEKER_CACHE_MAX_ENTRIES", None)
+    if max_bytes is None:
+        max_bytes = getattr(settings, "SPOTSEEKER_CACHE_MAX_BYTES", None)
+
+    report = {
+        "expired": 0,
+        "expired_bytes": 0,
+        "evicted": 0,
+        "evicted_bytes": 0,
+    }
+
+    removed = set()
+    if max_age is not None:
+        oldest = timezone.now() - timedelta(seconds=max_age)
+        for pk, size in CacheEntry.objects.filter(
+                time_stored__lt=oldest).values_list("pk", "size"):
+            removed.add(pk)
+            report["expired"] += 1
+            report["expired_bytes"] += size
+
+    totals = CacheEntry.objects.aggregate(entries=Count("pk"),
+                                          bytes=Sum("size"))
+    entries = totals["entries"] - report["expired"]
+    size = (totals["bytes"] or 0) - report["expired_bytes"]
+
+    if (max_entries is not None and entries > max_entries) or \
+            (max_bytes is not None and size > max_bytes):
+        # Entries never read since the migration sort first
+        least_recent = CacheEntry.objects.order_by(
+            "time_accessed", "pk").values_list("pk", "size")
+        for pk, entry_size in least_recent.iterator():
+            if (max_entries is None or entries <= max_entries) and \
+                    (max_bytes is None or size <= max_bytes):
+                break
+            if pk in removed:
+                continue
+            removed.add(pk)
+            entries -= 1
+            size -= entry_size
+            report["evicted"] += 1
+            report["evicted_bytes"] += entry_size
+
+    if not dry_run:
+        _delete(sorted(removed))
+
+    report["entries"] = entries
+    report["bytes"] = size
+    if removed:
+        logger.info("Cache sweep%s: expired %s entries (%s bytes), evicted "
+                    "%s entries (%s bytes); %s entries (%s bytes) remain",
+                    " (dry run)" if dry_run else "",
+                    report["expired"], report["expired_bytes"],
+                    report["evicted"], report["evicted_bytes"],
+                    entries, size)
+    return report
+
+
+def _delete(pks):
+    # In batches, to keep IN lists and lock times short.  Deleting the
+    # CacheEntry rows deletes CacheEntryTimed etc. with them.
+    for start in range(0, len(pks), DELETE_BATCH_SIZE):
+        CacheEntry.objects.filter(
+            pk__in=pks[start:start + DELETE_BATCH_SIZE]).delete()
+
+
+def start_sweeper():
+    """
+    Starts the background sweeper, if SPOTSEEKER_CACHE_SWEEP_INTERVAL is
+    set and it isn't already running.
+    """
+    global _sweeper
+    if getattr(settings, "SPOTSEEKER_CACHE_SWEEP_INTERVAL", None) is None:
+        return
+    if _sweeper is not None and _sweeper.is_alive():
+        return
+
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return
+        _sweeper = threading.Thread(target=_sweep_periodically,
+                                    name="spotseeker cache sweeper")
+        _sweeper.daemon = True
+        _sweeper.start()
+
+
+def _sweep_periodically():
+    while True:
+        interval = getattr(settings, "SPOTSEEKER_CACHE_SWEEP_INTERVAL", None)
+        if interval is None:
+            return
+        time.sleep(interval)
+        try:
+            sweep()
+        except Exception as ex:
+            logger.error("Error sweeping the cache: %s", ex)
+        finally:
+            connection.close()
@@ -2,49 +2,292 @@
 This is a class that makes it possible to bulk-save cache entries.
 For restclients methods that use threading, this can be used to prevent
 innodb gap locks from deadlocking sequential inserts.
+
+Writes can be queued three ways:
+
+    with queued_cache_writes():
+        ...
+
+queues the writes made on the current thread until the block exits;
+enable_cache_entry_queueing() / disable_cache_entry_queueing() queue every
+thread's writes in between; and with SPOTSEEKER_CACHE_WRITE_BEHIND set,
+writes are always queued and saved by a background thread, once
+SPOTSEEKER_CACHE_WRITE_BATCH_SIZE entries are waiting or every
+SPOTSEEKER_CACHE_WRITE_INTERVAL seconds.
 """
 
-from django.db import IntegrityError
+from spotseeker_restclient.models import CacheEntry
+from spotseeker_restclient.cache_maintenance import start_sweeper
+from django.conf import settings
+from django.db import connection, transaction
+from collections import OrderedDict
+from contextlib import contextmanager
+import atexit
+import logging
+import threading
 
 
-__manage_bulk_inserts = False
-__bulk_insert_queue = []
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_RETRIES = 2
+DEFAULT_WRITE_INTERVAL = 5
 
+logger = logging.getLogger(__name__)
 
-def store_cache_entry(entry):
-    global __manage_bulk_inserts
-    global __bulk_insert_queue
 
-    if __manage_bulk_inserts:
-        __bulk_insert_queue.append(entry)
-        return
+class EntryQueue(object):
+    """
+    Cache entries waiting to be saved.  Only the newest entry for each
+    (service, url) is kept.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entry):
+        """
+        Queues an entry, returning the number of entries queued.
+        """
+        key = (entry.service, entry.url)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            return len(self._entries)
+
+    def take(self):
+        """
+        Empties the queue, returning the entries in it, oldest first.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        return entries
+
+
+_shared_queue = EntryQueue()
+_local = threading.local()
+_manage_bulk_inserts = False
+
+_writer = None
+_writer_lock = threading.Lock()
+_writer_wakeup = threading.Event()
+_writer_stopping = False
+
+
+def store_cache_entry(entry):
+    start_sweeper()
+    queue = getattr(_local, "queue", None)
+    if queue is not None:
+        queue.add(entry)
+    elif _manage_bulk_inserts:
+        _shared_queue.add(entry)
+    elif getattr(settings, "SPOTSEEKER_CACHE_WRITE_BEHIND", False):
+        queued = _shared_queue.add(entry)
+        _start_writer()
+        if queued >= _batch_size():
+            _writer_wakeup.set()
     else:
         entry.save()
 
 
-def save_all_queued_entries():
-    global __bulk_insert_queue
+def _batch_size():
+    return getattr(settings, "SPOTSEEKER_CACHE_WRITE_BATCH_SIZE",
+                   DEFAULT_BATCH_SIZE)
+
+
+def save_entries(entries):
+    """
+    Saves cache entries in batches of SPOTSEEKER_CACHE_WRITE_BATCH_SIZE,
+    each batch in one transaction.  A batch that fails is retried up to
+    SPOTSEEKER_CACHE_WRITE_RETRIES times, then saved an entry at a time
+    so that one bad entry doesn't lose the rest.  Returns the number of
+    entries saved.
+
+    Rows already stored for an entry's url are replaced, not updated:
+    they are deleted and the entry is inserted in their place.  Columns
+    come only from the entry, and an entry that wasn't read from the
+    database gets a new primary key.
+    """
+    batch_size = _batch_size()
+    saved = 0
+    for start in range(0, len(entries), batch_size):
+        saved += _save_batch(entries[start:start + batch_size])
+    return saved
+
+
+def _save_batch(batch):
+    retries = getattr(settings, "SPOTSEEKER_CACHE_WRITE_RETRIES",
+                      DEFAULT_RETRIES)
+    keys = [_primary_keys(entry) for entry in batch]
+
+    for attempt in range(retries + 1):
+        try:
+            with transaction.atomic():
+                _write_batch(batch)
+            return len(batch)
+        except Exception as ex:
+            logger.warning("Error saving %s cache entries, attempt %s: %s",
+                           len(batch), attempt + 1, ex)
+            # Keys assigned before the rollback don't exist any more
+            for entry, entry_keys in zip(batch, keys):
+                _set_primary_keys(entry, entry_keys)
+
+    saved = 0
+    for entry in batch:
+        try:
+            with transaction.atomic():
+                _write_batch([entry])
+            saved += 1
+        except Exception as ex:
+            logger.error("Error saving cache entry for %s: %s", entry.url, ex)
+    return saved
+
+
+def _primary_keys(entry):
+    # Includes the parent model's key, for CacheEntryTimed etc.
+    return [(field.attname, getattr(entry, field.attname))
+            for field in entry._meta.concrete_fields if field.primary_key]
 
-    seen_urls = {}
-    bulk_create = []
 
+def _set_primary_keys(entry, keys):
+    for attname, value in keys:
+        setattr(entry, attname, value)
+
+
+def _write_batch(batch):
+    by_model = OrderedDict()
+    for entry in batch:
+        # Not type(entry), which is a proxy for entries loaded with
+        # defer()
+        by_model.setdefault(entry._meta.concrete_model, []).append(entry)
+
+    for model, entries in by_model.items():
+        for entry in entries:
+            entry.serialize()
+
+        # Rows already saved for these urls are replaced rather than
+        # updated one at a time; see save_entries.  Deleting the
+        # CacheEntry row deletes a CacheEntryTimed etc. row with it.
+        CacheEntry.objects.filter(
+            key__in=[entry.key for entry in entries]).delete()
+
+        if model._meta.parents:
+            _bulk_create_inherited(model, entries)
+        else:
+            model.objects.bulk_create(entries)
+
+
+def _bulk_create_inherited(model, entries):
+    """
+    bulk_create() for CacheEntryTimed etc., which Django doesn't do for
+    multi-table inherited models: bulk creates the CacheEntry rows, looks
+    up the keys they were given, then inserts the model's own rows with
+    one executemany().
+    """
+    (parent, link), = model._meta.parents.items()
+    parent_fields = parent._meta.concrete_fields
+    parent.objects.bulk_create([
+        parent(**dict((field.attname, getattr(entry, field.attname))
+                      for field in parent_fields))
+        for entry in entries])
+
+    ids = dict(parent.objects.filter(
+        key__in=[entry.key for entry in entries]).values_list("key", "pk"))
+    for entry in entries:
+        setattr(entry, parent._meta.pk.attname, ids[entry.key])
+        setattr(entry, link.attname, ids[entry.key])
+
+    fields = model._meta.local_concrete_fields
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        quote(model._meta.db_table),
+        ", ".join(quote(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(entry, field.attname),
+                                    connection)
+             for field in fields]
+            for entry in entries])
+
+
+@contextmanager
+def queued_cache_writes():
+    """
+    Queues the cache writes made on this thread inside the block, and
+    saves them in batches when the outermost block exits.
+    """
+    if getattr(_local, "queue", None) is not None:
+        yield
+        return
+
+    _local.queue = EntryQueue()
     try:
-        for entry in __bulk_insert_queue:
-            if entry.url not in seen_urls:
-                entry.save()
-                seen_urls[entry.url] = True
-    except Exception as ex:
-        print "Error bulk saving cache entries: ", ex
+        yield
+    finally:
+        queue = _local.queue
+        _local.queue = None
+        save_entries(queue.take())
+
 
-    __bulk_insert_queue = []
+def save_all_queued_entries():
+    """
+    Saves the entries queued by enable_cache_entry_queueing or for the
+    background writer.
+    """
+    return save_entries(_shared_queue.take())
 
 
 def enable_cache_entry_queueing():
-    global __manage_bulk_inserts
-    __manage_bulk_inserts = True
+    global _manage_bulk_inserts
+    _manage_bulk_inserts = True
 
 
 def disable_cache_entry_queueing():
-    global __manage_bulk_inserts
-    __manage_bulk_inserts = False
+    global _manage_bulk_inserts
+    _manage_bulk_inserts = False
     save_all_queued_entries()
+
+
+def _start_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+
+    with _writer_lock:
+        if _writer is not None and _writer.is_alive():
+            return
+        if _writer is None:
+            atexit.register(_stop_writer)
+        _writer = threading.Thread(target=_write_behind,
+                                   name="spotseeker cache writer")
+        _writer.daemon = True
+        _writer.start()
+
+
+def _write_behind():
+    while not _writer_stopping:
+        _writer_wakeup.wait(getattr(settings,
+                                    "SPOTSEEKER_CACHE_WRITE_INTERVAL",
+                                    DEFAULT_WRITE_INTERVAL))
+        _writer_wakeup.clear()
+        if len(_shared_queue):
+            try:
+                save_all_queued_entries()
+            except Exception as ex:
+                logger.error("Error in the cache writer: %s", ex)
+            finally:
+                connection.close()
+
+
+def _stop_writer():
+    """
+    Stops the background writer at exit, saving whatever is still queued.
+    """
+    global _writer_stopping
+    _writer_stopping = True
+    _writer_wakeup.set()
+    if _writer is not None:
+        _writer.join(10)
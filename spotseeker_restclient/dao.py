@@ -1,13 +1,118 @@
 from importlib import import_module
+import threading
+import time
 from django.conf import settings
+from django.db import connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.core.exceptions import *
 from spotseeker_restclient.cache_implementation import NoCache
+from spotseeker_restclient import instrumentation
+from spotseeker_restclient.deadline import remaining
+from spotseeker_restclient.scheduler import current_priority, priority
+from spotseeker_restclient.exceptions import CircuitOpenException, \
+    DeadlineExceededException
 from spotseeker_restclient.dao_implementation.spotseeker import File \
     as SpotseekerFile
 
 
+class _Flight(object):
+    """
+    A single upstream request, shared by every caller that asks for the
+    same url while it is in flight.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _single_flight(key, fetch):
+    """
+    Runs fetch() unless a fetch for key is already in flight, in which case
+    this waits for that one and returns its response.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _Flight()
+            _flights[key] = flight
+
+    if not is_leader:
+        # Only as long as this thread's deadline allows
+        if not flight.done.wait(remaining()):
+            raise DeadlineExceededException(key[1])
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    try:
+        flight.response = fetch()
+    except Exception as ex:
+        flight.error = ex
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+    return flight.response
+
+
+def _refresh(key, fetch, request_priority):
+    try:
+        with priority(request_priority):
+            _single_flight(key, fetch)
+    except Exception:
+        # The stale response has already been served; the next request
+        # will try again.
+        pass
+    finally:
+        connection.close()
+
+
+def _refresh_in_background(key, fetch):
+    with _flights_lock:
+        if key in _flights:
+            return None
+
+    thread = threading.Thread(target=_refresh,
+                              args=(key, fetch, current_priority()))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+_modules = {}
+
+
+@receiver(setting_changed)
+def _clear_modules(sender, setting, **kwargs):
+    for key in list(_modules.keys()):
+        if key[0] == setting:
+            _modules.pop(key, None)
+
+
 class DAO_BASE(object):
     def _getModule(self, settings_key, default_class):
+        """
+        Returns the instance of the class named by settings_key, or of
+        default_class.  Instances are shared, and are resolved again after
+        a setting_changed signal for the key (e.g. from override_settings).
+        """
+        key = (settings_key, default_class)
+        instance = _modules.get(key)
+        if instance is None:
+            instance = self._loadModule(settings_key, default_class)
+            _modules[key] = instance
+        return instance
+
+    def _loadModule(self, settings_key, default_class):
         if hasattr(settings, settings_key):
             # This is all taken from django's static file finder
             module, attr = getattr(settings, settings_key).rsplit('.', 1)
@@ -31,38 +136,120 @@ class MY_DAO(DAO_BASE):
         return self._getModule('DAO_CACHE_CLASS', NoCache)
 
     def _getURL(self, service, url, headers):
+        if not instrumentation.hooks():
+            return self._cachedGetURL(service, url, headers)[0]
+
+        start = time.time()
+        try:
+            response, outcome = self._cachedGetURL(service, url, headers)
+        except Exception as ex:
+            instrumentation.record_request(service, "GET", url, start,
+                                           error=ex)
+            raise
+        instrumentation.record_request(service, "GET", url, start,
+                                       response, outcome)
+        return response
+
+    def _cachedGetURL(self, service, url, headers):
+        """
+        Returns the response, and how the cache provided it: "hit",
+        "stale", "revalidated" or "miss".
+        """
         dao = self._getDAO()
         cache = self._getCache()
         cache_response = cache.getCache(service, url, headers)
         if cache_response is not None:
             if "response" in cache_response:
-                return cache_response["response"]
+                return cache_response["response"], "hit"
             if "headers" in cache_response:
                 headers = cache_response["headers"]
 
+        def fetch():
+            return self._fetchURL(dao, cache, service, url, headers)
+
+        key = (service, url)
+
+        # With DAO_CACHE_STALE_WHILE_REVALIDATE, an expired entry the cache
+        # can still provide is served while it is refreshed in a thread.
+        if getattr(settings, "DAO_CACHE_STALE_WHILE_REVALIDATE", False) and \
+                hasattr(cache, "getStaleCache"):
+            stale_response = cache.getStaleCache(service, url, headers)
+            if stale_response is not None and "response" in stale_response:
+                _refresh_in_background(key, fetch)
+                return stale_response["response"], "stale"
+
+        try:
+            if getattr(settings, "DAO_COALESCE_REQUESTS", True):
+                return _single_flight(key, fetch)
+            return fetch()
+        except CircuitOpenException:
+            # Fail fast, but with the last cached response if there is one
+            if getattr(settings, "SPOTSEEKER_BREAKER_SERVE_CACHED", True) \
+                    and hasattr(cache, "getStaleCache"):
+                stale_response = cache.getStaleCache(service, url, headers)
+                if stale_response is not None and \
+                        "response" in stale_response:
+                    return stale_response["response"], "stale"
+            raise
+
+    def _fetchURL(self, dao, cache, service, url, headers):
         response = dao.getURL(url, headers)
 
         cache_post_response = cache.processResponse(service, url, response)
 
         if cache_post_response is not None:
             if "response" in cache_post_response:
-                return cache_post_response["response"]
+                if response.status == 304:
+                    return cache_post_response["response"], "revalidated"
+                return cache_post_response["response"], "miss"
 
-        return response
+        return response, "miss"
+
+    def _streamURL(self, service, url, headers):
+        """
+        Returns a response whose body can be read incrementally with
+        response.stream().  A cached response is used if there is one, but
+        streamed responses aren't added to the cache, and no conditional
+        request is made, as a 304 would leave nothing to stream.
+        """
+        dao = self._getDAO()
+        cache = self._getCache()
+        cache_response = cache.getCache(service, url, headers)
+        if cache_response is not None and "response" in cache_response:
+            return cache_response["response"]
+
+        if hasattr(dao, "streamURL"):
+            return dao.streamURL(url, headers)
+        return dao.getURL(url, headers)
 
     def _postURL(self, service, url, headers, body=None):
         dao = self._getDAO()
-        response = dao.postURL(url, headers, body)
-        return response
+        return self._request(service, "POST", url, dao.postURL,
+                             url, headers, body)
 
     def _deleteURL(self, service, url, headers):
         dao = self._getDAO()
-        response = dao.deleteURL(url, headers, "")
-        return response
+        return self._request(service, "DELETE", url, dao.deleteURL,
+                             url, headers, "")
 
     def _putURL(self, service, url, headers, body=None):
         dao = self._getDAO()
-        response = dao.putURL(url, headers, body)
+        return self._request(service, "PUT", url, dao.putURL,
+                             url, headers, body)
+
+    def _request(self, service, method, url, send, *args):
+        if not instrumentation.hooks():
+            return send(*args)
+
+        start = time.time()
+        try:
+            response = send(*args)
+        except Exception as ex:
+            instrumentation.record_request(service, method, url, start,
+                                           error=ex)
+            raise
+        instrumentation.record_request(service, method, url, start,
+                                       response)
         return response
 
 
@@ -70,6 +257,9 @@ class SPOTSEEKER_DAO(MY_DAO):
     def getURL(self, url, headers):
         return self._getURL('spotseeker', url, headers)
 
+    def streamURL(self, url, headers):
+        return self._streamURL('spotseeker', url, headers)
+
     def putURL(self, url, headers, body):
         return self._putURL('spotseeker', url, headers, body)
 
@@ -3,20 +3,338 @@ Provides access to the http connection pools and
 connections for live data from a web service
 
 """
+import logging
+import Queue
+import random
+import threading
+import time
 import oauth2
+import urllib3
+from urlparse import urlparse, urlunparse, parse_qs
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver, Signal
+from spotseeker_restclient.deadline import get_deadline, remaining
+from spotseeker_restclient.exceptions import CircuitOpenException, \
+    DeadlineExceededException
+from spotseeker_restclient.instrumentation import Histogram
+from spotseeker_restclient.scheduler import get_scheduler, current_priority, \
+    priority
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_HOSTS = 10
+DEFAULT_CONNECT_TIMEOUT = 3
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_OPEN_SECONDS = 30
+DEFAULT_GET_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.05
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+LATENCY_REFRESH = 20
+RETRY_STATUSES = (502, 503, 504)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+_pool_manager = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_waiting = [0]
+_breakers = {}
+_breakers_lock = threading.Lock()
+_latencies = {}
+
+logger = logging.getLogger(__name__)
+
+# Sent with host, old_state and new_state when a circuit breaker changes
+# state
+circuit_state_changed = Signal(providing_args=["host", "old_state",
+                                               "new_state"])
+
+
+class _CountingPoolMixin(object):
+    """
+    Keeps track of how many threads are currently waiting to check a
+    connection out of the pool.
+    """
+    def _get_conn(self, timeout=None):
+        with _stats_lock:
+            _waiting[0] += 1
+        try:
+            return super(_CountingPoolMixin, self)._get_conn(timeout=timeout)
+        finally:
+            with _stats_lock:
+                _waiting[0] -= 1
+
+
+class _HTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _HTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+def get_pool_manager():
+    """
+    Returns the process-wide keep-alive pool manager, creating it on first
+    use from the SPOTSEEKER_POOL_* and SPOTSEEKER_*_TIMEOUT settings.
+    """
+    global _pool_manager
+
+    if _pool_manager is None:
+        with _pool_lock:
+            if _pool_manager is None:
+                timeout = urllib3.Timeout(
+                    connect=getattr(settings, 'SPOTSEEKER_CONNECT_TIMEOUT',
+                                    DEFAULT_CONNECT_TIMEOUT),
+                    read=getattr(settings, 'SPOTSEEKER_READ_TIMEOUT',
+                                 DEFAULT_READ_TIMEOUT))
+                manager = urllib3.PoolManager(
+                    num_pools=getattr(settings, 'SPOTSEEKER_POOL_HOSTS',
+                                      DEFAULT_POOL_HOSTS),
+                    maxsize=getattr(settings, 'SPOTSEEKER_POOL_SIZE',
+                                    DEFAULT_POOL_SIZE),
+                    block=True,
+                    timeout=timeout,
+                    retries=urllib3.Retry(total=1, read=False,
+                                          redirect=False))
+                manager.pool_classes_by_scheme = {
+                    'http': _HTTPConnectionPool,
+                    'https': _HTTPSConnectionPool,
+                }
+                _pool_manager = manager
+    return _pool_manager
+
+
+def reset_pool_manager():
+    """
+    Closes every pooled connection.  The next request builds a new pool,
+    picking up any changed settings.
+    """
+    global _pool_manager
+
+    with _pool_lock:
+        if _pool_manager is not None:
+            _pool_manager.clear()
+        _pool_manager = None
+
+
+@receiver(setting_changed)
+def _settings_changed(sender, setting, **kwargs):
+    if setting in ('SPOTSEEKER_POOL_SIZE', 'SPOTSEEKER_POOL_HOSTS',
+                   'SPOTSEEKER_CONNECT_TIMEOUT', 'SPOTSEEKER_READ_TIMEOUT'):
+        reset_pool_manager()
+    elif setting in ('SPOTSEEKER_BREAKER_FAILURES',
+                     'SPOTSEEKER_BREAKER_OPEN_SECONDS'):
+        reset_circuit_breakers()
+
+
+class CircuitBreaker(object):
+    """
+    Tracks failures for one host.  After failure_threshold consecutive
+    failures (errors or 5xx responses) the breaker opens, and requests
+    fail immediately for open_seconds.  Then it is half-open: one request
+    is let through as a probe, and its result closes the breaker or opens
+    it again.
+    """
+    def __init__(self, host, failure_threshold, open_seconds):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Returns whether a request may be made now.
+        """
+        changed = None
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.open_seconds:
+                    return False
+                changed = self._set_state(HALF_OPEN)
+            allowed = not self._probing
+            self._probing = True
+        self._notify(changed)
+        return allowed
+
+    def cancel_request(self):
+        """
+        Gives back a request allowed by allow_request that wasn't sent,
+        so a half-open breaker can let another probe through.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        changed = None
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                changed = self._set_state(CLOSED)
+        self._notify(changed)
+
+    def record_failure(self):
+        changed = None
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and
+                    self.failures >= self.failure_threshold):
+                self.opened_at = time.time()
+                changed = self._set_state(OPEN)
+        self._notify(changed)
+
+    def _set_state(self, state):
+        changed = (self.state, state)
+        self.state = state
+        return changed
+
+    def _notify(self, changed):
+        if changed is None:
+            return
+        old_state, new_state = changed
+        if new_state == OPEN:
+            logger.warning("Circuit breaker for %s opened after %s failures",
+                           self.host, self.failures)
+        else:
+            logger.info("Circuit breaker for %s is %s", self.host, new_state)
+        circuit_state_changed.send(sender=CircuitBreaker, host=self.host,
+                                   old_state=old_state, new_state=new_state)
+
+
+def get_circuit_breaker(host):
+    """
+    Returns the circuit breaker for host, or None if the
+    SPOTSEEKER_BREAKER_FAILURES setting is 0 or None.
+    """
+    breaker = _breakers.get(host)
+    if breaker is None:
+        failures = getattr(settings, 'SPOTSEEKER_BREAKER_FAILURES',
+                           DEFAULT_BREAKER_FAILURES)
+        if not failures:
+            return None
+        with _breakers_lock:
+            breaker = _breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    host, failures,
+                    getattr(settings, 'SPOTSEEKER_BREAKER_OPEN_SECONDS',
+                            DEFAULT_BREAKER_OPEN_SECONDS))
+                _breakers[host] = breaker
+    return breaker
+
+
+def get_circuit_states():
+    """
+    Returns a dict of host to its circuit breaker's state.
+    """
+    return dict((host, breaker.state)
+                for host, breaker in list(_breakers.items()))
+
+
+def reset_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def get_pool_stats():
+    """
+    Returns a dict of statistics for the connection pools: the number of
+    host pools, connections opened, requests made, requests that reused an
+    existing connection, idle connections and threads waiting on the pool.
+    """
+    stats = {
+        'pools': 0,
+        'connections_opened': 0,
+        'connections_reused': 0,
+        'requests': 0,
+        'idle': 0,
+        'waiting': _waiting[0],
+    }
+
+    manager = _pool_manager
+    if manager is None:
+        return stats
+
+    for key in list(manager.pools.keys()):
+        pool = manager.pools.get(key)
+        if pool is None:
+            continue
+        stats['pools'] += 1
+        stats['connections_opened'] += pool.num_connections
+        stats['requests'] += pool.num_requests
+        if pool.pool is not None:
+            stats['idle'] += len([conn for conn in list(pool.pool.queue)
+                                  if conn is not None])
+
+    stats['connections_reused'] = max(
+        stats['requests'] - stats['connections_opened'], 0)
+    return stats
+
+
+def _sign_request(method, url, headers, body):
+    """
+    Signs the request the same way oauth2.Client does, returning the url,
+    headers and body to send.
+    """
+    consumer = oauth2.Consumer(key=settings.SPOTSEEKER_OAUTH_KEY,
+                               secret=settings.SPOTSEEKER_OAUTH_SECRET)
+    headers = dict(headers or {})
+    body = body or ''
+
+    if method == "POST":
+        headers['Content-Type'] = headers.get('Content-Type',
+                                              FORM_CONTENT_TYPE)
+
+    is_form_encoded = headers.get('Content-Type') == FORM_CONTENT_TYPE
+
+    parameters = None
+    if is_form_encoded and body:
+        parameters = parse_qs(body)
+
+    req = oauth2.Request.from_consumer_and_token(
+        consumer, token=None, http_method=method, http_url=url,
+        parameters=parameters, body=body, is_form_encoded=is_form_encoded)
+    req.sign_request(oauth2.SignatureMethod_HMAC_SHA1(), consumer, None)
+
+    scheme, netloc, path, params, query, fragment = urlparse(url)
+    realm = urlunparse((scheme, netloc, '', None, None, None))
+
+    if is_form_encoded:
+        body = req.to_postdata()
+    elif method == "GET":
+        url = req.to_url()
+    else:
+        headers.update(req.to_header(realm=realm))
+
+    return url, headers, body
 
 
 def get_live_url(method,
                  host,
                  url,
                  headers,
-                 body=''):
+                 body='',
+                 preload_content=True,
+                 deadline=None):
     """
     Return a connection from the pool and perform an HTTP request.
-    :param con_pool:
-        is the http connection pool associated with the service
     :param method:
         HTTP request method (such as GET, POST, PUT, etc.)
     :param host:
@@ -25,14 +343,249 @@ def get_live_url(method,
         headers to include with the request
     :param body:
         the POST, PUT body of the request
+    :param preload_content:
+        if False, the body is left unread, to be streamed from the
+        response; the connection returns to the pool once it is consumed
+        or response.release_conn() is called.  The content is then None.
+    :param deadline:
+        the time.time() by which the request must finish; by default the
+        deadline from spotseeker_restclient.deadline, if any.  Timeouts
+        are cut to fit, and DeadlineExceededException is raised once it
+        has passed.
+
+    GETs that fail with a connection error or a 502, 503 or 504 are
+    retried up to SPOTSEEKER_GET_RETRIES times, after a jittered backoff
+    that must fit before the deadline.  With SPOTSEEKER_HEDGE_GETS, a GET
+    still waiting after the host's p95 latency is sent again, and the
+    first response is used.
+
+    While the host's circuit breaker is open, this raises
+    CircuitOpenException instead of making the request.  With the
+    SPOTSEEKER_SCHEDULER setting, each request first waits for a slot
+    from the host's scheduler.RequestScheduler.
     """
-    consumer = oauth2.Consumer(key=settings.SPOTSEEKER_OAUTH_KEY,
-                               secret=settings.SPOTSEEKER_OAUTH_SECRET)
-    client = oauth2.Client(consumer)
-    url = host + url
-
-    resp, content = client.request(url,
-                                   method=method,
-                                   body=body,
-                                   headers=headers)
-    return (resp, content)
+    if deadline is None:
+        deadline = get_deadline()
+
+    if method != "GET":
+        response = _urlopen(method, host, url, headers, body,
+                            preload_content, deadline)
+    else:
+        response = _get_with_retries(host, url, headers, preload_content,
+                                     deadline)
+
+    if not preload_content:
+        return (response, None)
+    return (response, response.data)
+
+
+def _get_with_retries(host, url, headers, preload_content, deadline):
+    retries = getattr(settings, 'SPOTSEEKER_GET_RETRIES',
+                      DEFAULT_GET_RETRIES)
+    hedge = preload_content and getattr(settings, 'SPOTSEEKER_HEDGE_GETS',
+                                        False)
+    latencies = _get_latencies(host) if hedge else None
+
+    attempt = 0
+    while True:
+        start = time.time()
+        try:
+            if hedge:
+                response = _hedged_get(host, url, headers, deadline,
+                                       latencies.percentile(95))
+            else:
+                response = _urlopen('GET', host, url, headers, '',
+                                    preload_content, deadline)
+        except CircuitOpenException:
+            raise
+        except urllib3.exceptions.HTTPError:
+            if attempt >= retries or not _backoff(attempt, deadline):
+                if deadline is not None and time.time() >= deadline:
+                    raise DeadlineExceededException(url)
+                raise
+        else:
+            if latencies is not None and response.status < 500:
+                latencies.add(time.time() - start)
+            if response.status not in RETRY_STATUSES or \
+                    attempt >= retries or not _backoff(attempt, deadline):
+                return response
+            response.release_conn()
+        attempt += 1
+
+
+def _backoff(attempt, deadline):
+    """
+    Sleeps before retry attempt + 1, returning False instead if the
+    backoff wouldn't leave time for the retry.
+    """
+    base = getattr(settings, 'SPOTSEEKER_RETRY_BACKOFF',
+                   DEFAULT_RETRY_BACKOFF)
+    delay = random.uniform(0, base * 2 ** attempt)
+    if deadline is not None and time.time() + delay >= deadline:
+        return False
+    time.sleep(delay)
+    return True
+
+
+def _urlopen(method, host, url, headers, body, preload_content, deadline):
+    if deadline is not None and not remaining(deadline):
+        raise DeadlineExceededException(url)
+
+    # Signed for each attempt, so retries don't reuse a nonce
+    signed_url, headers, body = _sign_request(method, host + url, headers,
+                                              body)
+
+    scheduler = get_scheduler(host)
+    if scheduler is not None and not scheduler.acquire(deadline=deadline):
+        raise DeadlineExceededException(url)
+
+    # Time may have run out waiting for the slot, and a timeout of 0
+    # isn't one urllib3 accepts
+    if deadline is not None and not remaining(deadline):
+        if scheduler is not None:
+            scheduler.release()
+        raise DeadlineExceededException(url)
+
+    breaker = get_circuit_breaker(host)
+    if breaker is not None and not breaker.allow_request():
+        if scheduler is not None:
+            scheduler.release()
+        raise CircuitOpenException(url, host)
+
+    start = time.time()
+    try:
+        kwargs = {}
+        if deadline is not None:
+            left = remaining(deadline)
+            kwargs['timeout'] = urllib3.Timeout(
+                connect=min(left, getattr(settings,
+                                          'SPOTSEEKER_CONNECT_TIMEOUT',
+                                          DEFAULT_CONNECT_TIMEOUT)),
+                read=min(left, getattr(settings, 'SPOTSEEKER_READ_TIMEOUT',
+                                       DEFAULT_READ_TIMEOUT)))
+            # The pool blocks when all its connections are in use
+            kwargs['pool_timeout'] = left
+
+        response = get_pool_manager().urlopen(method,
+                                              signed_url,
+                                              body=body or None,
+                                              headers=headers,
+                                              preload_content=preload_content,
+                                              **kwargs)
+    except urllib3.exceptions.EmptyPoolError:
+        # No connection came free in time; not the host's failure
+        if breaker is not None:
+            breaker.cancel_request()
+        if scheduler is not None:
+            scheduler.release()
+        raise DeadlineExceededException(url)
+    except Exception:
+        if breaker is not None:
+            breaker.record_failure()
+        if scheduler is not None:
+            scheduler.release(time.time() - start, failed=True)
+        raise
+
+    if breaker is not None:
+        if response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    if scheduler is not None:
+        # A streamed response gives up its slot once its headers are in
+        scheduler.release(time.time() - start,
+                          failed=response.status >= 500 or
+                          response.status == 429)
+    return response
+
+
+def _hedged_get(host, url, headers, deadline, delay):
+    """
+    Sends a GET, and a second one if the first hasn't returned after
+    delay seconds, returning whichever response arrives first.  Without
+    a delay, from too few samples, only one request is sent.
+    """
+    if delay is None:
+        return _urlopen('GET', host, url, headers, '', True, deadline)
+
+    results = Queue.Queue()
+    request_priority = current_priority()
+
+    def send():
+        try:
+            with priority(request_priority):
+                results.put((True, _urlopen('GET', host, url, headers, '',
+                                            True, deadline)))
+        except Exception as ex:
+            results.put((False, ex))
+
+    def start():
+        thread = threading.Thread(target=send)
+        thread.daemon = True
+        thread.start()
+
+    start()
+    wait = delay
+    if deadline is not None:
+        wait = min(delay, remaining(deadline))
+    try:
+        ok, value = results.get(timeout=wait)
+    except Queue.Empty:
+        pass
+    else:
+        if ok:
+            return value
+        raise value
+
+    if deadline is not None and not remaining(deadline):
+        raise DeadlineExceededException(url)
+
+    start()
+    error = None
+    for sent in range(2):
+        try:
+            ok, value = results.get(
+                timeout=None if deadline is None else remaining(deadline))
+        except Queue.Empty:
+            raise DeadlineExceededException(url)
+        if ok:
+            return value
+        error = value
+    raise error
+
+
+class _Latencies(object):
+    """
+    Recent GET latencies for a host.  The percentile is recomputed every
+    few samples, as it's read on every hedged request.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogram = Histogram(
+            getattr(settings, 'SPOTSEEKER_METRICS_MAX_SAMPLES', 1024))
+        self._percentiles = {}
+
+    def add(self, seconds):
+        with self._lock:
+            self._histogram.add(seconds)
+            if self._histogram.count % LATENCY_REFRESH == 0:
+                self._percentiles = {}
+
+    def percentile(self, percent):
+        with self._lock:
+            if self._histogram.count < getattr(
+                    settings, 'SPOTSEEKER_HEDGE_MIN_SAMPLES',
+                    DEFAULT_HEDGE_MIN_SAMPLES):
+                return None
+            if percent not in self._percentiles:
+                self._percentiles[percent] = \
+                    self._histogram.percentile(percent)
+            return self._percentiles[percent]
+
+
+def _get_latencies(host):
+    latencies = _latencies.get(host)
+    if latencies is None:
+        with _breakers_lock:
+            latencies = _latencies.setdefault(host, _Latencies())
+    return latencies
@@ -1,11 +1,15 @@
 import sys
 import os
-from os.path import abspath, dirname
+from os.path import dirname
 import re
 import json
 import logging
 import time
 import socket
+import posixpath
+import random
+import threading
+from collections import OrderedDict
 from urllib import quote, unquote, urlencode
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -19,6 +23,9 @@ A centralized the mock data access
 # Based on django.template.loaders.app_directories
 fs_encoding = sys.getfilesystemencoding() or sys.getdefaultencoding()
 app_resource_dirs = []
+resource_indexes = {}
+resource_index_lock = threading.Lock()
+logger = logging.getLogger(__name__)
 
 # An issue w/ loading order in management commands means this needs to be
 # a function.  Otherwise we can be trying to load modules that are trying to
@@ -56,16 +63,8 @@ def get_mockdata_url(service_name, implementation_name,
         possible values: "file", etc.
     """
 
-    dir_base = dirname(__file__)
     __initialize_app_resource_dirs()
 
-    RESOURCE_ROOT = abspath(dir_base + "/../resources/" +
-                            service_name + "/" + implementation_name)
-
-    file_path = None
-    success = False
-    start_time = time.time()
-
     for resource_dir in app_resource_dirs:
         response = _load_resource_from_path(resource_dir, service_name,
                                             implementation_name, url, headers)
@@ -85,27 +84,75 @@ def get_mockdata_url(service_name, implementation_name,
     return response
 
 
-def _load_resource_from_path(resource_dir, service_name,
-                             implementation_name,
-                             url, headers):
-
-    RESOURCE_ROOT = os.path.join(resource_dir['path'],
-                                 service_name,
-                                 implementation_name)
-    app = resource_dir['app']
+class ResourceIndex(object):
+    """
+    The files under one app's resources/<service>/<implementation>
+    directory, keyed by their path relative to it, e.g. "/api/v1/spot/1".
+    Scanned once, so that finding a resource is a few dict lookups instead
+    of a series of failed open() calls.  Each url's file is remembered
+    until the next scan.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.headers = {}
+        self.found = {}
+        self.directories = {}
+        self.checked = None
+        self.scan()
+
+    def scan(self):
+        files = {}
+        directories = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            directories[dirpath] = os.path.getmtime(dirpath)
+            relative = dirpath[len(self.root):].replace(os.sep, "/")
+            for filename in filenames:
+                files["%s/%s" % (relative, filename)] = \
+                    os.path.join(dirpath, filename)
+
+        headers = {}
+        for relative, file_path in files.items():
+            headers_path = files.get(relative + ".http-headers")
+            if headers_path is not None:
+                headers[file_path] = headers_path
+
+        self.files = files
+        self.headers = headers
+        self.found = {}
+        self.directories = directories
+        self.checked = time.time()
+
+    def is_stale(self):
+        """
+        True if a file has been added, renamed or removed since the scan.
+        """
+        for path, mtime in self.directories.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def find(self, url):
+        """
+        Returns the file for a url, or None.
+        """
+        # scan() replaces files before found, so these always match
+        found = self.found
+        files = self.files
+        try:
+            return found[url]
+        except KeyError:
+            pass
 
-    if url == "///":
-        # Just a placeholder to put everything else in an else.
-        # If there are things that need dynamic work, they'd go here
-        pass
-    else:
-        orig_file_path = RESOURCE_ROOT + url
-        unquoted = unquote(orig_file_path)
+        unquoted = unquote(url)
         paths = [
-            convert_to_platform_safe(orig_file_path),
-            "%s/index.html" % (convert_to_platform_safe(orig_file_path)),
-            orig_file_path,
-            "%s/index.html" % orig_file_path,
+            convert_to_platform_safe(url),
+            "%s/index.html" % (convert_to_platform_safe(url)),
+            url,
+            "%s/index.html" % url,
             convert_to_platform_safe(unquoted),
             "%s/index.html" % (convert_to_platform_safe(unquoted)),
             unquoted,
@@ -113,46 +160,218 @@ def _load_resource_from_path(resource_dir, service_name,
             ]
 
         file_path = None
-        handle = None
         for path in paths:
-            try:
-                file_path = path
-                handle = open(path)
+            file_path = files.get(posixpath.normpath(path))
+            if file_path is not None:
                 break
-            except IOError as ex:
-                pass
 
-        if handle is None:
-            return None
+        found[url] = file_path
+        return file_path
 
-        logger = logging.getLogger(__name__)
-        logger.debug("URL: %s; App: %s; File: %s" % (url, app, file_path))
+    def headers_file(self, file_path):
+        return self.headers.get(file_path)
 
-        response = MockHTTP()
-        response.status = 200
-        response.data = handle.read()
-        response.headers = {"X-Data-Source": service_name + " file mock data",
-                            }
 
+def get_resource_index(resource_dir, service_name, implementation_name):
+    """
+    Returns the ResourceIndex for an app's resources.  With
+    SPOTSEEKER_FILE_DAO_WATCH_INTERVAL set to a number of seconds, the
+    directories are checked for changes that often, and rescanned when
+    they've changed.
+    """
+    root = os.path.join(resource_dir['path'], service_name,
+                        implementation_name)
+    index = resource_indexes.get(root)
+    if index is None:
+        with resource_index_lock:
+            index = resource_indexes.get(root)
+            if index is None:
+                index = ResourceIndex(root)
+                resource_indexes[root] = index
+        return index
+
+    interval = getattr(settings, "SPOTSEEKER_FILE_DAO_WATCH_INTERVAL", None)
+    if interval is not None and time.time() - index.checked >= interval:
+        with resource_index_lock:
+            if time.time() - index.checked >= interval:
+                if index.is_stale():
+                    index.scan()
+                else:
+                    index.checked = time.time()
+    return index
+
+
+def clear_resource_indexes():
+    """
+    Drops the scanned resource indexes, so they're rebuilt on next use.
+    """
+    with resource_index_lock:
+        resource_indexes.clear()
+
+
+class ResourceCache(object):
+    """
+    A thread-safe LRU of resource file bodies and parsed .http-headers,
+    keyed by file path and checked against the files' mtimes, holding
+    up to SPOTSEEKER_FILE_DAO_CACHE_MAX_BYTES of bodies.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_path, headers_path):
+        """
+        Returns (status, data, headers) for a resource file, or None if
+        it's gone.  headers_path is the file's .http-headers, or None.
+        """
+        try:
+            mtimes = (os.path.getmtime(file_path),
+                      headers_path and os.path.getmtime(headers_path))
+        except OSError:
+            mtimes = None
+
+        with self._lock:
+            entry = self._entries.pop(file_path, None)
+            if entry is not None:
+                if entry[0] == mtimes:
+                    self._entries[file_path] = entry
+                    self.hits += 1
+                    return entry[1]
+                self.size -= len(entry[1][1])
+            self.misses += 1
+
+        resource = _read_resource(file_path, headers_path)
+        if resource is None or mtimes is None:
+            return resource
+
+        max_bytes = getattr(settings, "SPOTSEEKER_FILE_DAO_CACHE_MAX_BYTES",
+                            10 * 1024 * 1024)
+        size = len(resource[1])
+        if size > max_bytes:
+            return resource
+
+        with self._lock:
+            old = self._entries.pop(file_path, None)
+            if old is not None:
+                self.size -= len(old[1][1])
+            self._entries[file_path] = (mtimes, resource)
+            self.size += size
+
+            while self.size > max_bytes:
+                evicted_path, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[1][1])
+        return resource
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+resource_cache = ResourceCache()
+
+
+def _read_resource(file_path, headers_path):
+    try:
+        handle = open(file_path)
+    except IOError:
+        # Removed since the scan
+        return None
+    data = handle.read()
+    handle.close()
+
+    status = 200
+    file_headers = {}
+    if headers_path is not None:
         try:
-            headers = open(handle.name + '.http-headers')
+            headers = open(headers_path)
             file_values = json.loads(headers.read())
+            headers.close()
 
             if "headers" in file_values:
-                response.headers = dict(response.headers.items() +
-                                        file_values['headers'].items())
+                file_headers = file_values['headers']
 
                 if 'status' in file_values:
-                    response.status = file_values['status']
+                    status = file_values['status']
 
             else:
-                response.headers = dict(response.headers.items() +
-                                        file_values.items())
+                file_headers = file_values
 
         except IOError:
             pass
 
+    return status, data, file_headers
+
+
+def _load_resource_from_path(resource_dir, service_name,
+                             implementation_name,
+                             url, headers):
+
+    app = resource_dir['app']
+
+    if url == "///":
+        # Just a placeholder to put everything else in an else.
+        # If there are things that need dynamic work, they'd go here
+        pass
+    else:
+        index = get_resource_index(resource_dir, service_name,
+                                   implementation_name)
+        file_path = index.find(url)
+        if file_path is None:
+            return None
+
+        resource = resource_cache.get(file_path,
+                                      index.headers_file(file_path))
+        if resource is None:
+            return None
+        status, data, file_headers = resource
+
+        logger.debug("URL: %s; App: %s; File: %s", url, app, file_path)
+
+        response = MockHTTP()
+        response.status = status
+        response.data = data
+        response.headers = {"X-Data-Source": service_name + " file mock data",
+                            }
+        response.headers.update(file_headers)
+
+        # Answers conditional requests for resources with an ETag
+        etag = response.getheader("ETag")
+        if etag and headers and headers.get("If-None-Match") == etag:
+            response.status = 304
+            response.data = ""
+        return response
+
+
+def simulate_network(service_name):
+    """
+    Makes the file DAOs behave more like a network service, for load and
+    timeout testing.  Sleeps for SPOTSEEKER_FILE_DAO_LATENCY seconds plus
+    a random part of SPOTSEEKER_FILE_DAO_JITTER seconds, then fails the
+    request with SPOTSEEKER_FILE_DAO_ERROR_RATE probability, returning a
+    response with SPOTSEEKER_FILE_DAO_ERROR_STATUS (default 500).  Returns
+    that response, or None when the request should go ahead.  All off by
+    default.
+    """
+    latency = getattr(settings, "SPOTSEEKER_FILE_DAO_LATENCY", 0)
+    jitter = getattr(settings, "SPOTSEEKER_FILE_DAO_JITTER", 0)
+    error_rate = getattr(settings, "SPOTSEEKER_FILE_DAO_ERROR_RATE", 0)
+
+    if latency or jitter:
+        time.sleep(latency + random.random() * jitter)
+
+    if error_rate and random.random() < error_rate:
+        response = MockHTTP()
+        response.status = getattr(settings,
+                                  "SPOTSEEKER_FILE_DAO_ERROR_STATUS", 500)
+        response.data = "Simulated error"
+        response.headers = {"X-Data-Source": service_name +
+                            " file mock data"}
         return response
+    return None
 
 
 def post_mockdata_url(service_name, implementation_name,
@@ -1,21 +1,32 @@
 from importlib import import_module
 from spotseeker_restclient.dao_implementation.live import get_live_url
-from spotseeker_restclient.dao_implementation.mock import get_mockdata_url
+from spotseeker_restclient.dao_implementation.mock import get_mockdata_url, \
+    simulate_network
 from django.conf import settings
 
 
 class File(object):
     def getURL(self, url, headers):
+        response = simulate_network("spotseeker")
+        if response is not None:
+            return response
         return get_mockdata_url("spotseeker", "file", url, headers)
 
 
 class Live(object):
 
     def getURL(self, url, headers):
-
-        return get_live_url('GET',
-                            settings.SPOTSEEKER_HOST,
-                            url, headers=headers)
+        response, content = get_live_url('GET',
+                                         settings.SPOTSEEKER_HOST,
+                                         url, headers=headers)
+        return response
+
+    def streamURL(self, url, headers):
+        response, content = get_live_url('GET',
+                                         settings.SPOTSEEKER_HOST,
+                                         url, headers=headers,
+                                         preload_content=False)
+        return response
 
     def putURL(self, url, headers, body):
         return get_live_url('PUT',
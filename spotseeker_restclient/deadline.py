@@ -0,0 +1,65 @@
+"""
+Deadlines for the requests made on a thread.
+
+    with deadline(0.3):
+        spot = Spotseeker().get_spot_by_id(1)
+
+bounds everything inside the block, including retries, to 300ms; the
+Spotseeker methods that take a timeout argument do the same.  Nested
+deadlines never extend an outer one.  Requests that can't finish in time
+raise DeadlineExceededException.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+
+_local = threading.local()
+
+
+def get_deadline():
+    """
+    Returns the time.time() by which this thread's requests must finish,
+    or None.
+    """
+    return getattr(_local, "deadline", None)
+
+
+def remaining(when=None):
+    """
+    Returns the seconds left until when, by default this thread's
+    deadline, or None if there is no deadline.  Never less than 0.
+    """
+    if when is None:
+        when = get_deadline()
+        if when is None:
+            return None
+    return max(when - time.time(), 0.0)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Requests made inside the block must finish within seconds.  With
+    seconds None, the block is left as it is.
+    """
+    if seconds is None:
+        yield
+        return
+    with deadline_at(time.time() + seconds):
+        yield
+
+
+@contextmanager
+def deadline_at(when):
+    """
+    Requests made inside the block must finish by when, a time.time().
+    Used to carry a deadline over to another thread.
+    """
+    previous = get_deadline()
+    if when is not None and (previous is None or when < previous):
+        _local.deadline = when
+    try:
+        yield
+    finally:
+        _local.deadline = previous
@@ -18,3 +18,24 @@ class DataFailureException(Exception):
     def __str__(self):
         return ("Error fetching %s.  Status code: %s.  Message: %s." %
                 (self.url, self.status, self.msg))
+
+
+class CircuitOpenException(DataFailureException):
+    """
+    Raised in place of a request to a host whose circuit breaker is open,
+    after repeated failures.  The status is 503.
+    """
+    def __init__(self, url, host):
+        super(CircuitOpenException, self).__init__(
+            url, 503, "Circuit breaker open for %s" % host)
+        self.host = host
+
+
+class DeadlineExceededException(DataFailureException):
+    """
+    Raised when the time allowed for a call, from deadline.deadline() or a
+    method's timeout argument, runs out.  The status is 504.
+    """
+    def __init__(self, url):
+        super(DeadlineExceededException, self).__init__(
+            url, 504, "Deadline exceeded")
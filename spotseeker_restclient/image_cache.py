@@ -0,0 +1,381 @@
+"""
+Streams spot and item images, through an optional on-disk cache.
+
+With SPOTSEEKER_IMAGE_CACHE_DIR set, image bodies are kept in that
+directory, named by the sha1 of their content, so the same image stored
+under several urls is only kept once.  Each (parent type, parent id,
+image id, width) has a small JSON file recording the body's digest and
+the ETag and Last-Modified it was served with.  Within
+SPOTSEEKER_IMAGE_CACHE_FRESH_SECONDS (300) of being validated an image
+is served from disk; after that it is revalidated with a conditional
+request.  The least recently used bodies are removed once they total
+more than SPOTSEEKER_IMAGE_CACHE_MAX_BYTES (100MB).
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from hashlib import sha1
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_FRESH_SECONDS = 300
+CHUNK_SIZE = 2 ** 16
+
+logger = logging.getLogger(__name__)
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ImageStream(object):
+    """
+    An image response whose body is read in chunks, by iterating over it
+    or with write_to(fileobj), so it's never held in memory.  It can be
+    passed straight to a Django StreamingHttpResponse:
+
+        image = Spotseeker().stream_spot_image(spot_id, image_id, 200)
+        return StreamingHttpResponse(image, content_type=image.content_type)
+
+    The body can only be read once.  Call close() if it isn't read to the
+    end.
+    """
+    def __init__(self, status, headers, chunks, close=None):
+        self.status = status
+        self.headers = headers
+        self.content_type = headers.get("Content-Type")
+        self.etag = headers.get("ETag")
+        length = headers.get("Content-Length")
+        self.length = int(length) if length else None
+        self._chunks = chunks
+        self._close = close
+
+    def __iter__(self):
+        try:
+            for chunk in self._chunks:
+                yield chunk
+        finally:
+            self.close()
+
+    def write_to(self, fileobj):
+        """
+        Copies the body to fileobj, returning the number of bytes written.
+        """
+        written = 0
+        for chunk in self:
+            fileobj.write(chunk)
+            written += len(chunk)
+        return written
+
+    def close(self):
+        if self._close is not None:
+            close, self._close = self._close, None
+            close()
+
+
+class _BodyWriter(object):
+    """
+    Writes a body to a temporary file while hashing it, and then moves it
+    into the cache.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.size = 0
+        self._hash = sha1()
+        handle, self.path = tempfile.mkstemp(dir=cache._path("tmp"))
+        self._file = os.fdopen(handle, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """
+        Returns the digest of the body, now in the cache.
+        """
+        self._file.close()
+        digest = self._hash.hexdigest()
+        path = self.cache._body_path(digest)
+        if os.path.exists(path):
+            _remove(self.path)
+            os.utime(path, None)
+        else:
+            _makedirs(os.path.dirname(path))
+            os.rename(self.path, path)
+            self.cache._added(self.size)
+        return digest
+
+    def abort(self):
+        self._file.close()
+        _remove(self.path)
+
+
+class ImageCache(object):
+    """
+    The on-disk image cache; see the module docstring.
+    """
+    def __init__(self, directory, max_bytes=None, fresh_seconds=None):
+        if max_bytes is None:
+            max_bytes = getattr(settings, "SPOTSEEKER_IMAGE_CACHE_MAX_BYTES",
+                                DEFAULT_MAX_BYTES)
+        if fresh_seconds is None:
+            fresh_seconds = getattr(settings,
+                                    "SPOTSEEKER_IMAGE_CACHE_FRESH_SECONDS",
+                                    DEFAULT_FRESH_SECONDS)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self._size = None
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "revalidations": 0, "misses": 0}
+        for name in ("tmp", "keys", "bodies"):
+            _makedirs(self._path(name))
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _body_path(self, digest):
+        return self._path("bodies", digest[:2], digest)
+
+    def _key_path(self, key):
+        name = sha1("|".join(str(part) for part in key)).hexdigest()
+        return self._path("keys", name[:2], name + ".json")
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def lookup(self, key):
+        """
+        Returns the entry stored for key, a dict with the body's digest
+        and size, its etag, last_modified and content_type, and when it
+        was validated; or None.
+        """
+        try:
+            with open(self._key_path(key)) as handle:
+                entry = json.load(handle)
+        except (IOError, ValueError):
+            return None
+        if not os.path.exists(self._body_path(entry["digest"])):
+            # The body was evicted
+            _remove(self._key_path(key))
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["validated"] < self.fresh_seconds
+
+    def open(self, entry):
+        """
+        Returns an ImageStream of a stored entry's body, or None if it has
+        been evicted since the lookup.
+        """
+        path = self._body_path(entry["digest"])
+        try:
+            handle = open(path, "rb")
+        except IOError:
+            return None
+        # Marks the body as recently used, for eviction
+        os.utime(path, None)
+
+        headers = {"Content-Length": str(entry["size"])}
+        for header, field in (("Content-Type", "content_type"),
+                              ("ETag", "etag"),
+                              ("Last-Modified", "last_modified")):
+            if entry.get(field):
+                headers[header] = entry[field]
+
+        def chunks():
+            while True:
+                chunk = handle.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+        return ImageStream(200, headers, chunks(), handle.close)
+
+    def validated(self, key, entry):
+        """
+        Records that a stored entry was revalidated.
+        """
+        entry["validated"] = time.time()
+        self._write_entry(key, entry)
+
+    def store(self, key, response, chunk_size=CHUNK_SIZE):
+        """
+        Returns an ImageStream of a 200 response's body that saves it to
+        the cache as it is read.  Nothing is saved if the body isn't read
+        to the end.
+        """
+        writer = _BodyWriter(self)
+        headers = dict((header, response.getheader(header))
+                       for header in ("Content-Type", "Content-Length",
+                                      "ETag", "Last-Modified")
+                       if response.getheader(header))
+        done = []
+
+        def chunks():
+            for chunk in response.stream(chunk_size):
+                writer.write(chunk)
+                yield chunk
+
+            self._write_entry(key, {
+                "digest": writer.commit(),
+                "size": writer.size,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "content_type": headers.get("Content-Type"),
+                "validated": time.time(),
+            })
+            done.append(True)
+            self.evict()
+
+        def close():
+            if not done:
+                writer.abort()
+            response.release_conn()
+
+        return ImageStream(200, headers, chunks(), close)
+
+    def _write_entry(self, key, entry):
+        path = self._key_path(key)
+        _makedirs(os.path.dirname(path))
+        handle, temp_path = tempfile.mkstemp(dir=self._path("tmp"))
+        with os.fdopen(handle, "w") as temp:
+            json.dump(entry, temp)
+        os.rename(temp_path, path)
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+
+    def evict(self):
+        """
+        Removes the least recently used bodies until they total no more
+        than max_bytes.  Returns the number of bytes removed.
+        """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return 0
+
+            bodies = []
+            total = 0
+            for directory, names, files in os.walk(self._path("bodies")):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    bodies.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            removed = 0
+            bodies.sort()
+            for mtime, size, path in bodies:
+                if total - removed <= self.max_bytes:
+                    break
+                _remove(path)
+                removed += size
+
+            self._size = total - removed
+        if removed:
+            logger.info("Removed %s bytes of images from %s", removed,
+                        self.directory)
+        return removed
+
+
+def get_image_cache():
+    """
+    Returns the ImageCache for SPOTSEEKER_IMAGE_CACHE_DIR, or None if that
+    isn't set.
+    """
+    global _image_cache
+    directory = getattr(settings, "SPOTSEEKER_IMAGE_CACHE_DIR", None)
+    if directory is None:
+        return None
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache(directory)
+    return _image_cache
+
+
+@receiver(setting_changed)
+def _settings_changed(sender, setting, **kwargs):
+    global _image_cache
+    if setting.startswith("SPOTSEEKER_IMAGE_CACHE"):
+        _image_cache = None
+
+
+def stream_image(dao, key, url, chunk_size=CHUNK_SIZE):
+    """
+    Returns an ImageStream for url, from the cache for key when it can be,
+    and otherwise from dao.streamURL.  Responses other than a 200 are
+    returned as they are, with the body of the error.
+    """
+    cache = get_image_cache()
+    entry = None
+    headers = {}
+    if cache is not None:
+        entry = cache.lookup(key)
+        if entry is not None:
+            if cache.is_fresh(entry):
+                stream = cache.open(entry)
+                if stream is not None:
+                    cache._count("hits")
+                    return stream
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = dao.streamURL(url, headers)
+
+    if response.status == 304 and entry is not None:
+        response.release_conn()
+        stream = cache.open(entry)
+        if stream is not None:
+            cache.validated(key, entry)
+            cache._count("revalidations")
+            return stream
+        # Evicted while the request was made
+        response = dao.streamURL(url, {})
+
+    if response.status == 200 and cache is not None:
+        cache._count("misses")
+        return cache.store(key, response, chunk_size)
+
+    response_headers = dict((header, response.getheader(header))
+                            for header in ("Content-Type", "Content-Length",
+                                           "ETag", "Last-Modified")
+                            if response.getheader(header))
+    return ImageStream(response.status, response_headers,
+                       response.stream(chunk_size), response.release_conn)
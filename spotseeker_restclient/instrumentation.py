@@ -0,0 +1,348 @@
+"""
+Metrics and tracing hooks for DAO calls and Spotseeker methods.
+
+A hook is a callable that is passed an event dict after each call:
+
+    type        "dao" for a SPOTSEEKER_DAO request, "method" for a
+                Spotseeker method
+    name        "spotseeker GET" etc., or "Spotseeker.get_spot_by_id"
+    duration    seconds the call took
+    status      the response status, or the DataFailureException's
+    error       the exception raised, or None
+
+DAO events also have service, method, url, cache ("hit", "miss",
+"revalidated" or "stale" for GETs, otherwise None) and bytes (the body
+size, when known).  Method events have calls, bytes and cache, totalled
+over the DAO requests the method made on its thread, and parse_time, the
+time the method spent outside of them.
+
+Register hooks with register_hook(), or list their dotted paths in the
+SPOTSEEKER_METRICS_HOOKS setting; a class in the setting is instantiated.
+With no hooks, calls go straight through, without timing anything.
+HistogramExporter and LoggingExporter are built in.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from collections import deque
+from functools import wraps
+from importlib import import_module
+import inspect
+import logging
+import math
+import threading
+import time
+
+
+DEFAULT_MAX_SAMPLES = 1024
+
+logger = logging.getLogger(__name__)
+
+_registered = []
+_active = None
+_hooks_lock = threading.Lock()
+_local = threading.local()
+
+
+def hooks():
+    """
+    Returns the hooks to pass events to; empty when nothing is listening.
+    """
+    if _active is None:
+        _load_hooks()
+    return _active
+
+
+def _load_hooks():
+    global _active
+    with _hooks_lock:
+        loaded = []
+        for path in getattr(settings, "SPOTSEEKER_METRICS_HOOKS", ()):
+            module, attr = path.rsplit(".", 1)
+            try:
+                hook = getattr(import_module(module), attr)
+            except (ImportError, AttributeError) as ex:
+                raise ImproperlyConfigured("Error loading metrics hook %s: "
+                                           "%s" % (path, ex))
+            if inspect.isclass(hook):
+                hook = hook()
+            loaded.append(hook)
+        _active = tuple(_registered + loaded)
+
+
+@receiver(setting_changed)
+def _reload_hooks(sender, setting, **kwargs):
+    global _active
+    if setting == "SPOTSEEKER_METRICS_HOOKS":
+        _active = None
+
+
+def register_hook(hook):
+    """
+    Passes every following event to hook.  Returns the hook, so this can
+    be used as a decorator.
+    """
+    global _active
+    with _hooks_lock:
+        _registered.append(hook)
+        _active = None
+    return hook
+
+
+def unregister_hook(hook):
+    global _active
+    with _hooks_lock:
+        if hook in _registered:
+            _registered.remove(hook)
+        _active = None
+
+
+def clear_hooks():
+    """
+    Unregisters every hook registered with register_hook().
+    """
+    global _active
+    with _hooks_lock:
+        del _registered[:]
+        _active = None
+
+
+def emit(event):
+    """
+    Passes an event to each hook.  A hook that fails is logged, and
+    doesn't affect the call being measured.
+    """
+    for hook in hooks():
+        try:
+            hook(event)
+        except Exception as ex:
+            logger.error("Error in metrics hook %r: %s", hook, ex)
+
+
+def record_request(service, method, url, start, response=None, cache=None,
+                   error=None):
+    """
+    Emits the event for a DAO request that began at start.  response is
+    a response, or a (response, content) tuple as from the Live DAO.
+    """
+    duration = time.time() - start
+    data = None
+    if isinstance(response, tuple):
+        response, data = response
+    elif response is not None:
+        data = getattr(response, "data", None)
+
+    event = {
+        "type": "dao",
+        "name": "%s %s" % (service, method),
+        "service": service,
+        "method": method,
+        "url": url,
+        "duration": duration,
+        "status": getattr(response, "status", None),
+        "cache": cache,
+        "bytes": len(data) if isinstance(data, basestring) else None,
+        "error": error,
+    }
+    if event["status"] is None:
+        event["status"] = getattr(error, "status", None)
+
+    for trace in getattr(_local, "traces", ()):
+        trace["calls"] += 1
+        trace["dao_time"] += duration
+        trace["bytes"] += event["bytes"] or 0
+        trace["status"] = event["status"]
+        if cache is not None:
+            trace["cache"] = cache
+
+    emit(event)
+
+
+def traced(method):
+    """
+    Decorates a Spotseeker method so that each call emits a method event.
+    """
+    name = "Spotseeker.%s" % method.__name__
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if not hooks():
+            return method(*args, **kwargs)
+
+        traces = getattr(_local, "traces", None)
+        if traces is None:
+            traces = _local.traces = []
+        trace = {"calls": 0, "dao_time": 0.0, "bytes": 0, "status": None,
+                 "cache": None}
+        traces.append(trace)
+
+        error = None
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            duration = time.time() - start
+            traces.pop()
+
+            parse_time = None
+            if trace["calls"]:
+                parse_time = max(duration - trace["dao_time"], 0.0)
+            status = trace["status"]
+            if error is not None:
+                status = getattr(error, "status", status)
+
+            emit({
+                "type": "method",
+                "name": name,
+                "duration": duration,
+                "status": status,
+                "calls": trace["calls"],
+                "bytes": trace["bytes"],
+                "cache": trace["cache"],
+                "parse_time": parse_time,
+                "error": error,
+            })
+
+    return wrapper
+
+
+class Histogram(object):
+    """
+    Percentiles over the most recent max_samples values, with a count and
+    total over every value added.
+    """
+    def __init__(self, max_samples=DEFAULT_MAX_SAMPLES):
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=max_samples)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self._samples.append(value)
+
+    def percentile(self, percent):
+        """
+        Returns the nearest-rank percentile, or None with no values.
+        """
+        return _nearest_rank(sorted(self._samples), percent)
+
+    def summary(self):
+        samples = sorted(self._samples)
+        summary = {"count": self.count,
+                   "mean": self.total / self.count if self.count else None}
+        for percent in (50, 95, 99):
+            summary["p%s" % percent] = _nearest_rank(samples, percent)
+        return summary
+
+
+def _nearest_rank(samples, percent):
+    if not samples:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(samples))) - 1
+    return samples[min(max(rank, 0), len(samples) - 1)]
+
+
+class HistogramExporter(object):
+    """
+    A hook that keeps duration and parse time histograms, status and cache
+    outcome counts, and bytes transferred, for each event name.
+    """
+    def __init__(self, max_samples=None):
+        if max_samples is None:
+            max_samples = getattr(settings, "SPOTSEEKER_METRICS_MAX_SAMPLES",
+                                  DEFAULT_MAX_SAMPLES)
+        self.max_samples = max_samples
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            metric = self._metrics.get(event["name"])
+            if metric is None:
+                metric = self._metrics[event["name"]] = {
+                    "duration": Histogram(self.max_samples),
+                    "parse_time": Histogram(self.max_samples),
+                    "statuses": {},
+                    "cache": {},
+                    "bytes": 0,
+                    "errors": 0,
+                }
+
+            metric["duration"].add(event["duration"])
+            if event.get("parse_time") is not None:
+                metric["parse_time"].add(event["parse_time"])
+            status = event["status"]
+            metric["statuses"][status] = metric["statuses"].get(status, 0) + 1
+            cache = event.get("cache")
+            if cache is not None:
+                metric["cache"][cache] = metric["cache"].get(cache, 0) + 1
+            metric["bytes"] += event.get("bytes") or 0
+            if event["error"] is not None:
+                metric["errors"] += 1
+
+    def percentile(self, name, percent):
+        """
+        Returns a duration percentile for an event name, or None.
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                return None
+            return metric["duration"].percentile(percent)
+
+    def summary(self):
+        """
+        Returns a dict of event name to its count, mean and p50/p95/p99
+        durations, parse time percentiles, status and cache outcome
+        counts, bytes and errors.
+        """
+        summary = {}
+        with self._lock:
+            for name, metric in self._metrics.items():
+                values = metric["duration"].summary()
+                if metric["parse_time"].count:
+                    values["parse_time"] = metric["parse_time"].summary()
+                values["statuses"] = dict(metric["statuses"])
+                values["cache"] = dict(metric["cache"])
+                values["bytes"] = metric["bytes"]
+                values["errors"] = metric["errors"]
+                summary[name] = values
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+
+class LoggingExporter(object):
+    """
+    A hook that logs a line per event, to the spotseeker_restclient.metrics
+    logger by default.
+    """
+    def __init__(self, logger_name="spotseeker_restclient.metrics",
+                 level=logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def __call__(self, event):
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        details = ["status=%s" % event["status"]]
+        if event.get("cache") is not None:
+            details.append("cache=%s" % event["cache"])
+        if event.get("bytes") is not None:
+            details.append("bytes=%s" % event["bytes"])
+        if event.get("parse_time") is not None:
+            details.append("parse=%.1fms" % (event["parse_time"] * 1000))
+        if event["error"] is not None:
+            details.append("error=%s" % type(event["error"]).__name__)
+
+        self.logger.log(self.level, "%s %s %.1fms %s", event["name"],
+                        event.get("url", ""), event["duration"] * 1000,
+                        " ".join(details))
@@ -0,0 +1,38 @@
+"""
+Expires and evicts cache entries; see cache_maintenance.sweep.
+"""
+from spotseeker_restclient.cache_maintenance import sweep
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Removes cache entries older than a maximum age, then the least "
+            "recently used entries past a size budget.  Limits default to "
+            "the SPOTSEEKER_CACHE_MAX_AGE, SPOTSEEKER_CACHE_MAX_ENTRIES and "
+            "SPOTSEEKER_CACHE_MAX_BYTES settings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-age", type=int, dest="max_age",
+                            help="Maximum age of an entry, in seconds")
+        parser.add_argument("--max-entries", type=int, dest="max_entries",
+                            help="Maximum number of entries to keep")
+        parser.add_argument("--max-bytes", type=int, dest="max_bytes",
+                            help="Maximum total size of the entries kept")
+        parser.add_argument("--dry-run", action="store_true", dest="dry_run",
+                            default=False,
+                            help="Report what would be removed, but don't")
+
+    def handle(self, *args, **options):
+        report = sweep(max_age=options["max_age"],
+                       max_entries=options["max_entries"],
+                       max_bytes=options["max_bytes"],
+                       dry_run=options["dry_run"])
+
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write("%s %s expired entries (%s bytes) and evicted %s "
+                          "entries (%s bytes)" % (
+                              verb, report["expired"],
+                              report["expired_bytes"], report["evicted"],
+                              report["evicted_bytes"]))
+        self.stdout.write("%s entries (%s bytes) remain" % (
+            report["entries"], report["bytes"]))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('service', models.CharField(max_length=50, db_index=True)),
+                ('url', models.CharField(unique=True, max_length=255, db_index=True)),
+                ('status', models.PositiveIntegerField()),
+                ('header_pickle', models.TextField()),
+                ('content', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CacheEntryExpires',
+            fields=[
+                ('cacheentry_ptr', models.OneToOneField(parent_link=True, auto_created=True, primary_key=True, serialize=False, to='spotseeker_restclient.CacheEntry')),
+                ('time_expires', models.DateTimeField()),
+            ],
+            bases=('spotseeker_restclient.cacheentry',),
+        ),
+        migrations.CreateModel(
+            name='CacheEntryTimed',
+            fields=[
+                ('cacheentry_ptr', models.OneToOneField(parent_link=True, auto_created=True, primary_key=True, serialize=False, to='spotseeker_restclient.CacheEntry')),
+                ('time_saved', models.DateTimeField()),
+            ],
+            bases=('spotseeker_restclient.cacheentry',),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cacheentry',
+            unique_together=set([('service', 'url')]),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def clear_entries(apps, schema_editor):
+    # Cached responses can be fetched again, so they're thrown away rather
+    # than converted row by row; child tables first
+    for name in ("CacheEntryTimed", "CacheEntryExpires", "CacheEntry"):
+        model = apps.get_model("spotseeker_restclient", name)
+        schema_editor.execute("DELETE FROM %s" % schema_editor.quote_name(
+            model._meta.db_table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotseeker_restclient', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cacheentry',
+            name='key',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='cacheentry',
+            name='header_json',
+            field=models.TextField(default='{}'),
+        ),
+        migrations.AddField(
+            model_name='cacheentry',
+            name='body',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='cacheentry',
+            name='compressed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(clear_entries, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cacheentry',
+            unique_together=set([]),
+        ),
+        migrations.RemoveField(
+            model_name='cacheentry',
+            name='header_pickle',
+        ),
+        migrations.RemoveField(
+            model_name='cacheentry',
+            name='content',
+        ),
+        migrations.AlterField(
+            model_name='cacheentry',
+            name='url',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='cacheentry',
+            name='key',
+            field=models.CharField(unique=True, max_length=40),
+        ),
+    ]
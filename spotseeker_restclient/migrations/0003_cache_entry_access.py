@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+from django.utils import timezone
+
+
+def fill_sizes(apps, schema_editor):
+    # Existing entries count as stored and used now; one UPDATE, as the
+    # table can be large
+    CacheEntry = apps.get_model("spotseeker_restclient", "CacheEntry")
+    now = timezone.now()
+    CacheEntry.objects.update(
+        size=Length("url") + Length("header_json") + Length("body"),
+        time_stored=now,
+        time_accessed=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotseeker_restclient', '0002_compact_cache_entries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cacheentry',
+            name='size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cacheentry',
+            name='time_accessed',
+            field=models.DateTimeField(null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='cacheentry',
+            name='time_stored',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fill_sizes, migrations.RunPython.noop),
+    ]
@@ -19,6 +19,18 @@ class MockHTTP(object):
         """
         return self.data
 
+    def stream(self, amt=2 ** 16):
+        """
+        Yields the document body in chunks of up to amt bytes, like
+        HTTPResponse.stream.
+        """
+        data = self.data or ""
+        for start in range(0, len(data), amt):
+            yield data[start:start + amt]
+
+    def release_conn(self):
+        pass
+
     def getheader(self, field, default=''):
         """
         Returns the HTTP response header field, case insensitively
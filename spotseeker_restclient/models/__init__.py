@@ -1,44 +1,126 @@
+from django.conf import settings
 from django.db import models
-import pickle
-from base64 import b64encode, b64decode
+from django.utils import timezone
+from datetime import timedelta
+from hashlib import sha1
+import json
+import zlib
+
+
+def cache_key(service, url):
+    """
+    Returns the fixed width key for a service's url; urls can be longer
+    than any indexable column.
+    """
+    return sha1(" ".join(value.encode("utf-8")
+                         if isinstance(value, type(u"")) else value
+                         for value in (service, url))).hexdigest()
+
+
+class CacheEntryManager(models.Manager):
+    def for_url(self, service, url):
+        return self.filter(key=cache_key(service, url))
 
 
 class CacheEntry(models.Model):
+    """
+    A cached response.  Headers are stored as JSON, and bodies of
+    SPOTSEEKER_CACHE_COMPRESS_MIN_BYTES (16KB) or more are stored zlib
+    compressed; use the headers and content attributes rather than the
+    columns.  Look entries up by key, with objects.for_url(service, url).
+
+    time_stored, time_accessed and size (in bytes) are kept for
+    cache_maintenance.sweep.
+    """
+    key = models.CharField(max_length=40, unique=True)
     service = models.CharField(max_length=50, db_index=True)
-    url = models.CharField(max_length=255, unique=True, db_index=True)
+    url = models.TextField()
     status = models.PositiveIntegerField()
-    header_pickle = models.TextField()
-    content = models.TextField()
+    header_json = models.TextField(default="{}")
+    body = models.BinaryField(default="")
+    compressed = models.BooleanField(default=False)
+    time_stored = models.DateTimeField(null=True)
+    time_accessed = models.DateTimeField(null=True, db_index=True)
+    size = models.PositiveIntegerField(default=0)
     headers = None
+    _content = None
 
-    class Meta:
-        unique_together = ('service', 'url')
+    objects = CacheEntryManager()
 
     def getHeaders(self):
         if self.headers is None:
-            if self.header_pickle is None:
-                self.headers = {}
+            if self.header_json:
+                self.headers = json.loads(self.header_json)
             else:
-                self.headers = pickle.loads(b64decode(self.header_pickle))
+                self.headers = {}
         return self.headers
 
     def setHeaders(self, headers):
         self.headers = headers
 
-    def save(self, *args, **kwargs):
-        pickle_content = ""
-        if self.headers:
-            pickle_content = pickle.dumps(self.headers)
-        else:
-            pickle_content = pickle.dumps({})
+    @property
+    def content(self):
+        if self._content is None:
+            # bytes() for the buffer that some backends return
+            body = bytes(self.body or "")
+            if self.compressed:
+                body = zlib.decompress(body)
+            self._content = body
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
 
-        self.header_pickle = b64encode(pickle_content)
+    def serialize(self):
+        """
+        Fills in the key, header_json and body columns.  save() does this,
+        but bulk_create() doesn't call save().
+        """
+        self.key = cache_key(self.service, self.url)
+        self.header_json = json.dumps(self.getHeaders())
+
+        if self._content is not None:
+            data = self._content
+            if isinstance(data, type(u"")):
+                data = data.encode("utf-8")
+
+            self.compressed = len(data) >= getattr(
+                settings, "SPOTSEEKER_CACHE_COMPRESS_MIN_BYTES", 1024 * 16)
+            if self.compressed:
+                data = zlib.compress(data)
+            self.body = data
+            self.size = len(self.url) + len(self.header_json) + len(data)
+
+        self.time_stored = timezone.now()
+        self.time_accessed = self.time_stored
+
+    def touch(self):
+        """
+        Records a read of the entry, for LRU eviction.  To spare a write on
+        every read, time_accessed is only updated once it's more than
+        SPOTSEEKER_CACHE_ACCESS_RESOLUTION (60) seconds old.
+        """
+        now = timezone.now()
+        resolution = timedelta(seconds=getattr(
+            settings, "SPOTSEEKER_CACHE_ACCESS_RESOLUTION", 60))
+        if self.time_accessed is None or \
+                now - self.time_accessed > resolution:
+            CacheEntry.objects.filter(pk=self.pk).update(time_accessed=now)
+            self.time_accessed = now
+
+    def save(self, *args, **kwargs):
+        self.serialize()
         super(CacheEntry, self).save(*args, **kwargs)
 
 
 class CacheEntryTimed(CacheEntry):
     time_saved = models.DateTimeField()
 
+    objects = CacheEntryManager()
+
 
 class CacheEntryExpires(CacheEntry):
     time_expires = models.DateTimeField()
+
+    objects = CacheEntryManager()
@@ -0,0 +1,241 @@
+"""
+Lightweight versions of the spot models, for clients that parse many
+spots and never save them.  They use __slots__ instead of Django model
+instances but keep the same attribute names as
+spotseeker_restclient.models.spot.  A Spot's nested collections are only
+parsed the first time they are read.
+"""
+from django.utils.dateparse import parse_datetime, parse_time
+
+
+_UNPARSED = object()
+
+
+def _lazy(name, parse):
+    """
+    Returns a property that fills the _<name> slot from parse(self) on
+    first access.
+    """
+    slot = "_" + name
+
+    def getter(self):
+        value = getattr(self, slot)
+        if value is _UNPARSED:
+            value = parse(self)
+            setattr(self, slot, value)
+        return value
+
+    def setter(self, value):
+        setattr(self, slot, value)
+
+    return property(getter, setter)
+
+
+def _extended_info_from_data(info_data):
+    return [SpotExtendedInfo(key=key, value=info_data[key])
+            for key in info_data]
+
+
+class SpotType(object):
+    """ The type of Spot.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name=None):
+        self.name = name
+
+
+class SpotAvailableHours(object):
+    """
+    The hours a Spot is available, i.e. the open or closed hours for the
+    building the spot is located in.
+    """
+    __slots__ = ("day", "start_time", "end_time")
+
+    def __init__(self, day=None, start_time=None, end_time=None):
+        self.day = day
+        self.start_time = start_time
+        self.end_time = end_time
+
+
+class SpotExtendedInfo(object):
+    """
+    Additional institution-provided metadata about a spot.
+    """
+    __slots__ = ("key", "value")
+
+    def __init__(self, key=None, value=None):
+        self.key = key
+        self.value = value
+
+
+class SpotImage(object):
+    """
+    An image of a Spot.
+    """
+    __slots__ = ("image_id", "url", "description", "display_index",
+                 "content_type", "width", "height", "creation_date",
+                 "modification_date", "upload_user", "upload_application",
+                 "thumbnail_root")
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.get(attr))
+
+    @classmethod
+    def from_data(cls, image):
+        spot_image = cls()
+        spot_image.image_id = image["id"]
+        spot_image.url = image["url"]
+        spot_image.description = image["description"]
+        spot_image.display_index = image["display_index"]
+        spot_image.content_type = image["content-type"]
+        spot_image.width = image["width"]
+        spot_image.height = image["height"]
+        spot_image.creation_date = parse_datetime(image["creation_date"])
+        spot_image.modification_date = \
+            parse_datetime(image["modification_date"])
+        spot_image.upload_user = image["upload_user"]
+        spot_image.upload_application = image["upload_application"]
+        spot_image.thumbnail_root = image["thumbnail_root"]
+        return spot_image
+
+
+class ItemImage(object):
+    """
+    An image of a SpotItem.
+    """
+    __slots__ = ("image_id", "url", "description", "display_index",
+                 "content_type", "width", "height", "creation_date",
+                 "upload_user", "upload_application", "thumbnail_root")
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.get(attr))
+
+    @classmethod
+    def from_data(cls, image):
+        item_image = cls()
+        item_image.image_id = image["id"]
+        item_image.url = image["url"]
+        item_image.description = image["description"]
+        item_image.display_index = image["display_index"]
+        item_image.content_type = image["content-type"]
+        item_image.width = image["width"]
+        item_image.height = image["height"]
+        item_image.creation_date = parse_datetime(image["creation_date"])
+        item_image.upload_user = image["upload_user"]
+        item_image.upload_application = image["upload_application"]
+        item_image.thumbnail_root = image["thumbnail_root"]
+        return item_image
+
+
+class SpotItem(object):
+    """
+    An item, such as a piece of equipment, that belongs to a Spot.
+    """
+    __slots__ = ("item_id", "name", "category", "subcategory",
+                 "_images", "_extended_info", "_data")
+
+    def __init__(self, item_id=None, name=None, category=None,
+                 subcategory=None):
+        self.item_id = item_id
+        self.name = name
+        self.category = category
+        self.subcategory = subcategory
+        self._images = []
+        self._extended_info = []
+        self._data = None
+
+    images = _lazy("images", lambda self: [
+        ItemImage.from_data(image) for image in self._data.get("images", [])])
+    extended_info = _lazy("extended_info", lambda self:
+                          _extended_info_from_data(
+                              self._data["extended_info"]))
+
+    @classmethod
+    def from_data(cls, item):
+        spot_item = cls(item_id=item["id"],
+                        name=item["name"],
+                        category=item["category"],
+                        subcategory=item["subcategory"])
+        spot_item._data = item
+        spot_item._images = _UNPARSED
+        spot_item._extended_info = _UNPARSED
+        return spot_item
+
+
+def _spot_availability_from_data(availability_data):
+    availability = []
+    for day in availability_data:
+        for hours in availability_data[day]:
+            availability.append(
+                SpotAvailableHours(day=day,
+                                   start_time=parse_time(hours[0]),
+                                   end_time=parse_time(hours[1])))
+    return availability
+
+
+class Spot(object):
+    """ Represents a place for students to study.
+    """
+    __slots__ = ("spot_id", "name", "uri", "thumbnail_root", "latitude",
+                 "longitude", "height_from_sea_level", "building_name",
+                 "floor", "room_number", "building_description", "capacity",
+                 "display_access_restrictions", "organization", "manager",
+                 "etag", "last_modified", "external_id",
+                 "_spot_types", "_spot_availability", "_images",
+                 "_extended_info", "_items", "_data")
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            if attr.startswith("_"):
+                setattr(self, attr, [])
+            else:
+                setattr(self, attr, kwargs.get(attr))
+        self._data = None
+
+    spot_types = _lazy("spot_types", lambda self: [
+        SpotType(name=spot_type) for spot_type in self._data["type"]])
+    spot_availability = _lazy("spot_availability", lambda self:
+                              _spot_availability_from_data(
+                                  self._data["available_hours"]))
+    images = _lazy("images", lambda self: [
+        SpotImage.from_data(image) for image in self._data["images"]])
+    extended_info = _lazy("extended_info", lambda self:
+                          _extended_info_from_data(
+                              self._data["extended_info"]))
+    items = _lazy("items", lambda self: [
+        SpotItem.from_data(item) for item in self._data.get("items", [])])
+
+    @classmethod
+    def from_data(cls, spot_data):
+        spot = cls()
+        location = spot_data["location"]
+
+        spot.spot_id = spot_data["id"]
+        spot.name = spot_data["name"]
+        spot.uri = spot_data["uri"]
+        spot.latitude = location["latitude"]
+        spot.longitude = location["longitude"]
+        spot.height_from_sea_level = location["height_from_sea_level"]
+        spot.building_name = location["building_name"]
+        spot.building_description = location.get("description", None)
+        spot.floor = location["floor"]
+        spot.room_number = location["room_number"]
+        spot.capacity = spot_data["capacity"]
+        spot.display_access_restrictions = \
+            spot_data["display_access_restrictions"]
+        spot.organization = spot_data["organization"]
+        spot.manager = spot_data["manager"]
+        spot.etag = spot_data["etag"]
+        spot.external_id = spot_data["external_id"]
+        spot.last_modified = parse_datetime(spot_data["last_modified"])
+
+        spot._data = spot_data
+        spot._spot_types = _UNPARSED
+        spot._spot_availability = _UNPARSED
+        spot._images = _UNPARSED
+        spot._extended_info = _UNPARSED
+        spot._items = _UNPARSED
+        return spot
@@ -1,11 +1,18 @@
 from django.db import models
 
 
+# These are built from the server's JSON and never saved, so Django
+# doesn't create or migrate tables for them.
+
+
 class SpotType(models.Model):
     """ The type of Spot.
     """
     name = models.SlugField(max_length=50)
 
+    class Meta:
+        managed = False
+
 
 class SpotAvailableHours(models.Model):
     """
@@ -18,6 +25,9 @@ class SpotAvailableHours(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
 
+    class Meta:
+        managed = False
+
 
 class SpotExtendedInfo(models.Model):
     """
@@ -27,6 +37,9 @@ class SpotExtendedInfo(models.Model):
     key = models.CharField(max_length=50)
     value = models.CharField(max_length=255)
 
+    class Meta:
+        managed = False
+
 
 class SpotImage(models.Model):
     """
@@ -47,6 +60,9 @@ class SpotImage(models.Model):
     upload_user = models.CharField(max_length=40)
     upload_application = models.CharField(max_length=100)
 
+    class Meta:
+        managed = False
+
 
 class Spot(models.Model):
     """ Represents a place for students to study.
@@ -77,6 +93,9 @@ class Spot(models.Model):
                                    default=None,
                                    unique=True)
 
+    class Meta:
+        managed = False
+
 
 class SpotItem(models.Model):
     item_id = models.IntegerField()
@@ -84,6 +103,9 @@ class SpotItem(models.Model):
     category = models.CharField(max_length=255)
     subcategory = models.CharField(max_length=255)
 
+    class Meta:
+        managed = False
+
 
 class ItemImage(models.Model):
     image_id = models.IntegerField()
@@ -95,3 +117,6 @@ class ItemImage(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     upload_user = models.CharField(max_length=40)
     upload_application = models.CharField(max_length=100)
+
+    class Meta:
+        managed = False
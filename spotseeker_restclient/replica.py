@@ -0,0 +1,364 @@
+"""
+A local replica of the spots, answering search_spots queries in-process
+instead of sending them to the server.
+"""
+from spotseeker_restclient.spotseeker import Spotseeker
+from spotseeker_restclient.geo_index import SpotGeoIndex, distance
+from spotseeker_restclient.availability import AvailabilityIndex, DAYS, \
+    week_minute
+from spotseeker_restclient.attribute_index import AttributeIndex, \
+    ITEM, ITEM_EXTENDED_INFO, ITEM_FIELDS
+from django.utils.dateparse import parse_datetime, parse_time
+from django.utils.encoding import force_text
+from django.utils import timezone
+from collections import deque, namedtuple
+import threading
+
+
+# The server's default page size, when no limit is given
+DEFAULT_LIMIT = 20
+
+
+class SpotChange(namedtuple("SpotChange", ["sequence", "action", "spot_id",
+                                           "spot", "previous"])):
+    """
+    One entry in a SpotReplica's change feed.  action is "added", "changed"
+    or "deleted"; spot is the new Spot (None when deleted) and previous the
+    one it replaced (None when added).
+    """
+    __slots__ = ()
+
+
+class UnsupportedQuery(Exception):
+    """
+    Raised for query parameters the replica can't evaluate locally.
+    """
+    pass
+
+
+def parse_day_time(value):
+    """
+    Parses a "Tuesday,10:30" query value into a minute of the week.
+    """
+    try:
+        day, time = value.split(",")
+        parsed = parse_time(time.strip())
+        if parsed is None:
+            raise ValueError(value)
+        return week_minute(day.strip(), parsed)
+    except ValueError:
+        raise UnsupportedQuery("Bad day and time: %s" % value)
+
+
+def _now_minute():
+    now = timezone.localtime(timezone.now())
+    return week_minute(DAYS[now.weekday()], now.time())
+
+
+def _is_true(value):
+    return force_text(value).lower() in ("true", "1", "yes", "on")
+
+
+class SpotReplica(object):
+    """
+    Holds every spot, loaded once with all_spots, and evaluates
+    search_spots queries against them.  Queries with parameters the
+    replica can't evaluate are sent to the server as usual.
+
+    Supported parameters: limit, center_latitude, center_longitude,
+    distance, type, capacity, building_name, extended_info:<key>,
+    extended_info:or_group..., item:<field>, item:extended_info:<key>,
+    has_items, open_now (or open), open_at, open_until and
+    fuzzy_hours_start/fuzzy_hours_end.
+    """
+    def __init__(self, client=None, max_changes=10000):
+        self.client = client or Spotseeker()
+        self.spots = None
+        self.manifest = {}
+        self.geo_index = SpotGeoIndex()
+        self.availability = AvailabilityIndex()
+        self.attributes = AttributeIndex()
+        self.sequence = 0
+        self._spots_by_id = {}
+        self._changes = deque(maxlen=max_changes)
+        self._lock = threading.Lock()
+
+    def load(self, spots=None):
+        """
+        Replaces the replica's spots with the passed ones, or with a fresh
+        copy of all_spots.  This doesn't add to the change feed.
+        """
+        if spots is None:
+            spots = self.client.all_spots()
+        self._set_spots(list(spots))
+
+    def _set_spots(self, spots, changes=None):
+        spots_by_id = {}
+        manifest = {}
+        for spot in spots:
+            spot_id = str(spot.spot_id)
+            spots_by_id[spot_id] = spot
+            manifest[spot_id] = (spot.etag, spot.last_modified)
+
+        with self._lock:
+            self.spots = spots
+            self._spots_by_id = spots_by_id
+            self.manifest = manifest
+
+            if changes is None:
+                self.geo_index = SpotGeoIndex(spots)
+                self.availability = AvailabilityIndex(spots)
+                self.attributes = AttributeIndex(spots)
+                changes = []
+
+            recorded = []
+            for action, spot_id, spot, previous in changes:
+                self.sequence += 1
+                change = SpotChange(self.sequence, action, spot_id, spot,
+                                    previous)
+                self._changes.append(change)
+                recorded.append(change)
+
+            self.geo_index.update(recorded)
+            self.availability.update(recorded)
+            self.attributes.update(recorded)
+        return recorded
+
+    def _is_unchanged(self, spot_id, spot_data):
+        if spot_id not in self.manifest:
+            return False
+        etag, last_modified = self.manifest[spot_id]
+        if etag or spot_data.get("etag"):
+            return etag == spot_data.get("etag")
+        return last_modified == parse_datetime(spot_data["last_modified"])
+
+    def refresh(self):
+        """
+        Brings the replica up to date with all_spots.  The manifest of
+        (etag, last_modified) per spot decides which spots changed; only
+        those are parsed, and unchanged spots keep their Spot objects.
+        Returns the list of SpotChanges, which are also added to the
+        change feed.
+        """
+        if self.spots is None:
+            previous = {}
+        else:
+            previous = self._spots_by_id
+
+        spots = []
+        seen = set()
+        changes = []
+        for spot_data in self.client.iter_all_spot_data():
+            spot_id = str(spot_data["id"])
+            seen.add(spot_id)
+            old = previous.get(spot_id)
+
+            if old is not None and self._is_unchanged(spot_id, spot_data):
+                spots.append(old)
+                continue
+
+            spot = self.client.spot_from_data(spot_data)
+            spots.append(spot)
+            if old is None:
+                changes.append(("added", spot_id, spot, None))
+            else:
+                changes.append(("changed", spot_id, spot, old))
+
+        for spot_id in previous:
+            if spot_id not in seen:
+                changes.append(("deleted", spot_id, None, previous[spot_id]))
+
+        return self._set_spots(spots, changes)
+
+    def changes(self, since=0):
+        """
+        Iterates over the SpotChanges in the feed with a sequence number
+        after since.  Consumers can pass the last sequence they saw to
+        pick up where they left off; the feed keeps the latest
+        max_changes entries.
+        """
+        with self._lock:
+            changes = list(self._changes)
+        for change in changes:
+            if change.sequence > since:
+                yield change
+
+    def _get_spots(self):
+        if self.spots is None:
+            self.load()
+        return self.spots
+
+    def all_spots(self):
+        return list(self._get_spots())
+
+    def get_spot_by_id(self, spot_id):
+        self._get_spots()
+        spot = self._spots_by_id.get(str(spot_id))
+        if spot is None:
+            return self.client.get_spot_by_id(spot_id)
+        return spot
+
+    def closing_soon(self, within=30):
+        """
+        Returns (minutes until closing, spot) for the spots that are open
+        now and close within the given number of minutes, soonest first.
+        """
+        self._get_spots()
+        return [(minutes, self._spots_by_id[spot_id]) for minutes, spot_id
+                in self.availability.closing_soon(_now_minute(), within)]
+
+    def search_spots(self, query_tuple):
+        """
+        Returns a list of spots matching the passed parameters.
+        """
+        spots = self._get_spots()
+        try:
+            return self._search(spots, query_tuple)
+        except UnsupportedQuery:
+            return self.client.search_spots(query_tuple)
+
+    def _parse_query(self, query_tuple):
+        if hasattr(query_tuple, "items"):
+            query_tuple = query_tuple.items()
+
+        query = {}
+        for key, value in query_tuple:
+            query.setdefault(force_text(key), []).append(value)
+        return query
+
+    def _search(self, spots, query_tuple):
+        query = self._parse_query(query_tuple)
+        filters = []
+
+        limit = DEFAULT_LIMIT
+        center = None
+        max_distance = None
+
+        for key, values in query.items():
+            value = values[-1]
+            try:
+                if key == "limit":
+                    limit = int(value)
+                elif key in ("center_latitude", "center_longitude",
+                             "distance"):
+                    float(value)
+                elif key == "capacity":
+                    filters.append(self._capacity_filter(int(value)))
+                else:
+                    filters.append(self._filter(key, values, query))
+            except (TypeError, ValueError):
+                raise UnsupportedQuery("Bad value for %s" % key)
+
+        if "center_latitude" in query or "center_longitude" in query or \
+                "distance" in query:
+            try:
+                center = (float(query["center_latitude"][-1]),
+                          float(query["center_longitude"][-1]))
+                max_distance = float(query["distance"][-1])
+            except KeyError:
+                raise UnsupportedQuery("Incomplete location search")
+
+        if center is not None:
+            # Spots in range, nearest first.  With nothing else to match,
+            # the index can stop once it has found limit spots.
+            radius_limit = limit if limit and not filters else None
+            spots = [spot for spot_distance, spot in
+                     self.geo_index.radius(center[0], center[1],
+                                           max_distance, radius_limit)]
+
+        results = [spot for spot in spots
+                   if all(match(spot) for match in filters)]
+        if limit:
+            results = results[:limit]
+        return results
+
+    def _capacity_filter(self, capacity):
+        def match(spot):
+            return spot.capacity is not None and spot.capacity >= capacity
+        return match
+
+    def _filter(self, key, values, query):
+        """
+        Returns a function that tests whether a spot matches one query
+        parameter.
+        """
+        if key == "type":
+            types = set(values)
+            return lambda spot: any(spot_type.name in types
+                                    for spot_type in spot.spot_types)
+
+        if key == "building_name":
+            names = set(values)
+            return lambda spot: spot.building_name in names
+
+        if key.startswith("extended_info:or_group"):
+            return self._attribute_filter(self.attributes.any_true(values))
+
+        if key.startswith("extended_info:"):
+            info_key = key[len("extended_info:"):]
+            if ":" in info_key:
+                raise UnsupportedQuery(key)
+            return self._attribute_filter(
+                self.attributes.lookup(info_key, values))
+
+        if key.startswith("item:extended_info:"):
+            info_key = key[len("item:extended_info:"):]
+            return self._attribute_filter(
+                self.attributes.lookup(info_key, values,
+                                       field=ITEM_EXTENDED_INFO))
+
+        if key.startswith("item:"):
+            field = key[len("item:"):]
+            if field not in ITEM_FIELDS:
+                raise UnsupportedQuery(key)
+            return self._attribute_filter(
+                self.attributes.lookup(field, values, field=ITEM))
+
+        if key == "has_items":
+            wanted = _is_true(values[-1])
+            return lambda spot: (len(spot.items) > 0) == wanted
+
+        if key in ("open_now", "open"):
+            if not _is_true(values[-1]):
+                return lambda spot: True
+            return self._id_filter(
+                self.availability.open_at(_now_minute()))
+
+        if key == "open_at":
+            start = parse_day_time(values[-1])
+            if "open_until" not in query:
+                return self._id_filter(self.availability.open_at(start))
+            end = parse_day_time(query["open_until"][-1])
+            if end < start:
+                raise UnsupportedQuery("open_until before open_at")
+            hours = self.availability.hours
+            return lambda spot: any(window_start <= start and end <= window_end
+                                    for window_start, window_end
+                                    in hours(spot.spot_id))
+
+        if key == "open_until":
+            if "open_at" not in query:
+                raise UnsupportedQuery("open_until without open_at")
+            return lambda spot: True
+
+        if key == "fuzzy_hours_start":
+            start = parse_day_time(values[-1])
+            if "fuzzy_hours_end" in query:
+                end = parse_day_time(query["fuzzy_hours_end"][-1])
+            else:
+                end = start
+            return self._id_filter(
+                self.availability.open_between(start, end))
+
+        if key == "fuzzy_hours_end":
+            if "fuzzy_hours_start" not in query:
+                raise UnsupportedQuery("fuzzy_hours_end without start")
+            return lambda spot: True
+
+        raise UnsupportedQuery(key)
+
+    def _id_filter(self, spot_ids):
+        return lambda spot: str(spot.spot_id) in spot_ids
+
+    def _attribute_filter(self, bitmap):
+        return self._id_filter(self.attributes.spot_ids(bitmap))
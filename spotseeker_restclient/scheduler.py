@@ -0,0 +1,235 @@
+"""
+Schedules Live DAO requests to each host, so that bulk work doesn't
+crowd out interactive requests.
+
+With the SPOTSEEKER_SCHEDULER setting on, every request waits for a slot
+from its host's RequestScheduler.  Requests are interactive unless made
+inside
+
+    with priority(BULK):
+        ...
+
+Bulk requests only get a slot when no interactive request is waiting,
+and never take the last SPOTSEEKER_SCHEDULER_RESERVE (20%) of the
+slots, though they always have at least one: with a limit of 1 or 2,
+bulk requests can take a slot the reserve would keep.  The number of slots adapts: it grows by one per window of
+requests that finish within SPOTSEEKER_SCHEDULER_LATENCY_TARGET (1s),
+and halves on an error, 429 or 5xx, or a slower response.  Requests can
+also be rate limited to SPOTSEEKER_SCHEDULER_RATE per second, in bursts
+of up to SPOTSEEKER_SCHEDULER_BURST (the rate, and at least 1).
+"""
+from spotseeker_restclient.instrumentation import Histogram
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+DEFAULT_INITIAL_LIMIT = 10
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 50
+DEFAULT_RESERVE = 0.2
+DEFAULT_LATENCY_TARGET = 1.0
+DECREASE_FACTOR = 0.5
+
+_local = threading.local()
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def current_priority():
+    return getattr(_local, "priority", INTERACTIVE)
+
+
+@contextmanager
+def priority(name):
+    """
+    Requests made inside the block are scheduled with priority name,
+    INTERACTIVE or BULK.
+    """
+    if name not in (INTERACTIVE, BULK):
+        raise ValueError("Unknown priority: %s" % name)
+    previous = current_priority()
+    _local.priority = name
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class RequestScheduler(object):
+    """
+    Hands out request slots for one host; see the module docstring.  Call
+    acquire() before a request and release() after it.
+    """
+    def __init__(self, host):
+        self.host = host
+        self.min_limit = getattr(settings, "SPOTSEEKER_SCHEDULER_MIN_LIMIT",
+                                 DEFAULT_MIN_LIMIT)
+        self.max_limit = getattr(settings, "SPOTSEEKER_SCHEDULER_MAX_LIMIT",
+                                 DEFAULT_MAX_LIMIT)
+        self.limit = float(getattr(settings,
+                                   "SPOTSEEKER_SCHEDULER_INITIAL_LIMIT",
+                                   DEFAULT_INITIAL_LIMIT))
+        self.reserve = getattr(settings, "SPOTSEEKER_SCHEDULER_RESERVE",
+                               DEFAULT_RESERVE)
+        self.latency_target = getattr(
+            settings, "SPOTSEEKER_SCHEDULER_LATENCY_TARGET",
+            DEFAULT_LATENCY_TARGET)
+        self.rate = getattr(settings, "SPOTSEEKER_SCHEDULER_RATE", None)
+        # A request needs a whole token, so a rate under 1 per second
+        # still needs a burst of 1
+        self.burst = getattr(settings, "SPOTSEEKER_SCHEDULER_BURST",
+                             max(1, self.rate or 0))
+        if self.rate and self.burst < 1:
+            raise ImproperlyConfigured("SPOTSEEKER_SCHEDULER_BURST must be "
+                                       "at least 1")
+
+        self.in_flight = 0
+        self._tokens = self.burst
+        self._refilled = time.time()
+        self._last_decrease = 0
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self._admitted = {INTERACTIVE: 0, BULK: 0}
+        self._timeouts = {INTERACTIVE: 0, BULK: 0}
+        self._wait_times = {INTERACTIVE: Histogram(), BULK: Histogram()}
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=None, deadline=None):
+        """
+        Waits for a slot, returning True, or False if deadline (a
+        time.time()) passes first.
+        """
+        if priority is None:
+            priority = current_priority()
+
+        start = time.time()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    wait = self._admit(priority)
+                    if wait == 0:
+                        break
+                    if deadline is not None:
+                        left = deadline - time.time()
+                        if left <= 0:
+                            self._timeouts[priority] += 1
+                            return False
+                        wait = left if wait is None else min(wait, left)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                # A bulk request may have been waiting on this one
+                self._cond.notify_all()
+
+            self.in_flight += 1
+            self._admitted[priority] += 1
+            self._wait_times[priority].add(time.time() - start)
+        return True
+
+    def _admit(self, priority):
+        """
+        Takes a slot, returning 0, or returns the seconds until one might
+        be free, or None to wait for a release.
+        """
+        capacity = int(self.limit)
+        if priority == BULK:
+            if self._waiting[INTERACTIVE]:
+                return None
+            reserved = int(math.ceil(self.limit * self.reserve))
+            # Not 0, as the limit only grows when requests finish, so
+            # bulk-only traffic would never get a slot again
+            capacity = max(1, capacity - reserved)
+        if self.in_flight >= capacity:
+            return None
+
+        if self.rate:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        return 0
+
+    def release(self, latency=None, failed=False):
+        """
+        Frees a slot, adjusting the limit by the request's latency and
+        whether it failed.  With no latency, e.g. for a request that was
+        never sent, the limit is left alone.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if failed or (latency is not None and
+                          latency > self.latency_target):
+                # Once per latency target, so one slow spell only counts
+                # once
+                now = time.time()
+                if now - self._last_decrease > self.latency_target:
+                    self.limit = max(self.min_limit,
+                                     self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Returns a dict of the current limit and requests in flight, and
+        for each priority the requests queued, admitted and timed out
+        waiting, and wait time percentiles.
+        """
+        with self._cond:
+            stats = {"limit": self.limit, "in_flight": self.in_flight}
+            for name in (INTERACTIVE, BULK):
+                stats[name] = {
+                    "queued": self._waiting[name],
+                    "admitted": self._admitted[name],
+                    "timeouts": self._timeouts[name],
+                    "wait": self._wait_times[name].summary(),
+                }
+        return stats
+
+
+def get_scheduler(host):
+    """
+    Returns the scheduler for host, or None unless the SPOTSEEKER_SCHEDULER
+    setting is on.
+    """
+    scheduler = _schedulers.get(host)
+    if scheduler is None:
+        if not getattr(settings, "SPOTSEEKER_SCHEDULER", False):
+            return None
+        with _schedulers_lock:
+            scheduler = _schedulers.get(host)
+            if scheduler is None:
+                scheduler = _schedulers[host] = RequestScheduler(host)
+    return scheduler
+
+
+def get_scheduler_stats():
+    """
+    Returns a dict of host to its scheduler's stats().
+    """
+    return dict((host, scheduler.stats())
+                for host, scheduler in list(_schedulers.items()))
+
+
+def reset_schedulers():
+    with _schedulers_lock:
+        _schedulers.clear()
+
+
+@receiver(setting_changed)
+def _settings_changed(sender, setting, **kwargs):
+    if setting.startswith("SPOTSEEKER_SCHEDULER"):
+        reset_schedulers()
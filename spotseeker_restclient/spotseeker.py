@@ -1,20 +1,106 @@
 import StringIO
 from spotseeker_restclient.dao import SPOTSEEKER_DAO
+from spotseeker_restclient.deadline import deadline, deadline_at, \
+    get_deadline
 from spotseeker_restclient.exceptions import DataFailureException
+from spotseeker_restclient.image_cache import stream_image
+from spotseeker_restclient.instrumentation import traced
+from spotseeker_restclient.scheduler import current_priority, priority
 from spotseeker_restclient.models.spot import Spot, SpotAvailableHours, \
     SpotExtendedInfo, SpotImage, SpotType, SpotItem, ItemImage
+from spotseeker_restclient.models import lightweight
 from spotseeker_restclient.dao_implementation.spotseeker import File
 import json
 from django.utils.dateparse import parse_datetime, parse_time
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from django.db import connection
 from urllib import urlencode
+from multiprocessing.pool import ThreadPool
 import requests
+import time
 from requests_oauthlib import OAuth1
 
 
+ALL_SPOTS_URL = "/api/v1/spot/all"
+
+
+def _iter_json_array(chunks):
+    """
+    Yields the items of a JSON array as its text arrives in chunks, so the
+    whole document never needs to be held at once.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = " \t\n\r"
+    buf = ""
+    pos = 0
+    started = False
+    chunks = iter(chunks)
+    more = True
+
+    while True:
+        try:
+            chunk = next(chunks)
+            buf = buf[pos:] + chunk
+        except StopIteration:
+            more = False
+            buf = buf[pos:]
+        pos = 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in whitespace:
+                pos += 1
+            if pos == len(buf):
+                break
+
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == "]":
+                return
+            if buf[pos] == ",":
+                pos += 1
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if more:
+                    break
+                raise
+
+            # A value is only complete once the delimiter after it has
+            # arrived, as a number like "3." may still be cut short.
+            next_pos = end
+            while next_pos < len(buf) and buf[next_pos] in whitespace:
+                next_pos += 1
+            if next_pos == len(buf) or buf[next_pos] not in ",]":
+                if more:
+                    break
+                raise ValueError("Expected ',' or ']' in JSON array")
+
+            pos = next_pos
+            yield item
+
+        if not more:
+            raise ValueError("Unterminated JSON array")
+
+
 class Spotseeker(object):
 
+    def __init__(self, lightweight=False):
+        """
+        With lightweight=True, spots are returned as the __slots__ based
+        classes in spotseeker_restclient.models.lightweight instead of
+        Django model instances.
+        """
+        self.lightweight = lightweight
+
+    @traced
     def post_image(self, spot_id, image):
         url = "api/v1/spot/%s/image" % spot_id
         dao = SPOTSEEKER_DAO()
@@ -41,6 +127,7 @@ class Spotseeker(object):
             except AttributeError:
                 raise ImproperlyConfigured("Must set OAUTH_ keys in settings")
 
+    @traced
     def delete_image(self, spot_id, image_id, etag):
         url = "/api/v1/spot/%s/image/%s" % (spot_id, image_id)
         dao = SPOTSEEKER_DAO()
@@ -59,6 +146,7 @@ class Spotseeker(object):
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
 
+    @traced
     def post_item_image(self, item_id, image):
         url = "api/v1/item/%s/image" % item_id
         dao = SPOTSEEKER_DAO()
@@ -85,6 +173,7 @@ class Spotseeker(object):
             except AttributeError as ex:
                 raise ImproperlyConfigured("Must set OAUTH_ keys in settings")
 
+    @traced
     def delete_item_image(self, item_id, image_id, etag):
         url = "/api/v1/item/%s/image/%s" % (item_id, image_id)
         dao = SPOTSEEKER_DAO()
@@ -103,6 +192,7 @@ class Spotseeker(object):
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
 
+    @traced
     def put_spot(self, spot_id, spot_json, etag):
         url = "/api/v1/spot/%s" % spot_id
         dao = SPOTSEEKER_DAO()
@@ -123,6 +213,7 @@ class Spotseeker(object):
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
 
+    @traced
     def delete_spot(self, spot_id, etag):
         url = "/api/v1/spot/%s" % spot_id
         dao = SPOTSEEKER_DAO()
@@ -140,6 +231,7 @@ class Spotseeker(object):
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
 
+    @traced
     def post_spot(self, spot_json):
         url = "/api/v1/spot/"
         dao = SPOTSEEKER_DAO()
@@ -162,48 +254,86 @@ class Spotseeker(object):
             raise DataFailureException(url, resp.status, content)
         return resp
 
-    def get_spot_by_id(self, spot_id):
+    @traced
+    def get_spot_by_id(self, spot_id, timeout=None):
+        """
+        Returns the spot.  With a timeout, in seconds, the request and any
+        retries must finish in that time.
+        """
         url = "/api/v1/spot/%s" % spot_id
         dao = SPOTSEEKER_DAO()
-        if isinstance(dao._getDAO(), File):
+        with deadline(timeout):
             resp = dao.getURL(url, {})
-            content = resp.data
-        else:
-            resp, content = dao.getURL(url, {})
+        content = resp.data
 
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
-        return self._spot_from_data(json.loads(content))
+        return self.spot_from_data(json.loads(content))
+
+    @traced
+    def get_spots_by_ids(self, spot_ids, max_workers=10, timeout=None):
+        """
+        Returns a list of spots for the passed ids, in the same order,
+        fetching them concurrently over at most max_workers threads.  A spot
+        that fails to load is returned as the DataFailureException raised
+        for it, so one bad id doesn't fail the whole batch.  With a
+        timeout, spots not loaded in time are DeadlineExceededExceptions.
+        """
+        spot_ids = list(spot_ids)
+        if not spot_ids:
+            return []
 
-    def get_building_list(self, campus, app_type=None):
+        when = get_deadline()
+        if timeout is not None:
+            when = min(when or float("inf"), time.time() + timeout)
+        request_priority = current_priority()
+
+        def fetch(spot_id):
+            try:
+                with deadline_at(when), priority(request_priority):
+                    return self.get_spot_by_id(spot_id)
+            except DataFailureException as ex:
+                return ex
+            finally:
+                # The cache opened a connection for this pool thread
+                connection.close()
+
+        pool = ThreadPool(max(1, min(max_workers, len(spot_ids))))
+        try:
+            return pool.map(fetch, spot_ids)
+        finally:
+            pool.close()
+            pool.join()
+
+    @traced
+    def get_building_list(self, campus, app_type=None, timeout=None):
         url = "/api/v1/buildings?extended_info:campus=" + campus
         if app_type:
             url += "&extended_info:app_type=" + app_type
 
         dao = SPOTSEEKER_DAO()
-        if isinstance(dao._getDAO(), File):
+        with deadline(timeout):
             resp = dao.getURL(url, {})
-            content = resp.data
-        else:
-            resp, content = dao.getURL(url, {})
+        content = resp.data
 
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
         return json.loads(content)
 
-    def search_spots(self, query_tuple):
+    @traced
+    def search_spots(self, query_tuple, timeout=None):
         """
-        Returns a list of spots matching the passed parameters.
+        Returns a list of spots matching the passed parameters.  With a
+        timeout, in seconds, the request and any retries must finish in
+        that time.
         """
 
         dao = SPOTSEEKER_DAO()
         url = "/api/v1/spot?" + urlencode(query_tuple)
 
-        if isinstance(dao._getDAO(), File):
+        with deadline(timeout):
             resp = dao.getURL(url, {})
-            content = resp.data
-        else:
-            resp, content = dao.getURL(url, {})
+        content = resp.data
 
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
@@ -212,23 +342,65 @@ class Spotseeker(object):
 
         spots = []
         for res in results:
-            spots.append(self._spot_from_data(res))
+            spots.append(self.spot_from_data(res))
 
         return spots
 
-    def all_spots(self):
+    def iter_search_spots(self, query_tuple, chunk_size=2 ** 16):
+        """
+        Yields the spots matching the passed parameters one at a time,
+        parsing the response as it is read.
+        """
+        url = "/api/v1/spot?" + urlencode(query_tuple)
+        return self._iter_spots(url, chunk_size)
+
+    def iter_all_spots(self, chunk_size=2 ** 16):
+        """
+        Yields every spot one at a time, parsing the response as it is
+        read.
+        """
+        return self._iter_spots(ALL_SPOTS_URL, chunk_size)
+
+    def _iter_spots(self, url, chunk_size):
+        for spot_data in self._iter_spot_data(url, chunk_size):
+            yield self.spot_from_data(spot_data)
+
+    def iter_all_spot_data(self, chunk_size=2 ** 16):
+        """
+        Yields the decoded JSON for every spot, without building Spot
+        objects; pass the ones wanted to spot_from_data().
+        """
+        return self._iter_spot_data(ALL_SPOTS_URL, chunk_size)
+
+    def _iter_spot_data(self, url, chunk_size=2 ** 16):
+        """
+        Yields the decoded JSON for each spot in the response, without
+        building Spot objects.
+        """
+        dao = SPOTSEEKER_DAO()
+        resp = dao.streamURL(url, {})
+
+        try:
+            if resp.status != 200:
+                raise DataFailureException(url, resp.status, resp.data)
+
+            for spot_data in _iter_json_array(resp.stream(chunk_size)):
+                yield spot_data
+        finally:
+            resp.release_conn()
+
+    @traced
+    def all_spots(self, timeout=None):
         """
         Returns a list of all spots.
         """
 
         dao = SPOTSEEKER_DAO()
-        url = "/api/v1/spot/all"
+        url = ALL_SPOTS_URL
 
-        if isinstance(dao._getDAO(), File):
+        with deadline(timeout):
             resp = dao.getURL(url, {})
-            content = resp.data
-        else:
-            resp, content = dao.getURL(url, {})
+        content = resp.data
 
         if resp.status != 200:
             raise DataFailureException(url, resp.status, content)
@@ -237,11 +409,18 @@ class Spotseeker(object):
 
         spots = []
         for res in results:
-            spots.append(self._spot_from_data(res))
+            spots.append(self.spot_from_data(res))
 
         return spots
 
-    def _spot_from_data(self, spot_data):
+    def spot_from_data(self, spot_data):
+        """
+        Returns the spot for its decoded JSON, as a lightweight Spot with
+        lightweight=True.
+        """
+        if self.lightweight:
+            return lightweight.Spot.from_data(spot_data)
+
         spot = Spot()
 
         spot.spot_id = spot_data["id"]
@@ -365,27 +544,161 @@ class Spotseeker(object):
             extended_info.append(spot_extended_info)
         return extended_info
 
+    @traced
     def get_item_image(self, parent_id, image_id, width=None):
         return self._get_image("item", parent_id, image_id, width)
 
+    @traced
     def get_spot_image(self, parent_id, image_id, width=None):
         return self._get_image("spot", parent_id, image_id, width)
 
     def _get_image(self, image_app_type, parent_id, image_id, width=None):
         dao = SPOTSEEKER_DAO()
+        url = self._image_url(image_app_type, parent_id, image_id, width)
+        resp = dao.getURL(url, {})
+        content = resp.data
+        return resp, content
+
+    def _image_url(self, image_app_type, parent_id, image_id, width=None):
         if width is not None:
-            url = "/api/v1/%s/%s/image/%s/thumb/constrain/width:%s" % (
+            return "/api/v1/%s/%s/image/%s/thumb/constrain/width:%s" % (
                 image_app_type,
                 parent_id,
                 image_id,
                 width)
-        else:
-            url = "/api/v1/%s/%s/image/%s" % (image_app_type,
-                                              parent_id,
-                                              image_id)
-        if isinstance(dao._getDAO(), File):
-            resp = dao.getURL(url, {})
-            content = resp.data
-        else:
-            resp, content = dao.getURL(url, {})
-        return resp, content
+        return "/api/v1/%s/%s/image/%s" % (image_app_type,
+                                           parent_id,
+                                           image_id)
+
+    @traced
+    def stream_spot_image(self, parent_id, image_id, width=None):
+        """
+        Returns an ImageStream of the image, or of its thumbnail when a
+        width is given, to be read in chunks.  With
+        SPOTSEEKER_IMAGE_CACHE_DIR set, images are cached on disk; see
+        spotseeker_restclient.image_cache.
+        """
+        return self._stream_image("spot", parent_id, image_id, width)
+
+    @traced
+    def stream_item_image(self, parent_id, image_id, width=None):
+        return self._stream_image("item", parent_id, image_id, width)
+
+    def _stream_image(self, image_app_type, parent_id, image_id, width=None):
+        url = self._image_url(image_app_type, parent_id, image_id, width)
+        key = (image_app_type, parent_id, image_id, width)
+        image = stream_image(SPOTSEEKER_DAO(), key, url)
+
+        if image.status != 200:
+            raise DataFailureException(url, image.status, "".join(image))
+        return image
+
+
+def _call_and_close_connection(method, args, kwargs, request_priority):
+    """
+    Runs method on a pool thread with the caller's scheduling priority,
+    then closes the DB connection the cache opened for that thread.
+    """
+    try:
+        with priority(request_priority):
+            return method(*args, **kwargs)
+    finally:
+        connection.close()
+
+
+class AsyncSpotseeker(object):
+    """
+    A non-blocking wrapper around Spotseeker.  Each method starts the call
+    on a shared pool of worker threads and returns immediately with an
+    AsyncResult; call .get(timeout) on it for the value, or to re-raise
+    the DataFailureException.  The same DAO and cache settings apply.
+    """
+    def __init__(self, max_workers=20, client=None):
+        self.max_workers = max_workers
+        self.client = client or Spotseeker()
+        self._pool = None
+
+    def _submit(self, method, *args, **kwargs):
+        if self._pool is None:
+            self._pool = ThreadPool(self.max_workers)
+        return self._pool.apply_async(_call_and_close_connection,
+                                      (getattr(self.client, method), args,
+                                       kwargs, current_priority()))
+
+    def close(self):
+        """
+        Waits for calls in flight and shuts down the worker threads.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_spot_by_id(self, spot_id, timeout=None):
+        return self._submit("get_spot_by_id", spot_id, timeout)
+
+    def get_spots_by_ids(self, spot_ids, max_workers=10, timeout=None):
+        return self._submit("get_spots_by_ids", spot_ids, max_workers,
+                            timeout)
+
+    def search_spots(self, query_tuple, timeout=None):
+        return self._submit("search_spots", query_tuple, timeout)
+
+    def iter_search_spots(self, query_tuple, chunk_size=2 ** 16):
+        """
+        Returns Spotseeker.iter_search_spots; the spots are read as the
+        generator is consumed, on the caller's thread.
+        """
+        return self.client.iter_search_spots(query_tuple, chunk_size)
+
+    def iter_all_spots(self, chunk_size=2 ** 16):
+        """
+        Returns Spotseeker.iter_all_spots; the spots are read as the
+        generator is consumed, on the caller's thread.
+        """
+        return self.client.iter_all_spots(chunk_size)
+
+    def all_spots(self, timeout=None):
+        return self._submit("all_spots", timeout)
+
+    def get_building_list(self, campus, app_type=None, timeout=None):
+        return self._submit("get_building_list", campus, app_type, timeout)
+
+    def put_spot(self, spot_id, spot_json, etag):
+        return self._submit("put_spot", spot_id, spot_json, etag)
+
+    def post_spot(self, spot_json):
+        return self._submit("post_spot", spot_json)
+
+    def delete_spot(self, spot_id, etag):
+        return self._submit("delete_spot", spot_id, etag)
+
+    def post_image(self, spot_id, image):
+        return self._submit("post_image", spot_id, image)
+
+    def delete_image(self, spot_id, image_id, etag):
+        return self._submit("delete_image", spot_id, image_id, etag)
+
+    def post_item_image(self, item_id, image):
+        return self._submit("post_item_image", item_id, image)
+
+    def delete_item_image(self, item_id, image_id, etag):
+        return self._submit("delete_item_image", item_id, image_id, etag)
+
+    def get_spot_image(self, parent_id, image_id, width=None):
+        return self._submit("get_spot_image", parent_id, image_id, width)
+
+    def get_item_image(self, parent_id, image_id, width=None):
+        return self._submit("get_item_image", parent_id, image_id, width)
+
+    def stream_spot_image(self, parent_id, image_id, width=None):
+        return self._submit("stream_spot_image", parent_id, image_id, width)
+
+    def stream_item_image(self, parent_id, image_id, width=None):
+        return self._submit("stream_item_image", parent_id, image_id, width)
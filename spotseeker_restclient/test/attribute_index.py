@@ -0,0 +1,86 @@
+from django.test import TestCase
+from spotseeker_restclient.attribute_index import AttributeIndex, ITEM, \
+    ITEM_EXTENDED_INFO
+from spotseeker_restclient.models.lightweight import Spot, SpotItem, \
+    SpotExtendedInfo
+from spotseeker_restclient.replica import SpotChange
+
+
+def _spot(spot_id, info, items=()):
+    spot = Spot(spot_id=spot_id)
+    spot.extended_info = [SpotExtendedInfo(key=key, value=value)
+                          for key, value in info.items()]
+    spot.items = list(items)
+    return spot
+
+
+def _item(item_id, category, info):
+    item = SpotItem(item_id=item_id, name="Item %s" % item_id,
+                    category=category, subcategory="laptop")
+    item.extended_info = [SpotExtendedInfo(key=key, value=value)
+                          for key, value in info.items()]
+    return item
+
+
+class AttributeIndexTest(TestCase):
+
+    def setUp(self):
+        self.spots = [
+            _spot(1, {"app_type": "food", "s_cuisine_indian": "true",
+                      "campus": "seattle"}),
+            _spot(2, {"app_type": "food", "s_cuisine_bbq": "true",
+                      "s_cuisine_indian": "false", "campus": "bothell"}),
+            _spot(3, {"app_type": "tech", "campus": "seattle"},
+                  [_item(10, "Computers", {"i_brand": "Apple"}),
+                   _item(11, "Computers", {"i_brand": "Dell"})]),
+            _spot(4, {"campus": "tacoma"}),
+        ]
+        self.index = AttributeIndex(self.spots)
+
+    def ids(self, bitmap):
+        return sorted(self.index.spot_ids(bitmap))
+
+    def test_lookup(self):
+        index = self.index
+        self.assertEqual(self.ids(index.lookup("app_type", ["food"])),
+                         ["1", "2"])
+        self.assertEqual(self.ids(index.lookup("campus",
+                                               ["seattle", "tacoma"])),
+                         ["1", "3", "4"])
+        self.assertEqual(self.ids(index.lookup("missing", ["x"])), [])
+        self.assertEqual(self.ids(index.lookup("i_brand", ["Apple"],
+                                               field=ITEM_EXTENDED_INFO)),
+                         ["3"])
+        self.assertEqual(self.ids(index.lookup("id", ["11"], field=ITEM)),
+                         ["3"])
+        self.assertEqual(self.ids(index.all()), ["1", "2", "3", "4"])
+
+    def test_groups(self):
+        index = self.index
+        self.assertEqual(self.ids(index.any_true(["s_cuisine_indian",
+                                                  "s_cuisine_bbq"])),
+                         ["1", "2"])
+        self.assertEqual(self.ids(index.any_true(["s_cuisine_indian"])),
+                         ["1"])
+        self.assertEqual(self.ids(index.find(
+            [("app_type", "food"), ("app_type", "tech")],
+            [("campus", "seattle")])), ["1", "3"])
+        self.assertEqual(self.ids(index.find()), ["1", "2", "3", "4"])
+
+    def test_update(self):
+        index = self.index
+        changed = _spot(1, {"app_type": "tech"})
+        index.update([
+            SpotChange(1, "changed", "1", changed, self.spots[0]),
+            SpotChange(2, "deleted", "2", None, self.spots[1]),
+            SpotChange(3, "added", "5", _spot(5, {"app_type": "food"}),
+                       None),
+        ])
+        self.assertEqual(self.ids(index.lookup("app_type", ["food"])),
+                         ["5"])
+        self.assertEqual(self.ids(index.lookup("app_type", ["tech"])),
+                         ["1", "3"])
+        self.assertEqual(self.ids(index.any_true(["s_cuisine_indian",
+                                                  "s_cuisine_bbq"])), [])
+        self.assertEqual(len(index), 4)
+        self.assertEqual(self.ids(index.all()), ["1", "3", "4", "5"])
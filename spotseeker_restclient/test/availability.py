@@ -0,0 +1,87 @@
+from datetime import time
+from django.test import TestCase
+from spotseeker_restclient.availability import AvailabilityIndex, \
+    MINUTES_PER_WEEK, is_open_at, is_open_between, merge_hours, week_minute
+from spotseeker_restclient.models.lightweight import Spot, \
+    SpotAvailableHours
+from spotseeker_restclient.replica import SpotChange
+
+
+def _spot(spot_id, *hours):
+    spot = Spot(spot_id=spot_id)
+    spot.spot_availability = [
+        SpotAvailableHours(day=day, start_time=time(*start),
+                           end_time=time(*end))
+        for day, start, end in hours]
+    return spot
+
+
+class AvailabilityIndexTest(TestCase):
+
+    def setUp(self):
+        self.spots = [
+            _spot(1, ("monday", (8, 0), (17, 0)),
+                  ("tuesday", (8, 0), (12, 0)),
+                  ("tuesday", (13, 0), (17, 30))),
+            _spot(2, ("monday", (10, 0), (23, 59)),
+                  ("tuesday", (0, 0), (2, 0))),
+            _spot(3, ("sunday", (20, 0), (23, 59)),
+                  ("monday", (0, 0), (1, 0))),
+            _spot(4, ("wednesday", (9, 0), (9, 0))),
+            _spot(5),
+        ]
+        self.index = AvailabilityIndex(self.spots)
+
+    def test_matches_scan(self):
+        for minute in range(0, MINUTES_PER_WEEK, 7):
+            self.assertEqual(
+                self.index.open_at(minute),
+                set(str(spot.spot_id) for spot in self.spots
+                    if is_open_at(spot, minute)))
+
+        for start, end in ((0, 30), (600, 1500), (2159, 2160), (9000, 100),
+                           (MINUTES_PER_WEEK - 1, 0), (3000, 3000)):
+            self.assertEqual(
+                self.index.open_between(start, end),
+                set(str(spot.spot_id) for spot in self.spots
+                    if is_open_between(spot, start, end)))
+
+    def test_closing_soon(self):
+        monday_1630 = week_minute("monday", time(16, 30))
+        self.assertEqual(self.index.closing_soon(monday_1630, 30),
+                         [(30, "1")])
+        self.assertEqual(self.index.closing_soon(monday_1630, 29), [])
+
+        # Spot 2 is open across midnight, into Tuesday
+        monday_2350 = week_minute("monday", time(23, 50))
+        self.assertEqual(self.index.closing_soon(monday_2350, 60), [])
+        self.assertEqual(self.index.closing_soon(monday_2350, 130),
+                         [(130, "2")])
+
+        # ... and spot 3 across the end of the week
+        sunday_2345 = week_minute("sunday", time(23, 45))
+        self.assertEqual(self.index.closing_soon(sunday_2345, 75),
+                         [(75, "3")])
+
+    def test_update(self):
+        tuesday_noon = week_minute("tuesday", time(12, 15))
+        self.assertEqual(self.index.open_at(tuesday_noon), set())
+
+        changed = _spot(1, ("tuesday", (12, 0), (13, 0)))
+        self.index.update([
+            SpotChange(1, "changed", "1", changed, self.spots[0]),
+            SpotChange(2, "added", "6", _spot(6, ("tuesday", (6, 0),
+                                                  (18, 0))), None),
+            SpotChange(3, "deleted", "2", None, self.spots[1]),
+        ])
+        self.assertEqual(self.index.open_at(tuesday_noon), set(["1", "6"]))
+        self.assertEqual(self.index.open_at(60), set())
+        self.assertEqual(self.index.hours("1"),
+                         ((week_minute("tuesday", time(12, 0)),
+                           week_minute("tuesday", time(13, 0))),))
+        self.assertEqual(len(self.index), 5)
+
+    def test_merge_hours(self):
+        self.assertEqual(merge_hours([(50, 60), (0, 10), (10, 20), (5, 15),
+                                      (30, 30)]),
+                         [(0, 20), (50, 60)])
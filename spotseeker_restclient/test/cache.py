@@ -0,0 +1,278 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient.spotseeker import Spotseeker
+from spotseeker_restclient.cache_implementation import MemoryCache, \
+    MemoryStore, DjangoCache, ETagCache, TimeSimpleCache
+from spotseeker_restclient.dao import SPOTSEEKER_DAO
+from django.core.cache import caches
+from spotseeker_restclient.mock_http import MockHTTP
+from spotseeker_restclient.models import CacheEntry, CacheEntryTimed
+
+DAO = "spotseeker_restclient.dao_implementation.spotseeker.File"
+MEMORY_CACHE = "spotseeker_restclient.cache_implementation.MemoryCache"
+DJANGO_CACHE = "spotseeker_restclient.cache_implementation.DjangoCache"
+ETAG_CACHE = "spotseeker_restclient.cache_implementation.ETagCache"
+CONDITIONAL_DAO = "spotseeker_restclient.test.cache.ConditionalDAO"
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "spotseeker_restclient_tests",
+    }
+}
+
+
+def _response(data, status=200):
+    response = MockHTTP()
+    response.status = status
+    response.data = data
+    response.headers = {}
+    return response
+
+
+class ConditionalDAO(object):
+    """
+    Answers every GET with the same body, or a 304 when the request
+    carries its ETag.
+    """
+    requests = []
+    etag = '"abc"'
+
+    def getURL(self, url, headers):
+        ConditionalDAO.requests.append(dict(headers))
+        response = MockHTTP()
+        if headers.get("If-None-Match") == ConditionalDAO.etag:
+            response.status = 304
+            response.headers = {"ETag": ConditionalDAO.etag}
+        else:
+            response.status = 200
+            response.data = "body %s" % ConditionalDAO.etag
+            response.headers = {
+                "ETag": ConditionalDAO.etag,
+                "Last-Modified": "Mon, 07 Nov 1994 01:49:37 GMT",
+            }
+        return response
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=DAO,
+                   DAO_CACHE_CLASS=MEMORY_CACHE)
+class MemoryCacheTest(TestCase):
+
+    def setUp(self):
+        MemoryCache.reset()
+
+    def tearDown(self):
+        MemoryCache.reset()
+
+    def test_memory_hit(self):
+        spot_client = Spotseeker()
+        spot_client.get_spot_by_id('123')
+
+        store = MemoryCache.get_store()
+        self.assertEqual(store.stats()["entries"], 1)
+        self.assertEqual(CacheEntryTimed.objects.count(), 1)
+
+        spot = spot_client.get_spot_by_id('123')
+        self.assertEqual(spot.spot_id, "123")
+        self.assertEqual(store.stats()["hits"], 1)
+
+    def test_database_fallback(self):
+        spot_client = Spotseeker()
+        spot_client.get_spot_by_id('123')
+
+        # A fresh memory tier is filled from the database tier
+        MemoryCache.reset()
+        cache = MemoryCache()
+        hit = cache.getCache("spotseeker", "/api/v1/spot/123", {})
+        self.assertEqual(hit["response"].status, 200)
+        self.assertEqual(MemoryCache.get_store().stats()["entries"], 1)
+
+    def test_errors_not_kept_in_memory(self):
+        spot_client = Spotseeker()
+        self.assertRaises(Exception, spot_client.get_spot_by_id, 999)
+        self.assertEqual(MemoryCache.get_store().stats()["entries"], 0)
+
+
+class MemoryStoreTest(TestCase):
+
+    def test_lru_eviction(self):
+        store = MemoryStore(ttl=60, max_bytes=10)
+        store.set("a", _response("aaaa"))
+        store.set("b", _response("bbbb"))
+        store.get("a")
+        store.set("c", _response("cccc"))
+
+        self.assertEqual(store.get("b"), None)
+        self.assertEqual(store.get("a").data, "aaaa")
+        self.assertEqual(store.get("c").data, "cccc")
+
+        stats = store.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["bytes"], 8)
+
+    def test_oversized_entry(self):
+        store = MemoryStore(ttl=60, max_bytes=4)
+        store.set("a", _response("aaaaa"))
+        self.assertEqual(store.stats()["entries"], 0)
+
+    def test_ttl(self):
+        store = MemoryStore(ttl=-1, max_bytes=100)
+        store.set("a", _response("aaaa"))
+        self.assertEqual(store.get("a"), None)
+        self.assertEqual(store.stats()["expirations"], 1)
+        self.assertEqual(store.stats()["bytes"], 0)
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=DAO,
+                   DAO_CACHE_CLASS=DJANGO_CACHE,
+                   CACHES=LOCMEM_CACHES)
+class DjangoCacheTest(TestCase):
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_cached_response(self):
+        spot_client = Spotseeker()
+        spot_client.get_spot_by_id('123')
+
+        hit = DjangoCache().getCache("spotseeker", "/api/v1/spot/123", {})
+        self.assertEqual(hit["response"].status, 200)
+
+        spot = spot_client.get_spot_by_id('123')
+        self.assertEqual(spot.spot_id, "123")
+
+    @override_settings(SPOTSEEKER_CACHE_COMPRESS_MIN_BYTES=10)
+    def test_compression(self):
+        cache = DjangoCache()
+        cache.processResponse("spotseeker", "/api/v1/spot/all",
+                              _response("x" * 1000))
+
+        entry = caches["default"].get(cache._key("spotseeker",
+                                                 "/api/v1/spot/all"))
+        self.assertTrue(entry["compressed"])
+        self.assertTrue(len(entry["data"]) < 1000)
+
+        hit = cache.getCache("spotseeker", "/api/v1/spot/all", {})
+        self.assertEqual(hit["response"].data, "x" * 1000)
+
+    @override_settings(SPOTSEEKER_CACHE_TTLS=[(r"^/api/v1/spot\?", 0),
+                                              (r"/all$", 60)],
+                       SPOTSEEKER_CACHE_DEFAULT_TTL=30)
+    def test_url_ttls(self):
+        cache = DjangoCache()
+        self.assertEqual(cache._ttl("/api/v1/spot?limit=5"), 0)
+        self.assertEqual(cache._ttl("/api/v1/spot/all"), 60)
+        self.assertEqual(cache._ttl("/api/v1/spot/123"), 30)
+
+        cache.processResponse("spotseeker", "/api/v1/spot?limit=5",
+                              _response("[]"))
+        self.assertEqual(cache.getCache("spotseeker",
+                                        "/api/v1/spot?limit=5", {}), None)
+
+    def test_error_keeps_success(self):
+        cache = DjangoCache()
+        cache.processResponse("spotseeker", "/api/v1/spot/1",
+                              _response("{}"))
+        post = cache.processResponse("spotseeker", "/api/v1/spot/1",
+                                     _response("", status=500))
+        self.assertEqual(post["response"].status, 200)
+
+        hit = cache.getCache("spotseeker", "/api/v1/spot/1", {})
+        self.assertEqual(hit["response"].status, 200)
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=CONDITIONAL_DAO,
+                   DAO_CACHE_CLASS=ETAG_CACHE)
+class ETagCacheTest(TestCase):
+
+    def setUp(self):
+        ETagCache.reset_stats()
+        ConditionalDAO.requests = []
+        ConditionalDAO.etag = '"abc"'
+
+    def test_revalidation(self):
+        dao = SPOTSEEKER_DAO()
+        response = dao.getURL("/api/v1/spot/1", {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(ConditionalDAO.requests[0], {})
+
+        response = dao.getURL("/api/v1/spot/1", {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.data, 'body "abc"')
+        self.assertEqual(response.getheader("ETag"), '"abc"')
+        self.assertEqual(ConditionalDAO.requests[1], {
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Mon, 07 Nov 1994 01:49:37 GMT",
+        })
+
+        self.assertEqual(ETagCache.stats(),
+                         {"hits": 1, "revalidations": 1, "misses": 1})
+
+    def test_changed_resource(self):
+        dao = SPOTSEEKER_DAO()
+        dao.getURL("/api/v1/spot/1", {})
+
+        ConditionalDAO.etag = '"def"'
+        response = dao.getURL("/api/v1/spot/1", {})
+        self.assertEqual(response.data, 'body "def"')
+
+        dao.getURL("/api/v1/spot/1", {})
+        self.assertEqual(ConditionalDAO.requests[2]["If-None-Match"],
+                         '"def"')
+        self.assertEqual(ETagCache.stats(),
+                         {"hits": 1, "revalidations": 2, "misses": 1})
+
+
+class CacheEntryTest(TestCase):
+
+    def test_long_urls(self):
+        cache = TimeSimpleCache()
+        base = "/api/v1/spot?" + "&".join(["extended_info:app_type=food"] *
+                                          20)
+        for suffix in ("a", "b"):
+            cache.processResponse("spotseeker", base + suffix,
+                                  _response("body " + suffix))
+
+        self.assertTrue(len(base) > 255)
+        self.assertEqual(CacheEntryTimed.objects.count(), 2)
+        for suffix in ("a", "b"):
+            hit = cache.getCache("spotseeker", base + suffix, {})
+            self.assertEqual(hit["response"].data, "body " + suffix)
+        self.assertEqual(cache.getCache("spotseeker", base, {}), None)
+
+    @override_settings(SPOTSEEKER_CACHE_COMPRESS_MIN_BYTES=1024)
+    def test_storage(self):
+        for url, data in (("/small", "x" * 100), ("/large", "y" * 10000)):
+            entry = CacheEntry(service="spotseeker", url=url, status=200)
+            entry.content = data
+            entry.headers = {"ETag": '"abc"', "Content-Type": "text/plain"}
+            entry.save()
+
+        small = CacheEntry.objects.for_url("spotseeker", "/small").get()
+        self.assertFalse(small.compressed)
+        self.assertEqual(small.content, "x" * 100)
+
+        large = CacheEntry.objects.for_url("spotseeker", "/large").get()
+        self.assertTrue(large.compressed)
+        self.assertTrue(len(bytes(large.body)) < 1000)
+        self.assertEqual(large.content, "y" * 10000)
+        self.assertEqual(large.getHeaders()["ETag"], '"abc"')
+        self.assertEqual(large.header_json.count("abc"), 1)
+
+        # Updating metadata leaves the deferred body alone
+        entry = CacheEntry.objects.for_url("spotseeker",
+                                           "/large").defer("body").get()
+        entry.status = 404
+        with self.assertNumQueries(1):
+            entry.save()
+        large = CacheEntry.objects.for_url("spotseeker", "/large").get()
+        self.assertEqual((large.status, large.content), (404, "y" * 10000))
+
+    @override_settings(SPOTSEEKER_DAO_CLASS=CONDITIONAL_DAO,
+                       DAO_CACHE_CLASS=ETAG_CACHE)
+    def test_revalidation_skips_body(self):
+        SPOTSEEKER_DAO().getURL("/api/v1/spot/1", {})
+        entry = ETagCache()._get_entry("spotseeker", "/api/v1/spot/1",
+                                       defer_body=True)
+        self.assertEqual(entry.get_deferred_fields(), set(["body"]))
+        with self.assertNumQueries(1):
+            ETagCache().getCache("spotseeker", "/api/v1/spot/1", {})
@@ -0,0 +1,123 @@
+from datetime import timedelta
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+from spotseeker_restclient.cache_maintenance import sweep
+from spotseeker_restclient.models import CacheEntry, CacheEntryTimed
+
+
+def _store(url, content="x" * 100, stored_ago=0, accessed_ago=None,
+           model=CacheEntry):
+    entry = model()
+    entry.service = "spotseeker"
+    entry.url = url
+    entry.status = 200
+    entry.content = content
+    if model is CacheEntryTimed:
+        entry.time_saved = timezone.now()
+    entry.save()
+
+    now = timezone.now()
+    if accessed_ago is None:
+        accessed_ago = stored_ago
+    CacheEntry.objects.filter(pk=entry.pk).update(
+        time_stored=now - timedelta(seconds=stored_ago),
+        time_accessed=now - timedelta(seconds=accessed_ago))
+    return CacheEntry.objects.get(pk=entry.pk)
+
+
+class CacheMaintenanceTest(TestCase):
+
+    def test_size(self):
+        entry = _store("/api/1", "x" * 100)
+        self.assertEqual(entry.size, len("/api/1") + len("{}") + 100)
+
+    def test_expiry(self):
+        _store("/api/old", stored_ago=7200)
+        _store("/api/new", stored_ago=60)
+        _store("/api/timed", stored_ago=7200, model=CacheEntryTimed)
+
+        report = sweep(max_age=3600)
+        self.assertEqual(report["expired"], 2)
+        self.assertEqual(report["evicted"], 0)
+        self.assertEqual(report["entries"], 1)
+        self.assertEqual(list(CacheEntry.objects.values_list("url",
+                                                             flat=True)),
+                         ["/api/new"])
+        self.assertEqual(CacheEntryTimed.objects.count(), 0)
+
+    def test_eviction_order(self):
+        # Stored in one order, read in another
+        for i, accessed_ago in enumerate([10, 500, 50, 300, 100]):
+            _store("/api/%s" % i, stored_ago=1000, accessed_ago=accessed_ago)
+
+        report = sweep(max_entries=3)
+        self.assertEqual(report["evicted"], 2)
+        self.assertEqual(sorted(CacheEntry.objects.values_list("url",
+                                                               flat=True)),
+                         ["/api/0", "/api/2", "/api/4"])
+
+        size = CacheEntry.objects.get(url="/api/0").size
+        report = sweep(max_bytes=size * 2)
+        self.assertEqual(report["evicted"], 1)
+        self.assertEqual(report["evicted_bytes"], size)
+        self.assertEqual(report["bytes"], size * 2)
+        self.assertEqual(sorted(CacheEntry.objects.values_list("url",
+                                                               flat=True)),
+                         ["/api/0", "/api/2"])
+
+    def test_expiry_counts_toward_budget(self):
+        _store("/api/old", stored_ago=7200, accessed_ago=1)
+        _store("/api/1", accessed_ago=100)
+        _store("/api/2", accessed_ago=10)
+
+        report = sweep(max_age=3600, max_entries=2)
+        self.assertEqual(report["expired"], 1)
+        self.assertEqual(report["evicted"], 0)
+        self.assertEqual(CacheEntry.objects.count(), 2)
+
+    def test_dry_run(self):
+        for i in range(5):
+            _store("/api/%s" % i, accessed_ago=i)
+
+        with self.settings(SPOTSEEKER_CACHE_MAX_ENTRIES=2):
+            report = sweep(dry_run=True)
+        self.assertEqual(report["evicted"], 3)
+        self.assertEqual(report["entries"], 2)
+        self.assertEqual(CacheEntry.objects.count(), 5)
+
+    def test_no_limits(self):
+        _store("/api/1", stored_ago=10 ** 6)
+        report = sweep()
+        self.assertEqual(report["expired"] + report["evicted"], 0)
+        self.assertEqual(report["entries"], 1)
+
+    def test_touch(self):
+        entry = _store("/api/1", accessed_ago=30)
+        accessed = entry.time_accessed
+        entry.touch()
+        self.assertEqual(CacheEntry.objects.get(pk=entry.pk).time_accessed,
+                         accessed)
+
+        with self.settings(SPOTSEEKER_CACHE_ACCESS_RESOLUTION=10):
+            entry.touch()
+        self.assertTrue(
+            CacheEntry.objects.get(pk=entry.pk).time_accessed > accessed)
+
+    def test_command(self):
+        for i in range(4):
+            _store("/api/%s" % i, stored_ago=i * 1000)
+
+        out = StringIO()
+        call_command("sweep_cache", "--max-age", "2500", "--max-entries", "2",
+                     "--dry-run", stdout=out)
+        self.assertIn("Would remove 1 expired entries", out.getvalue())
+        self.assertIn("evicted 1 entries", out.getvalue())
+        self.assertEqual(CacheEntry.objects.count(), 4)
+
+        out = StringIO()
+        call_command("sweep_cache", "--max-age", "2500", stdout=out)
+        self.assertIn("Removed 1 expired entries", out.getvalue())
+        self.assertIn("3 entries", out.getvalue())
+        self.assertEqual(CacheEntry.objects.count(), 3)
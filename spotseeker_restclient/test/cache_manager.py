@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import make_aware, get_current_timezone
+from spotseeker_restclient.cache_manager import queued_cache_writes, \
+    store_cache_entry, save_all_queued_entries, save_entries, \
+    enable_cache_entry_queueing, disable_cache_entry_queueing
+from spotseeker_restclient.cache_implementation import TimeSimpleCache
+from spotseeker_restclient.mock_http import MockHTTP
+from spotseeker_restclient.models import CacheEntry, CacheEntryTimed
+
+
+def _entry(url, content="", model=CacheEntry, status=200):
+    entry = model()
+    entry.service = "spotseeker"
+    entry.url = url
+    entry.status = status
+    entry.content = content
+    entry.headers = {"ETag": content}
+    if model is CacheEntryTimed:
+        entry.time_saved = make_aware(datetime.now(), get_current_timezone())
+    return entry
+
+
+class CacheManagerTest(TestCase):
+
+    def test_queued_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            with queued_cache_writes():
+                for i in range(50):
+                    store_cache_entry(_entry("/api/%s" % i))
+                store_cache_entry(_entry("/api/1", "newest"))
+
+                with queued_cache_writes():
+                    store_cache_entry(_entry("/api/2", "nested"))
+
+                self.assertEqual(CacheEntry.objects.count(), 0)
+
+        self.assertEqual(CacheEntry.objects.count(), 50)
+        entry = CacheEntry.objects.get(url="/api/1")
+        self.assertEqual(entry.content, "newest")
+        self.assertEqual(entry.getHeaders(), {"ETag": "newest"})
+        self.assertEqual(CacheEntry.objects.get(url="/api/2").content,
+                         "nested")
+
+        # A lookup and an insert, plus savepoints
+        self.assertTrue(len(queries) <= 6, len(queries))
+
+    def test_inherited_model(self):
+        _entry("/api/1", "old", model=CacheEntryTimed).save()
+        old = CacheEntryTimed.objects.get(url="/api/1")
+
+        with CaptureQueriesContext(connection) as queries:
+            with queued_cache_writes():
+                for i in range(50):
+                    store_cache_entry(_entry("/api/%s" % i,
+                                             model=CacheEntryTimed))
+                old.content = "new"
+                store_cache_entry(old)
+
+        self.assertEqual(CacheEntryTimed.objects.count(), 50)
+        self.assertEqual(CacheEntry.objects.count(), 50)
+        entry = CacheEntryTimed.objects.get(url="/api/1")
+        self.assertEqual(entry.pk, old.pk)
+        self.assertEqual(entry.content, "new")
+        self.assertEqual(CacheEntryTimed.objects.get(url="/api/2").content,
+                         "")
+
+        # Not a query or two per entry
+        self.assertTrue(len(queries) <= 10, len(queries))
+
+    def test_refresh_expired(self):
+        cache = TimeSimpleCache()
+        expired = make_aware(datetime.now(), get_current_timezone()) - \
+            timedelta(minutes=5)
+        for data in ("old", "new"):
+            response = MockHTTP()
+            response.status = 200
+            response.data = data
+            # The second response refreshes the expired entry, which is
+            # loaded without its body
+            with queued_cache_writes():
+                cache.processResponse("spotseeker", "/api/v1/spot/1",
+                                      response)
+            if data == "old":
+                CacheEntryTimed.objects.update(time_saved=expired)
+
+        hit = cache.getCache("spotseeker", "/api/v1/spot/1", {})
+        self.assertEqual(hit["response"].data, "new")
+        self.assertEqual(CacheEntryTimed.objects.count(), 1)
+
+    def test_updates(self):
+        _entry("/api/1", "old").save()
+        _entry("/api/2", "old", model=CacheEntryTimed).save()
+
+        with self.settings(SPOTSEEKER_CACHE_WRITE_BATCH_SIZE=2):
+            with queued_cache_writes():
+                store_cache_entry(_entry("/api/1", "new"))
+                store_cache_entry(_entry("/api/2", "new",
+                                         model=CacheEntryTimed))
+                store_cache_entry(_entry("/api/3", "new",
+                                         model=CacheEntryTimed))
+
+        self.assertEqual(CacheEntry.objects.count(), 3)
+        self.assertEqual(CacheEntryTimed.objects.count(), 2)
+        for entry in CacheEntry.objects.all():
+            self.assertEqual(entry.content, "new")
+            self.assertEqual(entry.getHeaders(), {"ETag": "new"})
+
+    def test_failed_batch(self):
+        entries = [_entry("/api/%s" % i, model=CacheEntryTimed)
+                   for i in range(5)]
+        entries[2].status = None
+
+        self.assertEqual(save_entries(entries), 4)
+        self.assertEqual(sorted(CacheEntryTimed.objects.values_list(
+            "url", flat=True)), ["/api/0", "/api/1", "/api/3", "/api/4"])
+
+    def test_shared_queue(self):
+        enable_cache_entry_queueing()
+        try:
+            store_cache_entry(_entry("/api/1"))
+            self.assertEqual(CacheEntry.objects.count(), 0)
+        finally:
+            disable_cache_entry_queueing()
+        self.assertEqual(CacheEntry.objects.count(), 1)
+
+        with self.settings(SPOTSEEKER_CACHE_WRITE_BEHIND=True,
+                           SPOTSEEKER_CACHE_WRITE_INTERVAL=3600):
+            store_cache_entry(_entry("/api/2"))
+            self.assertEqual(CacheEntry.objects.count(), 1)
+            self.assertEqual(save_all_queued_entries(), 1)
+        self.assertEqual(CacheEntry.objects.count(), 2)
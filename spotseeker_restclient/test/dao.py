@@ -0,0 +1,145 @@
+import threading
+import time
+from datetime import timedelta
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.exceptions import ImproperlyConfigured
+from spotseeker_restclient.dao import SPOTSEEKER_DAO
+from spotseeker_restclient.cache_implementation import TimeSimpleCache, \
+    NoCache
+from spotseeker_restclient.dao_implementation.spotseeker import File
+from spotseeker_restclient.mock_http import MockHTTP
+from spotseeker_restclient.models import CacheEntryTimed
+
+SLOW_DAO = "spotseeker_restclient.test.dao.SlowDAO"
+STALE_CACHE = "spotseeker_restclient.test.dao.StaleCache"
+
+
+def _response(data):
+    response = MockHTTP()
+    response.status = 200
+    response.data = data
+    response.headers = {}
+    return response
+
+
+class SlowDAO(object):
+    """
+    Counts requests, and holds each one until release is set.
+    """
+    calls = 0
+    release = threading.Event()
+
+    def getURL(self, url, headers):
+        SlowDAO.calls += 1
+        SlowDAO.release.wait(5)
+        return _response("fresh %s" % SlowDAO.calls)
+
+
+class StaleCache(object):
+    """
+    Always has an expired entry to offer.
+    """
+    saved = []
+
+    def getCache(self, service, url, headers):
+        return None
+
+    def getStaleCache(self, service, url, headers):
+        return {"response": _response("stale")}
+
+    def processResponse(self, service, url, response):
+        StaleCache.saved.append(response.data)
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=SLOW_DAO)
+class DAOTest(TestCase):
+
+    def setUp(self):
+        SlowDAO.calls = 0
+        SlowDAO.release = threading.Event()
+        StaleCache.saved = []
+
+    def test_coalescing(self):
+        responses = []
+
+        def get():
+            responses.append(SPOTSEEKER_DAO().getURL("/api/v1/spot/all", {}))
+
+        threads = [threading.Thread(target=get) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        SlowDAO.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(SlowDAO.calls, 1)
+        self.assertEqual([r.data for r in responses], ["fresh 1"] * 5)
+
+    @override_settings(DAO_COALESCE_REQUESTS=False)
+    def test_coalescing_disabled(self):
+        SlowDAO.release.set()
+        SPOTSEEKER_DAO().getURL("/api/v1/spot/all", {})
+        SPOTSEEKER_DAO().getURL("/api/v1/spot/all", {})
+        self.assertEqual(SlowDAO.calls, 2)
+
+    @override_settings(DAO_CACHE_CLASS=STALE_CACHE,
+                       DAO_CACHE_STALE_WHILE_REVALIDATE=True)
+    def test_stale_while_revalidate(self):
+        response = SPOTSEEKER_DAO().getURL("/api/v1/spot/all", {})
+        self.assertEqual(response.data, "stale")
+
+        SlowDAO.release.set()
+        for i in range(50):
+            if StaleCache.saved:
+                break
+            time.sleep(0.1)
+        self.assertEqual(StaleCache.saved, ["fresh 1"])
+
+    @override_settings(DAO_CACHE_CLASS=STALE_CACHE)
+    def test_stale_disabled(self):
+        SlowDAO.release.set()
+        response = SPOTSEEKER_DAO().getURL("/api/v1/spot/all", {})
+        self.assertEqual(response.data, "fresh 1")
+
+    @override_settings(DAO_CACHE_MAX_STALE_AGE=60)
+    def test_timed_cache_stale_entry(self):
+        cache = TimeSimpleCache()
+        cache.processResponse("spotseeker", "/api/v1/spot/all",
+                              _response("[]"))
+        entry = CacheEntryTimed.objects.get(url="/api/v1/spot/all")
+
+        entry.time_saved = entry.time_saved - timedelta(seconds=90)
+        entry.save()
+        self.assertEqual(cache.getCache("spotseeker", "/api/v1/spot/all",
+                                        {}), None)
+        stale = cache.getStaleCache("spotseeker", "/api/v1/spot/all", {})
+        self.assertEqual(stale["response"].data, "[]")
+
+        entry.time_saved = entry.time_saved - timedelta(seconds=60)
+        entry.save()
+        self.assertEqual(cache.getStaleCache("spotseeker",
+                                             "/api/v1/spot/all", {}), None)
+
+    def test_module_reuse(self):
+        dao = SPOTSEEKER_DAO()._getDAO()
+        self.assertTrue(isinstance(dao, SlowDAO))
+        self.assertTrue(SPOTSEEKER_DAO()._getDAO() is dao)
+        self.assertTrue(isinstance(SPOTSEEKER_DAO()._getCache(), NoCache))
+
+        with override_settings(SPOTSEEKER_DAO_CLASS="spotseeker_restclient."
+                               "dao_implementation.spotseeker.File",
+                               DAO_CACHE_CLASS=STALE_CACHE):
+            self.assertTrue(isinstance(SPOTSEEKER_DAO()._getDAO(), File))
+            self.assertTrue(isinstance(SPOTSEEKER_DAO()._getCache(),
+                                       StaleCache))
+
+        self.assertTrue(SPOTSEEKER_DAO()._getDAO() is not dao)
+        self.assertTrue(isinstance(SPOTSEEKER_DAO()._getDAO(), SlowDAO))
+        self.assertTrue(isinstance(SPOTSEEKER_DAO()._getCache(), NoCache))
+
+    @override_settings(SPOTSEEKER_DAO_CLASS="spotseeker_restclient.test.dao."
+                       "NoSuchDAO")
+    def test_bad_module(self):
+        self.assertRaises(ImproperlyConfigured, SPOTSEEKER_DAO()._getDAO)
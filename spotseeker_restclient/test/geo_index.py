@@ -0,0 +1,125 @@
+import random
+from django.test import TestCase
+from spotseeker_restclient.geo_index import SpotGeoIndex, distance
+from spotseeker_restclient.models.lightweight import Spot
+from spotseeker_restclient.replica import SpotChange
+
+
+def _spots(count, seed=1):
+    generator = random.Random(seed)
+    return [Spot(spot_id=spot_id,
+                 latitude=47.64 + generator.random() * 0.04,
+                 longitude=-122.33 + generator.random() * 0.04)
+            for spot_id in range(count)]
+
+
+class SpotGeoIndexTest(TestCase):
+
+    def setUp(self):
+        self.spots = _spots(500)
+        self.index = SpotGeoIndex(self.spots)
+        self.center = (47.655, -122.31)
+
+    def _by_distance(self):
+        return sorted((distance(self.center[0], self.center[1],
+                                spot.latitude, spot.longitude), spot.spot_id)
+                      for spot in self.spots)
+
+    def test_radius(self):
+        expected = [spot_id for spot_distance, spot_id in self._by_distance()
+                    if spot_distance <= 400]
+        results = self.index.radius(self.center[0], self.center[1], 400)
+        self.assertEqual([spot.spot_id for d, spot in results], expected)
+
+    def test_radius_limit(self):
+        expected = [spot_id for spot_distance, spot_id in self._by_distance()
+                    if spot_distance <= 400][:5]
+        results = self.index.radius(self.center[0], self.center[1], 400,
+                                    limit=5)
+        self.assertEqual([spot.spot_id for d, spot in results], expected)
+
+        self.assertEqual(self.index.radius(48.5, -121.0, 400, limit=5), [])
+
+    def test_nearest(self):
+        expected = [spot_id for d, spot_id in self._by_distance()[:7]]
+        results = self.index.nearest(self.center[0], self.center[1], 7)
+        self.assertEqual([spot.spot_id for d, spot in results], expected)
+
+        far_away = self.index.nearest(48.5, -121.0, 3)
+        self.assertEqual(len(far_away), 3)
+
+        self.assertEqual(len(self.index.nearest(0, 0, 1000)), 500)
+        nearby = self.index.nearest(self.center[0], self.center[1], 1000,
+                                    max_distance=200)
+        self.assertEqual([spot.spot_id for d, spot in nearby],
+                         [spot_id for spot_distance, spot_id
+                          in self._by_distance() if spot_distance <= 200])
+        self.assertEqual(SpotGeoIndex().nearest(0, 0, 1), [])
+
+    def test_cell_size(self):
+        # Cells shrink as spots are added, and queries stay exact
+        generator = random.Random(3)
+        spots = [Spot(spot_id=spot_id,
+                      latitude=47.654 + generator.random() * 0.002,
+                      longitude=-122.311 + generator.random() * 0.002)
+                 for spot_id in range(500)]
+        index = SpotGeoIndex(spots[:20])
+        self.assertEqual(index.cell_size, 0.002)
+        for spot in spots[20:]:
+            index.add(spot)
+        self.assertTrue(index.cell_size < 0.002)
+        self.assertTrue(len(index) <= 16 * len(index._cells))
+
+        expected = sorted((distance(self.center[0], self.center[1],
+                                    spot.latitude, spot.longitude),
+                           spot.spot_id) for spot in spots)
+        results = index.nearest(self.center[0], self.center[1], 7)
+        self.assertEqual([spot.spot_id for d, spot in results],
+                         [spot_id for d, spot_id in expected[:7]])
+        results = index.radius(self.center[0], self.center[1], 50)
+        self.assertEqual([spot.spot_id for d, spot in results],
+                         [spot_id for d, spot_id in expected if d <= 50])
+
+        index = SpotGeoIndex(self.spots, cell_size=0.01)
+        self.assertEqual(index.cell_size, 0.01)
+
+        # Spots sharing a point can't be split up
+        index = SpotGeoIndex([Spot(spot_id=spot_id, latitude=47.65,
+                                   longitude=-122.31)
+                              for spot_id in range(100)])
+        self.assertEqual(len(index._cells), 1)
+        self.assertEqual(len(index.radius(47.65, -122.31, 1)), 100)
+
+    def test_bounding_box(self):
+        box = (47.65, -122.32, 47.66, -122.30)
+        expected = [spot.spot_id for spot in self.spots
+                    if box[0] <= spot.latitude <= box[2] and
+                    box[1] <= spot.longitude <= box[3]]
+        results = self.index.bounding_box(*box)
+        self.assertEqual(sorted(spot.spot_id for spot in results),
+                         sorted(expected))
+
+        results = self.index.bounding_box(40, -130, 50, -120)
+        self.assertEqual(len(results), 500)
+
+    def test_update(self):
+        moved = Spot(spot_id=3, latitude=self.center[0],
+                     longitude=self.center[1])
+        self.index.update([
+            SpotChange(1, "deleted", "1", None, self.spots[1]),
+            SpotChange(2, "changed", "3", moved, self.spots[3]),
+            SpotChange(3, "added", "900", Spot(spot_id=900), None),
+        ])
+        self.assertEqual(len(self.index), 499)
+
+        nearest = self.index.nearest(self.center[0], self.center[1], 1)
+        self.assertTrue(nearest[0][1] is moved)
+        self.assertEqual(nearest[0][0], 0)
+
+        results = self.index.bounding_box(40, -130, 50, -120)
+        self.assertEqual(sorted(spot.spot_id for spot in results),
+                         [spot_id for spot_id in range(500) if spot_id != 1])
+
+        self.index.add(Spot(spot_id=901, latitude=47.65,
+                            longitude=-122.31))
+        self.assertEqual(len(self.index), 500)
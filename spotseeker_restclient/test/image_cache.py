@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient.exceptions import DataFailureException
+from spotseeker_restclient.image_cache import get_image_cache
+from spotseeker_restclient.spotseeker import Spotseeker
+
+DAO = "spotseeker_restclient.dao_implementation.spotseeker.File"
+RESOURCES = os.path.join(os.path.dirname(__file__), "..", "resources",
+                         "spotseeker", "file", "api", "v1", "spot", "10",
+                         "image")
+
+
+def _resource(*path):
+    with open(os.path.join(RESOURCES, *path), "rb") as handle:
+        return handle.read()
+
+
+def _bodies(directory):
+    return [name for path, dirs, names in
+            os.walk(os.path.join(directory, "bodies")) for name in names]
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=DAO)
+class ImageCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.thumbnail = _resource("1", "thumb", "constrain", "width_100")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stream(self):
+        image = Spotseeker().stream_spot_image(10, 1, 100)
+        self.assertEqual(image.status, 200)
+        self.assertEqual(image.content_type, "image/png")
+        self.assertEqual(image.etag, '"b2b1a5c0"')
+
+        out = StringIO()
+        self.assertEqual(image.write_to(out), len(self.thumbnail))
+        self.assertEqual(out.getvalue(), self.thumbnail)
+
+        response = StreamingHttpResponse(
+            Spotseeker().stream_spot_image(10, 2))
+        self.assertEqual("".join(response.streaming_content), _resource("2"))
+
+        with self.assertRaises(DataFailureException) as cm:
+            Spotseeker().stream_spot_image(10, 3)
+        self.assertEqual(cm.exception.status, 404)
+
+    def test_cache(self):
+        with self.settings(SPOTSEEKER_IMAGE_CACHE_DIR=self.directory):
+            client = Spotseeker()
+            self.assertEqual("".join(client.stream_spot_image(10, 1, 100)),
+                             self.thumbnail)
+            image = client.stream_spot_image(10, 1, 100)
+            self.assertEqual(image.content_type, "image/png")
+            self.assertEqual(image.length, len(self.thumbnail))
+            self.assertEqual("".join(image), self.thumbnail)
+
+            self.assertEqual(get_image_cache().stats(),
+                             {"hits": 1, "revalidations": 0, "misses": 1})
+            self.assertEqual(len(_bodies(self.directory)), 1)
+
+    def test_revalidation(self):
+        with self.settings(SPOTSEEKER_IMAGE_CACHE_DIR=self.directory,
+                           SPOTSEEKER_IMAGE_CACHE_FRESH_SECONDS=0):
+            client = Spotseeker()
+            for i in range(2):
+                self.assertEqual(
+                    "".join(client.stream_spot_image(10, 1, 100)),
+                    self.thumbnail)
+
+            # No ETag to revalidate with, so it's fetched again, but the
+            # same body is only kept once
+            for i in range(2):
+                self.assertEqual("".join(client.stream_spot_image(10, 2)),
+                                 _resource("2"))
+
+            self.assertEqual(get_image_cache().stats(),
+                             {"hits": 0, "revalidations": 1, "misses": 3})
+            self.assertEqual(len(_bodies(self.directory)), 2)
+
+    def test_partial_read(self):
+        with self.settings(SPOTSEEKER_IMAGE_CACHE_DIR=self.directory):
+            image = Spotseeker().stream_spot_image(10, 2)
+            image.close()
+            self.assertEqual(_bodies(self.directory), [])
+            self.assertEqual(os.listdir(os.path.join(self.directory, "tmp")),
+                             [])
+
+            self.assertEqual("".join(Spotseeker().stream_spot_image(10, 2)),
+                             _resource("2"))
+            self.assertEqual(len(_bodies(self.directory)), 1)
+
+    def test_eviction(self):
+        size = len(self.thumbnail) + len(_resource("2"))
+        with self.settings(SPOTSEEKER_IMAGE_CACHE_DIR=self.directory,
+                           SPOTSEEKER_IMAGE_CACHE_MAX_BYTES=size):
+            client = Spotseeker()
+            "".join(client.stream_spot_image(10, 1, 100))
+            "".join(client.stream_spot_image(10, 2))
+            self.assertEqual(len(_bodies(self.directory)), 2)
+
+            # The thumbnail was used less recently than the full image
+            bodies = os.path.join(self.directory, "bodies")
+            for path, dirs, names in os.walk(bodies):
+                for name in names:
+                    with open(os.path.join(path, name), "rb") as handle:
+                        if handle.read() == self.thumbnail:
+                            os.utime(os.path.join(path, name), (0, 0))
+
+            cache = get_image_cache()
+            cache.max_bytes = size - 1
+            self.assertEqual(cache.evict(), len(self.thumbnail))
+
+            "".join(client.stream_spot_image(10, 1, 100))
+            self.assertEqual(cache.stats()["misses"], 3)
@@ -0,0 +1,184 @@
+import logging
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient import instrumentation
+from spotseeker_restclient.dao import SPOTSEEKER_DAO
+from spotseeker_restclient.exceptions import DataFailureException
+from spotseeker_restclient.mock_http import MockHTTP
+from spotseeker_restclient.instrumentation import Histogram, \
+    HistogramExporter, LoggingExporter, register_hook, clear_hooks
+from spotseeker_restclient.spotseeker import Spotseeker
+
+DAO = "spotseeker_restclient.dao_implementation.spotseeker.File"
+TIMED_CACHE = "spotseeker_restclient.cache_implementation.TimeSimpleCache"
+ETAG_CACHE = "spotseeker_restclient.cache_implementation.ETagCache"
+CONDITIONAL_DAO = "spotseeker_restclient.test.cache.ConditionalDAO"
+WRITE_DAO = "spotseeker_restclient.test.instrumentation.WriteDAO"
+
+
+class WriteDAO(object):
+    def putURL(self, url, headers, body):
+        response = MockHTTP()
+        response.status = 200
+        return response, "{}"
+
+
+class _Handler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=DAO)
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        self.events = []
+        register_hook(self.events.append)
+
+    def tearDown(self):
+        clear_hooks()
+
+    @override_settings(DAO_CACHE_CLASS=TIMED_CACHE)
+    def test_dao_events(self):
+        dao = SPOTSEEKER_DAO()
+        dao.getURL("/api/v1/spot/1", {})
+        dao.getURL("/api/v1/spot/1", {})
+        with self.settings(SPOTSEEKER_DAO_CLASS=WRITE_DAO):
+            dao.putURL("/api/v1/spot/1", {}, "{}")
+
+        self.assertEqual([event["name"] for event in self.events],
+                         ["spotseeker GET", "spotseeker GET",
+                          "spotseeker PUT"])
+        self.assertEqual([event["cache"] for event in self.events],
+                         ["miss", "hit", None])
+        self.assertEqual(self.events[2]["status"], 200)
+        self.assertEqual(self.events[2]["bytes"], 2)
+
+        event = self.events[0]
+        self.assertEqual(event["type"], "dao")
+        self.assertEqual(event["url"], "/api/v1/spot/1")
+        self.assertEqual(event["status"], 200)
+        self.assertTrue(event["bytes"] > 0)
+        self.assertTrue(event["duration"] >= 0)
+        self.assertEqual(event["error"], None)
+
+    @override_settings(SPOTSEEKER_DAO_CLASS=CONDITIONAL_DAO,
+                       DAO_CACHE_CLASS=ETAG_CACHE)
+    def test_revalidated(self):
+        dao = SPOTSEEKER_DAO()
+        dao.getURL("/api/v1/spot/1", {})
+        response = dao.getURL("/api/v1/spot/1", {})
+
+        self.assertEqual([event["cache"] for event in self.events],
+                         ["miss", "revalidated"])
+        self.assertEqual(self.events[1]["status"], 200)
+        self.assertEqual(self.events[1]["bytes"], len(response.data))
+
+    def test_method_events(self):
+        spot = Spotseeker().get_spot_by_id(1)
+        self.assertEqual(spot.spot_id, 1)
+
+        dao_event, method_event = self.events
+        self.assertEqual(method_event["type"], "method")
+        self.assertEqual(method_event["name"], "Spotseeker.get_spot_by_id")
+        self.assertEqual(method_event["calls"], 1)
+        self.assertEqual(method_event["bytes"], dao_event["bytes"])
+        self.assertEqual(method_event["status"], 200)
+        self.assertTrue(method_event["duration"] >= dao_event["duration"])
+        self.assertTrue(0 <= method_event["parse_time"] <=
+                        method_event["duration"])
+
+    def test_errors(self):
+        with self.assertRaises(DataFailureException):
+            Spotseeker().get_spot_by_id(999999)
+
+        dao_event, method_event = self.events
+        self.assertEqual(dao_event["status"], 404)
+        self.assertEqual(method_event["status"], 404)
+        self.assertTrue(isinstance(method_event["error"],
+                                   DataFailureException))
+
+    def test_failing_hook(self):
+        def fail(event):
+            raise Exception("Broken hook")
+        register_hook(fail)
+
+        Spotseeker().get_spot_by_id(1)
+        self.assertEqual(len(self.events), 2)
+
+    @override_settings(SPOTSEEKER_METRICS_HOOKS=[
+        "spotseeker_restclient.instrumentation.HistogramExporter"])
+    def test_setting(self):
+        exporter = instrumentation.hooks()[-1]
+        self.assertTrue(isinstance(exporter, HistogramExporter))
+
+        Spotseeker().get_spot_by_id(1)
+        summary = exporter.summary()
+        self.assertEqual(summary["spotseeker GET"]["count"], 1)
+        self.assertEqual(summary["Spotseeker.get_spot_by_id"]["count"], 1)
+
+    def test_no_hooks(self):
+        clear_hooks()
+        self.assertEqual(instrumentation.hooks(), ())
+        Spotseeker().get_spot_by_id(1)
+        self.assertEqual(self.events, [])
+
+
+class ExporterTest(TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), None)
+        for value in range(1, 101):
+            histogram.add(value)
+
+        self.assertEqual(histogram.summary(), {"count": 100, "mean": 50.5,
+                                               "p50": 50, "p95": 95,
+                                               "p99": 99})
+
+        histogram = Histogram(max_samples=10)
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(50), 95)
+
+    def test_histogram_exporter(self):
+        exporter = HistogramExporter()
+        for duration in (0.1, 0.2, 0.3):
+            exporter({"name": "spotseeker GET", "duration": duration,
+                      "status": 200, "cache": "hit", "bytes": 10,
+                      "error": None})
+        exporter({"name": "spotseeker GET", "duration": 0.4, "status": 500,
+                  "cache": "miss", "bytes": None, "error": Exception()})
+
+        summary = exporter.summary()["spotseeker GET"]
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["p50"], 0.2)
+        self.assertEqual(summary["p99"], 0.4)
+        self.assertEqual(summary["statuses"], {200: 3, 500: 1})
+        self.assertEqual(summary["cache"], {"hit": 3, "miss": 1})
+        self.assertEqual(summary["bytes"], 30)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(exporter.percentile("spotseeker GET", 95), 0.4)
+
+        exporter.reset()
+        self.assertEqual(exporter.summary(), {})
+
+    def test_logging_exporter(self):
+        handler = _Handler()
+        logger = logging.getLogger("spotseeker_restclient.metrics")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            LoggingExporter()({"name": "spotseeker GET", "url": "/api/v1/",
+                               "duration": 0.0125, "status": 200,
+                               "cache": "miss", "bytes": 42, "error": None})
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertEqual(handler.messages, [
+            "spotseeker GET /api/v1/ 12.5ms status=200 cache=miss bytes=42"])
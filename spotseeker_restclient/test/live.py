@@ -0,0 +1,404 @@
+import socket
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient.dao import SPOTSEEKER_DAO
+from spotseeker_restclient.dao_implementation import live
+from spotseeker_restclient.dao_implementation.live import \
+    get_pool_manager, get_pool_stats, reset_pool_manager, \
+    reset_circuit_breakers, get_circuit_states, circuit_state_changed
+from spotseeker_restclient.dao_implementation.spotseeker import Live
+from spotseeker_restclient.deadline import deadline, remaining
+from spotseeker_restclient.exceptions import CircuitOpenException, \
+    DeadlineExceededException
+from spotseeker_restclient.spotseeker import Spotseeker
+
+LIVE_DAO = "spotseeker_restclient.dao_implementation.spotseeker.Live"
+ETAG_CACHE = "spotseeker_restclient.cache_implementation.ETagCache"
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = '{"method": "%s"}' % self.command
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class FlakyHandler(KeepAliveHandler):
+    """
+    Counts requests, and answers them with the class's status.
+    """
+    status = 200
+    requests = 0
+
+    def do_GET(self):
+        FlakyHandler.requests += 1
+        body = "status %s" % FlakyHandler.status
+        self.send_response(FlakyHandler.status)
+        self.send_header("ETag", '"abc"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LiveDAOTest(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = "http://127.0.0.1:%s" % self.server.server_port
+        reset_pool_manager()
+
+    def tearDown(self):
+        reset_pool_manager()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        with override_settings(SPOTSEEKER_HOST=self.host,
+                               SPOTSEEKER_OAUTH_KEY="key",
+                               SPOTSEEKER_OAUTH_SECRET="secret"):
+            dao = Live()
+            resp = dao.getURL("/api/v1/spot/1", {})
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(resp.data, '{"method": "GET"}')
+
+            resp, content = dao.putURL("/api/v1/spot/1",
+                                       {"Content-Type": "application/json"},
+                                       '{"name": "x"}')
+            self.assertEqual(content, '{"method": "PUT"}')
+
+            resp, content = dao.postURL("/api/v1/spot/",
+                                        {"Content-Type": "application/json"},
+                                        '{"name": "x"}')
+            self.assertEqual(content, '{"method": "POST"}')
+
+            resp, content = dao.deleteURL("/api/v1/spot/1", {}, "")
+            self.assertEqual(content, '{"method": "DELETE"}')
+
+        stats = get_pool_stats()
+        self.assertEqual(stats['pools'], 1)
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 3)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['waiting'], 0)
+
+    def test_stream(self):
+        with override_settings(SPOTSEEKER_HOST=self.host,
+                               SPOTSEEKER_OAUTH_KEY="key",
+                               SPOTSEEKER_OAUTH_SECRET="secret"):
+            resp = Live().streamURL("/api/v1/spot/all", {})
+            self.assertEqual(resp.status, 200)
+            self.assertEqual("".join(resp.stream(4)), '{"method": "GET"}')
+            resp.release_conn()
+
+        self.assertEqual(get_pool_stats()['idle'], 1)
+
+    def test_pool_size_setting(self):
+        with override_settings(SPOTSEEKER_HOST=self.host,
+                               SPOTSEEKER_OAUTH_KEY="key",
+                               SPOTSEEKER_OAUTH_SECRET="secret",
+                               SPOTSEEKER_POOL_SIZE=2):
+            resp = Live().getURL("/api/v1/spot/1", {})
+            self.assertEqual(resp.status, 200)
+
+            pool = get_pool_manager().connection_from_url(self.host)
+            self.assertEqual(pool.pool.maxsize, 2)
+
+
+class ScriptedHandler(KeepAliveHandler):
+    """
+    Answers each request after the delay and with the status next in the
+    class's script, then promptly with a 200.
+    """
+    script = []
+    requests = []
+
+    def _respond(self):
+        ScriptedHandler.requests.append(self.command)
+        delay, status = (ScriptedHandler.script.pop(0)
+                         if ScriptedHandler.script else (0, 200))
+        time.sleep(delay)
+        body = '{"request": %s}' % len(ScriptedHandler.requests)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = _respond
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Requests that timed out on the client's side
+        pass
+
+
+class CircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        FlakyHandler.status = 200
+        FlakyHandler.requests = 0
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = "http://127.0.0.1:%s" % self.server.server_port
+
+        self.transitions = []
+        circuit_state_changed.connect(self._transition)
+        reset_pool_manager()
+        reset_circuit_breakers()
+
+    def tearDown(self):
+        circuit_state_changed.disconnect(self._transition)
+        reset_pool_manager()
+        reset_circuit_breakers()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _transition(self, sender, host, old_state, new_state, **kwargs):
+        self.transitions.append((host, old_state, new_state))
+
+    def _settings(self, **kwargs):
+        values = {
+            "SPOTSEEKER_HOST": self.host,
+            "SPOTSEEKER_OAUTH_KEY": "key",
+            "SPOTSEEKER_OAUTH_SECRET": "secret",
+            "SPOTSEEKER_BREAKER_FAILURES": 3,
+            "SPOTSEEKER_BREAKER_OPEN_SECONDS": 0.2,
+        }
+        values.update(kwargs)
+        return override_settings(**values)
+
+    def test_open_and_close(self):
+        with self._settings():
+            dao = Live()
+            FlakyHandler.status = 500
+            for i in range(3):
+                self.assertEqual(dao.getURL("/api/v1/spot/1", {}).status,
+                                 500)
+            self.assertEqual(get_circuit_states(), {self.host: "open"})
+
+            with self.assertRaises(CircuitOpenException) as cm:
+                dao.getURL("/api/v1/spot/1", {})
+            self.assertEqual(cm.exception.status, 503)
+            self.assertEqual(cm.exception.url, "/api/v1/spot/1")
+            self.assertEqual(FlakyHandler.requests, 3)
+
+            # The probe fails, so it opens again
+            time.sleep(0.25)
+            self.assertEqual(dao.getURL("/api/v1/spot/1", {}).status, 500)
+            self.assertRaises(CircuitOpenException, dao.getURL,
+                              "/api/v1/spot/1", {})
+
+            FlakyHandler.status = 200
+            time.sleep(0.25)
+            self.assertEqual(dao.getURL("/api/v1/spot/1", {}).status, 200)
+            self.assertEqual(dao.getURL("/api/v1/spot/1", {}).status, 200)
+            self.assertEqual(FlakyHandler.requests, 6)
+
+        self.assertEqual(self.transitions, [
+            (self.host, "closed", "open"),
+            (self.host, "open", "half-open"),
+            (self.host, "half-open", "open"),
+            (self.host, "open", "half-open"),
+            (self.host, "half-open", "closed"),
+        ])
+
+    def test_success_resets_failures(self):
+        with self._settings():
+            dao = Live()
+            for status in (500, 500, 200, 500, 500, 404):
+                FlakyHandler.status = status
+                dao.getURL("/api/v1/spot/1", {})
+            self.assertEqual(get_circuit_states(), {self.host: "closed"})
+
+    def test_connection_errors(self):
+        # A port nothing is listening on
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        host = "http://127.0.0.1:%s" % sock.getsockname()[1]
+        sock.close()
+
+        with self._settings(SPOTSEEKER_HOST=host):
+            dao = Live()
+            for i in range(3):
+                self.assertRaises(Exception, dao.getURL, "/api/v1/spot/1",
+                                  {})
+            self.assertRaises(CircuitOpenException, dao.getURL,
+                              "/api/v1/spot/1", {})
+            self.assertEqual(get_circuit_states()[host], "open")
+
+    def test_cached_response(self):
+        with self._settings(SPOTSEEKER_DAO_CLASS=LIVE_DAO,
+                            DAO_CACHE_CLASS=ETAG_CACHE):
+            dao = SPOTSEEKER_DAO()
+            self.assertEqual(dao.getURL("/api/v1/spot/1", {}).data,
+                             "status 200")
+
+            FlakyHandler.status = 500
+            for i in range(3):
+                dao.getURL("/api/v1/spot/1", {})
+
+            response = dao.getURL("/api/v1/spot/1", {})
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.data, "status 200")
+            self.assertEqual(FlakyHandler.requests, 4)
+
+            self.assertRaises(CircuitOpenException, dao.getURL,
+                              "/api/v1/spot/2", {})
+
+            with self.settings(SPOTSEEKER_BREAKER_SERVE_CACHED=False):
+                self.assertRaises(CircuitOpenException, dao.getURL,
+                                  "/api/v1/spot/1", {})
+
+
+@override_settings(SPOTSEEKER_OAUTH_KEY="key",
+                   SPOTSEEKER_OAUTH_SECRET="secret",
+                   SPOTSEEKER_RETRY_BACKOFF=0.01,
+                   SPOTSEEKER_DAO_CLASS=LIVE_DAO)
+class DeadlineTest(TestCase):
+
+    def setUp(self):
+        ScriptedHandler.script = []
+        ScriptedHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = "http://127.0.0.1:%s" % self.server.server_port
+        reset_pool_manager()
+        reset_circuit_breakers()
+        live._latencies.clear()
+
+    def tearDown(self):
+        reset_pool_manager()
+        reset_circuit_breakers()
+        live._latencies.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_nesting(self):
+        self.assertEqual(remaining(), None)
+        with deadline(10):
+            with deadline(0.5):
+                self.assertTrue(remaining() <= 0.5)
+                with deadline(20):
+                    self.assertTrue(remaining() <= 0.5)
+            self.assertTrue(9 < remaining() <= 10)
+            with deadline(None):
+                self.assertTrue(9 < remaining() <= 10)
+        self.assertEqual(remaining(), None)
+
+    def test_deadline(self):
+        ScriptedHandler.script = [(1, 200)]
+        with self.settings(SPOTSEEKER_HOST=self.host):
+            start = time.time()
+            with deadline(0.2):
+                self.assertRaises(DeadlineExceededException,
+                                  Live().getURL, "/api/v1/spot/1", {})
+            self.assertTrue(time.time() - start < 0.5)
+
+            # Already past
+            with deadline(0):
+                self.assertRaises(DeadlineExceededException,
+                                  Live().getURL, "/api/v1/spot/1", {})
+        self.assertEqual(len(ScriptedHandler.requests), 1)
+
+    def test_exhausted_pool(self):
+        with self.settings(SPOTSEEKER_HOST=self.host,
+                           SPOTSEEKER_POOL_SIZE=1):
+            held = Live().streamURL("/api/v1/spot/1", {})
+
+            # Waits for the held connection only until the deadline
+            start = time.time()
+            with deadline(0.3):
+                self.assertRaises(DeadlineExceededException,
+                                  Live().getURL, "/api/v1/spot/1", {})
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual(len(ScriptedHandler.requests), 1)
+
+            # Not counted against the host
+            self.assertEqual(live.get_circuit_breaker(self.host).failures, 0)
+
+            held.read()
+            held.release_conn()
+            self.assertEqual(Live().getURL("/api/v1/spot/1", {}).status, 200)
+
+    def test_method_timeout(self):
+        ScriptedHandler.script = [(1, 200)]
+        with self.settings(SPOTSEEKER_HOST=self.host):
+            with self.assertRaises(DeadlineExceededException) as cm:
+                Spotseeker().get_spot_by_id(1, timeout=0.2)
+            self.assertEqual(cm.exception.status, 504)
+
+    def test_retries(self):
+        ScriptedHandler.script = [(0, 503), (0, 502)]
+        with self.settings(SPOTSEEKER_HOST=self.host):
+            response = Live().getURL("/api/v1/spot/1", {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.data, '{"request": 3}')
+
+        ScriptedHandler.script = [(0, 503)] * 3
+        with self.settings(SPOTSEEKER_HOST=self.host,
+                           SPOTSEEKER_GET_RETRIES=1):
+            response = Live().getURL("/api/v1/spot/1", {})
+        self.assertEqual(response.status, 503)
+        self.assertEqual(len(ScriptedHandler.requests), 5)
+
+        # Only GETs are retried
+        ScriptedHandler.script = [(0, 503)]
+        with self.settings(SPOTSEEKER_HOST=self.host):
+            response, content = Live().putURL("/api/v1/spot/1", {}, "{}")
+        self.assertEqual(response.status, 503)
+        self.assertEqual(ScriptedHandler.requests[-1], "PUT")
+        self.assertEqual(len(ScriptedHandler.requests), 6)
+
+    def test_retries_within_deadline(self):
+        ScriptedHandler.script = [(0, 503)] * 3
+        with self.settings(SPOTSEEKER_HOST=self.host,
+                           SPOTSEEKER_RETRY_BACKOFF=10):
+            start = time.time()
+            with deadline(0.5):
+                response = Live().getURL("/api/v1/spot/1", {})
+            self.assertEqual(response.status, 503)
+            self.assertTrue(time.time() - start < 0.5)
+
+    def test_hedging(self):
+        with self.settings(SPOTSEEKER_HOST=self.host,
+                           SPOTSEEKER_HEDGE_GETS=True,
+                           SPOTSEEKER_HEDGE_MIN_SAMPLES=5):
+            dao = Live()
+            for i in range(5):
+                dao.getURL("/api/v1/spot/1", {})
+            p95 = live._get_latencies(self.host).percentile(95)
+            self.assertTrue(p95 < 0.5)
+
+            ScriptedHandler.script = [(2, 200)]
+            start = time.time()
+            response = dao.getURL("/api/v1/spot/1", {})
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.data, '{"request": 7}')
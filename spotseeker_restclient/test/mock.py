@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient.dao_implementation.mock import \
+    _load_resource_from_path, clear_resource_indexes, get_mockdata_url, \
+    resource_cache
+from spotseeker_restclient.dao_implementation.spotseeker import File
+import time
+
+
+class ResourceIndexTest(TestCase):
+
+    def setUp(self):
+        clear_resource_indexes()
+        resource_cache.clear()
+        self.path = tempfile.mkdtemp()
+        self.root = os.path.join(self.path, "spotseeker", "file")
+        self.resource_dir = {"path": self.path, "app": "test"}
+
+        self.write("api/v1/spot/1", "spot 1")
+        self.write("api/v1/spot/1.http-headers",
+                   '{"headers": {"ETag": "abc"}, "status": 203}')
+        self.write("api/v1/buildings/index.html", "buildings")
+        self.write("api/v1/spot_limit_0", "safe name")
+        self.write("api/v1/spot?a b", "unquoted")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        clear_resource_indexes()
+        resource_cache.clear()
+
+    def write(self, path, data, mtime=0):
+        path = os.path.join(self.root, *path.split("/"))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as handle:
+            handle.write(data)
+        os.utime(path, (mtime, mtime))
+        # Backdate the directory, so a later change is always visible
+        os.utime(os.path.dirname(path), (0, 0))
+
+    def get(self, url):
+        return _load_resource_from_path(self.resource_dir, "spotseeker",
+                                        "file", url, {})
+
+    def test_lookup(self):
+        response = self.get("/api/v1/spot/1")
+        self.assertEqual(response.data, "spot 1")
+        self.assertEqual(response.status, 203)
+        self.assertEqual(response.getheader("ETag"), "abc")
+
+        self.assertEqual(self.get("/api/v1/buildings").data, "buildings")
+        self.assertEqual(self.get("/api/v1/buildings/").data, "buildings")
+        self.assertEqual(self.get("/api/v1/spot?limit=0").data, "safe name")
+        self.assertEqual(self.get("/api/v1/spot%3Fa%20b").data, "unquoted")
+        self.assertEqual(self.get("/api/v1/spot/2"), None)
+        self.assertEqual(self.get("/api/v1/spot"), None)
+        self.assertEqual(self.get("/api/v1/spot/../../../x"), None)
+
+    def test_watch(self):
+        self.assertEqual(self.get("/api/v1/spot/2"), None)
+        self.write("api/v1/spot/2", "spot 2")
+        os.utime(os.path.join(self.root, "api", "v1", "spot"), None)
+
+        # Without watching, the scan is kept
+        self.assertEqual(self.get("/api/v1/spot/2"), None)
+
+        with self.settings(SPOTSEEKER_FILE_DAO_WATCH_INTERVAL=0):
+            self.assertEqual(self.get("/api/v1/spot/2").data, "spot 2")
+
+            os.remove(os.path.join(self.root, "api", "v1", "spot", "1"))
+            self.assertEqual(self.get("/api/v1/spot/1"), None)
+
+    def test_app_resources(self):
+        response = get_mockdata_url("spotseeker", "file", "/api/v1/spot/1",
+                                    {})
+        self.assertEqual(response.status, 200)
+        response = get_mockdata_url("spotseeker", "file", "/api/v1/nope",
+                                    {})
+        self.assertEqual(response.status, 404)
+
+    def test_body_cache(self):
+        hits = resource_cache.hits
+        self.assertEqual(self.get("/api/v1/spot/1").data, "spot 1")
+        response = self.get("/api/v1/spot/1")
+        self.assertEqual(response.data, "spot 1")
+        self.assertEqual(response.getheader("ETag"), "abc")
+        self.assertEqual(resource_cache.hits, hits + 1)
+
+        # Responses don't share headers
+        response.headers["ETag"] = "changed"
+        self.assertEqual(self.get("/api/v1/spot/1").getheader("ETag"),
+                         "abc")
+
+        self.write("api/v1/spot/1", "new spot 1", mtime=10)
+        self.assertEqual(self.get("/api/v1/spot/1").data, "new spot 1")
+        self.write("api/v1/spot/1.http-headers", '{"ETag": "def"}', mtime=10)
+        response = self.get("/api/v1/spot/1")
+        self.assertEqual(response.getheader("ETag"), "def")
+        self.assertEqual(response.status, 200)
+
+        with self.settings(SPOTSEEKER_FILE_DAO_CACHE_MAX_BYTES=12):
+            self.get("/api/v1/buildings")
+            self.get("/api/v1/spot_limit_0")
+            self.assertTrue(resource_cache.size <= 12)
+
+    def test_simulate_network(self):
+        with self.settings(SPOTSEEKER_FILE_DAO_ERROR_RATE=1,
+                           SPOTSEEKER_FILE_DAO_ERROR_STATUS=503):
+            self.assertEqual(File().getURL("/api/v1/spot/1", {}).status, 503)
+
+        with self.settings(SPOTSEEKER_FILE_DAO_LATENCY=0.05,
+                           SPOTSEEKER_FILE_DAO_JITTER=0.05):
+            start = time.time()
+            response = File().getURL("/api/v1/spot/1", {})
+            elapsed = time.time() - start
+            self.assertEqual(response.status, 200)
+            self.assertTrue(0.05 <= elapsed < 1, elapsed)
@@ -0,0 +1,212 @@
+import copy
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient.spotseeker import Spotseeker
+from spotseeker_restclient.replica import SpotReplica, distance
+
+DAO = "spotseeker_restclient.dao_implementation.spotseeker.File"
+
+TECH_QUERY = [('limit', 0), ('extended_info:app_type', 'tech')]
+
+
+class RecordingClient(Spotseeker):
+    def __init__(self, *args, **kwargs):
+        super(RecordingClient, self).__init__(*args, **kwargs)
+        self.searches = []
+
+    def search_spots(self, query_tuple):
+        self.searches.append(query_tuple)
+        return super(RecordingClient, self).search_spots(query_tuple)
+
+
+class ChangingClient(Spotseeker):
+    """
+    Serves an editable copy of the spot/all fixture, counting the spots
+    it parses.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ChangingClient, self).__init__(*args, **kwargs)
+        self.spot_data = list(Spotseeker().iter_all_spot_data())
+        self.parsed = 0
+
+    def iter_all_spot_data(self, chunk_size=2 ** 16):
+        for spot_data in self.spot_data:
+            yield copy.deepcopy(spot_data)
+
+    def spot_from_data(self, spot_data):
+        self.parsed += 1
+        return super(ChangingClient, self).spot_from_data(spot_data)
+
+
+def _ids(spots):
+    return [str(spot.spot_id) for spot in spots]
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=DAO)
+class SpotReplicaTest(TestCase):
+
+    def setUp(self):
+        self.client = RecordingClient()
+        self.replica = SpotReplica(client=self.client)
+
+    def test_fixture_equivalence(self):
+        self.replica.load(self.client.search_spots(TECH_QUERY))
+
+        for query in (TECH_QUERY,
+                      [('limit', 0),
+                       ('item:extended_info:i_brand', 'Apple'),
+                       ('extended_info:app_type', 'tech')]):
+            self.assertEqual(sorted(_ids(self.replica.search_spots(query))),
+                             sorted(_ids(self.client.search_spots(query))))
+
+        self.assertEqual(len(self.client.searches), 3)
+
+    def test_extended_info(self):
+        self.assertEqual(_ids(self.replica.search_spots(
+            [('extended_info:app_type', 'food')])), ["1", "3"])
+        self.assertEqual(_ids(self.replica.search_spots(
+            [('extended_info:app_type', 'food'),
+             ('extended_info:app_type', 'study')])), ["1", "3"])
+        self.assertEqual(_ids(self.replica.search_spots(
+            [('extended_info:app_type', 'food'),
+             ('extended_info:s_cuisine_indian', 'true')])), ["1"])
+        self.assertEqual(_ids(self.replica.search_spots(
+            [('extended_info:or_group:1', 's_cuisine_indian'),
+             ('extended_info:or_group:1', 's_cuisine_bbq')])), ["1", "3"])
+        self.assertEqual(self.client.searches, [])
+
+    def test_type_and_capacity(self):
+        self.assertEqual(_ids(self.replica.search_spots(
+            [('type', 'food_court'), ('type', 'study_room')])), ["1", "2"])
+        self.assertEqual(_ids(self.replica.search_spots(
+            [('capacity', 10)])), ["1"])
+
+    def test_location(self):
+        spot = self.replica.get_spot_by_id(1)
+        query = [('center_latitude', spot.latitude),
+                 ('center_longitude', spot.longitude)]
+
+        self.assertEqual(_ids(self.replica.search_spots(
+            query + [('distance', 10)])), ["1"])
+        self.assertEqual(_ids(self.replica.search_spots(
+            query + [('distance', 1000)])), ["1", "2", "3"])
+        self.assertEqual(_ids(self.replica.search_spots(
+            query + [('distance', 1000), ('limit', 2)])), ["1", "2"])
+
+        self.assertAlmostEqual(distance(47.6552915, -122.3051094,
+                                        47.6558366, -122.3085307),
+                               263.3, places=0)
+
+    def test_hours(self):
+        def search(*query):
+            return _ids(self.replica.search_spots(list(query)))
+
+        self.assertEqual(search(('open_at', 'Monday,10:45')), ["1"])
+        self.assertEqual(search(('open_at', 'Monday,11:00'),
+                                ('open_until', 'Monday,15:00')), ["2"])
+        self.assertEqual(search(('open_at', 'Saturday,12:00')), [])
+        self.assertEqual(search(('fuzzy_hours_start', 'Monday,10:05'),
+                                ('fuzzy_hours_end', 'Monday,10:40')), ["1"])
+        self.assertEqual(search(('fuzzy_hours_start', 'Monday,09:00'),
+                                ('fuzzy_hours_end', 'Monday,10:20')),
+                         ["2", "3"])
+        self.assertEqual(search(('fuzzy_hours_start', 'Saturday,09:00'),
+                                ('fuzzy_hours_end', 'Monday,00:10')),
+                         ["2", "3"])
+        self.assertEqual(self.client.searches, [])
+
+    def test_remote_fallback(self):
+        query = [('has_items', 'true'), ('item:brand', 'x')]
+        self.assertRaises(Exception, self.replica.search_spots, query)
+        self.assertEqual(self.client.searches, [query])
+
+        query = [('center_latitude', 47.6), ('distance', 10)]
+        self.assertRaises(Exception, self.replica.search_spots, query)
+        self.assertEqual(len(self.client.searches), 2)
+
+
+@override_settings(SPOTSEEKER_DAO_CLASS=DAO)
+class ReplicaSyncTest(TestCase):
+
+    def test_refresh(self):
+        client = ChangingClient(lightweight=True)
+        replica = SpotReplica(client=client)
+
+        changes = replica.refresh()
+        self.assertEqual([(c.sequence, c.action, c.spot_id)
+                          for c in changes],
+                         [(1, "added", "1"), (2, "added", "2"),
+                          (3, "added", "3")])
+        self.assertEqual(client.parsed, 3)
+        self.assertEqual(replica.manifest["1"][0],
+                         "f573702e9e71197ff3eaa3c6357845d614580930")
+
+        unchanged = replica.get_spot_by_id("3")
+        self.assertEqual(replica.refresh(), [])
+        self.assertEqual(client.parsed, 3)
+
+        client.spot_data[0]["etag"] = "new etag"
+        client.spot_data[0]["name"] = "New name"
+        del client.spot_data[1]
+        added = copy.deepcopy(client.spot_data[-1])
+        added["id"] = 4
+        client.spot_data.append(added)
+
+        changes = replica.refresh()
+        self.assertEqual([(c.sequence, c.action, c.spot_id)
+                          for c in changes],
+                         [(4, "changed", "1"), (5, "added", "4"),
+                          (6, "deleted", "2")])
+        self.assertEqual(client.parsed, 5)
+        self.assertEqual(changes[0].spot.name, "New name")
+        self.assertEqual(changes[0].previous.name, "Banh & Naan, Husky Den")
+        self.assertEqual(changes[2].spot, None)
+
+        self.assertTrue(replica.get_spot_by_id("3") is unchanged)
+        self.assertEqual(sorted(_ids(replica.all_spots())), ["1", "3", "4"])
+        self.assertEqual(sorted(replica.manifest.keys()), ["1", "3", "4"])
+
+        self.assertEqual([c.sequence for c in replica.changes(since=4)],
+                         [5, 6])
+        self.assertEqual(len(list(replica.changes())), 6)
+
+    def test_refresh_after_load(self):
+        client = ChangingClient()
+        replica = SpotReplica(client=client)
+        replica.load()
+        self.assertEqual(client.parsed, 3)
+
+        self.assertEqual(replica.refresh(), [])
+        self.assertEqual(client.parsed, 3)
+        self.assertEqual(list(replica.changes()), [])
+
+    def test_non_ascii(self):
+        client = ChangingClient(lightweight=True)
+        client.spot_data[0]["items"] = [
+            {"id": 1, "name": u"C\xe1mara", "category": u"C\xe1maras",
+             "subcategory": "Digital", "extended_info": {}},
+            {"id": 2, "name": "Tripod", "category": "Stands",
+             "subcategory": "Legs", "extended_info": {}}]
+        client.spot_data[0]["extended_info"][u"caf\xe9"] = u"tr\xfce"
+        client.spot_data[0]["extended_info"][u"b\xe1r"] = "true"
+        replica = SpotReplica(client=client)
+        self.assertEqual(len(replica.refresh()), 3)
+
+        self.assertEqual(_ids(replica.search_spots(
+            [("item:name", u"C\xe1mara")])), ["1"])
+        self.assertEqual(_ids(replica.search_spots(
+            [("item:category", "C\xc3\xa1maras")])), ["1"])
+        self.assertEqual(_ids(replica.search_spots(
+            [(u"extended_info:or_group:1", u"caf\xe9")])), [])
+        self.assertEqual(_ids(replica.search_spots(
+            [("extended_info:or_group:1", "b\xc3\xa1r")])), ["1"])
+        self.assertEqual(_ids(replica.search_spots(
+            [("extended_info:caf\xc3\xa9", "tr\xc3\xbce")])), ["1"])
+        self.assertEqual(_ids(replica.search_spots(
+            [(u"extended_info:caf\xe9", u"tr\xfce")])), ["1"])
+
+        client.spot_data[0]["items"][1]["subcategory"] = u"\xfcber"
+        client.spot_data[0]["etag"] = "new etag"
+        self.assertEqual(len(replica.refresh()), 1)
+        self.assertEqual(_ids(replica.search_spots(
+            [("item:subcategory", u"\xfcber")])), ["1"])
@@ -0,0 +1,180 @@
+import threading
+import time
+from BaseHTTPServer import HTTPServer
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.utils import override_settings
+from spotseeker_restclient.dao_implementation.live import reset_pool_manager
+from spotseeker_restclient.dao_implementation.spotseeker import Live
+from spotseeker_restclient.scheduler import RequestScheduler, \
+    INTERACTIVE, BULK, priority, current_priority, get_scheduler_stats, \
+    reset_schedulers
+from spotseeker_restclient.test.live import KeepAliveHandler
+
+
+@override_settings(SPOTSEEKER_SCHEDULER_INITIAL_LIMIT=4,
+                   SPOTSEEKER_SCHEDULER_LATENCY_TARGET=0.5)
+class RequestSchedulerTest(TestCase):
+
+    def test_priority(self):
+        self.assertEqual(current_priority(), INTERACTIVE)
+        with priority(BULK):
+            self.assertEqual(current_priority(), BULK)
+            with priority(INTERACTIVE):
+                self.assertEqual(current_priority(), INTERACTIVE)
+            self.assertEqual(current_priority(), BULK)
+        self.assertEqual(current_priority(), INTERACTIVE)
+        self.assertRaises(ValueError, priority("urgent").__enter__)
+
+    def test_reserve(self):
+        scheduler = RequestScheduler("host")
+        soon = time.time() + 0.05
+
+        # One of the four slots is kept for interactive requests
+        for i in range(3):
+            self.assertTrue(scheduler.acquire(BULK, soon))
+        self.assertFalse(scheduler.acquire(BULK, soon))
+        self.assertTrue(scheduler.acquire(INTERACTIVE, soon))
+        self.assertFalse(scheduler.acquire(INTERACTIVE, soon))
+
+        stats = scheduler.stats()
+        self.assertEqual(stats["in_flight"], 4)
+        self.assertEqual(stats[BULK]["admitted"], 3)
+        self.assertEqual(stats[BULK]["timeouts"], 1)
+        self.assertEqual(stats[INTERACTIVE]["admitted"], 1)
+        self.assertEqual(stats[INTERACTIVE]["wait"]["count"], 1)
+
+    def test_small_limit(self):
+        with self.settings(SPOTSEEKER_SCHEDULER_INITIAL_LIMIT=1):
+            scheduler = RequestScheduler("host")
+        soon = time.time() + 0.05
+
+        # No slot is left to reserve, so bulk requests get the only one
+        self.assertTrue(scheduler.acquire(BULK, soon))
+        self.assertFalse(scheduler.acquire(INTERACTIVE, soon))
+        scheduler.release()
+        self.assertTrue(scheduler.acquire(INTERACTIVE, soon))
+        self.assertFalse(scheduler.acquire(BULK, soon))
+
+    def test_interactive_first(self):
+        scheduler = RequestScheduler("host")
+        for i in range(4):
+            scheduler.acquire(INTERACTIVE)
+
+        order = []
+
+        def request(name):
+            scheduler.acquire(name, time.time() + 5)
+            order.append(name)
+
+        bulk = threading.Thread(target=request, args=(BULK,))
+        bulk.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=request, args=(INTERACTIVE,))
+        interactive.start()
+        time.sleep(0.05)
+        self.assertEqual(scheduler.stats()[BULK]["queued"], 1)
+        self.assertEqual(scheduler.stats()[INTERACTIVE]["queued"], 1)
+
+        # The bulk request waited longer, but doesn't go first
+        scheduler.release(0.1)
+        interactive.join(1)
+        self.assertEqual(order, [INTERACTIVE])
+
+        for i in range(2):
+            scheduler.release(0.1)
+        bulk.join(1)
+        self.assertEqual(order, [INTERACTIVE, BULK])
+
+    def test_aimd(self):
+        scheduler = RequestScheduler("host")
+        for i in range(8):
+            scheduler.acquire()
+            scheduler.release(0.1)
+        self.assertTrue(5 < scheduler.limit < 6, scheduler.limit)
+
+        limit = scheduler.limit
+        scheduler.acquire()
+        scheduler.release(0.1, failed=True)
+        self.assertEqual(scheduler.limit, limit / 2)
+
+        # The same slow spell isn't counted twice
+        scheduler.acquire()
+        scheduler.release(1)
+        self.assertEqual(scheduler.limit, limit / 2)
+
+        for i in range(5):
+            scheduler.acquire()
+            scheduler.release(failed=True)
+        self.assertTrue(scheduler.limit >= 1)
+
+        # Requests that were never sent leave the limit alone
+        limit = scheduler.limit
+        scheduler.acquire()
+        scheduler.release()
+        self.assertEqual(scheduler.limit, limit)
+
+    @override_settings(SPOTSEEKER_SCHEDULER_RATE=20,
+                       SPOTSEEKER_SCHEDULER_BURST=2)
+    def test_rate_limit(self):
+        scheduler = RequestScheduler("host")
+        start = time.time()
+        for i in range(4):
+            self.assertTrue(scheduler.acquire())
+            scheduler.release(0.01)
+        # Two in the burst, then one every 50ms
+        self.assertTrue(time.time() - start >= 0.09)
+
+        scheduler.acquire()
+        self.assertFalse(scheduler.acquire(deadline=time.time() + 0.01))
+
+    @override_settings(SPOTSEEKER_SCHEDULER_RATE=0.5)
+    def test_fractional_rate(self):
+        scheduler = RequestScheduler("host")
+        self.assertEqual(scheduler.burst, 1)
+        self.assertTrue(scheduler.acquire(deadline=time.time() + 0.05))
+        scheduler.release(0.01)
+
+        # The next token is two seconds away
+        self.assertFalse(scheduler.acquire(deadline=time.time() + 0.05))
+        scheduler._tokens = 0.99
+        self.assertTrue(scheduler.acquire(deadline=time.time() + 0.5))
+
+        with self.settings(SPOTSEEKER_SCHEDULER_BURST=0.5):
+            self.assertRaises(ImproperlyConfigured, RequestScheduler, "host")
+
+
+class LiveSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = "http://127.0.0.1:%s" % self.server.server_port
+        reset_pool_manager()
+        reset_schedulers()
+
+    def tearDown(self):
+        reset_pool_manager()
+        reset_schedulers()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_live_requests(self):
+        with override_settings(SPOTSEEKER_HOST=self.host,
+                               SPOTSEEKER_OAUTH_KEY="key",
+                               SPOTSEEKER_OAUTH_SECRET="secret",
+                               SPOTSEEKER_SCHEDULER=True):
+            dao = Live()
+            self.assertEqual(dao.getURL("/api/v1/spot/1", {}).status, 200)
+            with priority(BULK):
+                dao.putURL("/api/v1/spot/1", {}, "{}")
+
+            stats = get_scheduler_stats()[self.host]
+            self.assertEqual(stats["in_flight"], 0)
+            self.assertEqual(stats[INTERACTIVE]["admitted"], 1)
+            self.assertEqual(stats[BULK]["admitted"], 1)
+            self.assertTrue(stats["limit"] > 10)
+
+        self.assertEqual(get_scheduler_stats(), {})
@@ -1,10 +1,25 @@
 from django.test import TestCase
-from spotseeker_restclient.spotseeker import Spotseeker
+from spotseeker_restclient.spotseeker import Spotseeker, AsyncSpotseeker, \
+    _iter_json_array
+from spotseeker_restclient.dao_implementation.spotseeker import File
 from spotseeker_restclient.exceptions import DataFailureException
+from spotseeker_restclient.scheduler import BULK, priority, current_priority
 from django.utils.dateparse import parse_datetime, parse_time
 from django.test.utils import override_settings
 
 DAO = "spotseeker_restclient.dao_implementation.spotseeker.File"
+PRIORITY_DAO = "spotseeker_restclient.test.spot.PriorityFile"
+
+
+class PriorityFile(File):
+    """
+    Records the priority each request would be scheduled with.
+    """
+    priorities = []
+
+    def getURL(self, url, headers):
+        PriorityFile.priorities.append(current_priority())
+        return super(PriorityFile, self).getURL(url, headers)
 
 
 @override_settings(SPOTSEEKER_DAO_CLASS=DAO)
@@ -73,6 +88,28 @@ class SpotseekerTest(TestCase):
         self.assertRaises(DataFailureException,
                           spot_client.get_spot_by_id, 999)
 
+    def test_get_spots_by_ids(self):
+        spot_client = Spotseeker()
+        spots = spot_client.get_spots_by_ids(['123', 999, '1'],
+                                             max_workers=2)
+
+        self.assertEqual(len(spots), 3)
+        self.assertEqual(spots[0].spot_id, "123")
+        self.assertTrue(isinstance(spots[1], DataFailureException))
+        self.assertEqual(spots[1].status, 404)
+        self.assertEqual(spots[2].spot_id, 1)
+
+        self.assertEqual(spot_client.get_spots_by_ids([]), [])
+
+    @override_settings(SPOTSEEKER_DAO_CLASS=PRIORITY_DAO)
+    def test_worker_priority(self):
+        PriorityFile.priorities = []
+        with priority(BULK):
+            Spotseeker().get_spots_by_ids(['123', '1'], max_workers=2)
+            with AsyncSpotseeker(max_workers=2) as spot_client:
+                spot_client.get_spot_by_id('123').get(5)
+        self.assertEqual(PriorityFile.priorities, [BULK] * 3)
+
     def test_search_spots(self):
         """ Tests search_spots function with mock data provided in the
             file named : spot?limit=5&center_latitude=47.653811&
@@ -133,6 +170,43 @@ class SpotseekerTest(TestCase):
 
         self.assertEqual(len(spot_data.spot_availability), 5)
 
+    def test_iter_search_spots(self):
+        spot_client = Spotseeker()
+        query_tuple = [
+                    ('limit', 5), ('center_latitude', u'47.653811'),
+                    ('center_longitude', u'-122.307815'),
+                    ('distance', 100000),
+                    ('fuzzy_hours_start', 'Tuesday,05:00'),
+                    ('fuzzy_hours_end', 'Tuesday,11:00'),
+                    ('extended_info:app_type', 'food')]
+
+        spots = spot_client.iter_search_spots(query_tuple, chunk_size=100)
+        self.assertEqual([spot.spot_id for spot in spots],
+                         [spot.spot_id for spot in
+                          spot_client.search_spots(query_tuple)])
+
+    def test_iter_all_spots(self):
+        spot_client = Spotseeker(lightweight=True)
+        spots = list(spot_client.iter_all_spots(chunk_size=7))
+        self.assertEqual(len(spots), 3)
+        self.assertEqual([spot.spot_id for spot in spots],
+                         [spot.spot_id for spot in spot_client.all_spots()])
+
+        spots = spot_client.iter_search_spots([("no_such_query", 1)])
+        self.assertRaises(DataFailureException, list, spots)
+
+    def test_iter_json_array(self):
+        content = '[ {"a": [1, 2]}, "x]" ,\n 12, 3.5, null, [] ]'
+        for size in (1, 2, 3, len(content)):
+            chunks = [content[i:i + size]
+                      for i in range(0, len(content), size)]
+            self.assertEqual(list(_iter_json_array(chunks)),
+                             [{"a": [1, 2]}, "x]", 12, 3.5, None, []])
+
+        self.assertEqual(list(_iter_json_array(["[", "]"])), [])
+        self.assertRaises(ValueError, list, _iter_json_array(['[{"a"']))
+        self.assertRaises(ValueError, list, _iter_json_array(['{}']))
+
     def test_building_list(self):
         spot_client = Spotseeker()
         buildings = spot_client.get_building_list("seattle")
@@ -142,3 +216,68 @@ class SpotseekerTest(TestCase):
         spot_client = Spotseeker()
         spots = spot_client.all_spots()
         self.assertEqual(len(spots), 3)
+
+    def test_async_client(self):
+        with AsyncSpotseeker(max_workers=4) as spot_client:
+            spot = spot_client.get_spot_by_id('123')
+            spots = spot_client.all_spots()
+            bad_spot = spot_client.get_spot_by_id(999)
+            buildings = spot_client.get_building_list("seattle")
+
+            self.assertEqual(spot.get(5).spot_id, "123")
+            self.assertEqual(len(spots.get(5)), 3)
+            self.assertEqual(len(buildings.get(5)), 43)
+            self.assertRaises(DataFailureException, bad_spot.get, 5)
+
+    def test_async_iter_spots(self):
+        with AsyncSpotseeker(client=Spotseeker(lightweight=True)) as client:
+            spots = list(client.iter_all_spots(chunk_size=7))
+            self.assertEqual(len(spots), 3)
+            self.assertEqual([spot.spot_id for spot in spots],
+                             [spot.spot_id for spot in
+                              client.all_spots().get(5)])
+
+            spots = client.iter_search_spots([("no_such_query", 1)])
+            self.assertRaises(DataFailureException, list, spots)
+
+    def test_lightweight_spot(self):
+        spot_client = Spotseeker(lightweight=True)
+        spot_data = spot_client.get_spot_by_id('123')
+        model_data = Spotseeker().get_spot_by_id('123')
+
+        for attr in ["spot_id", "name", "uri", "latitude", "longitude",
+                     "height_from_sea_level", "building_name", "floor",
+                     "room_number", "capacity", "display_access_restrictions",
+                     "organization", "manager", "etag", "external_id",
+                     "last_modified"]:
+            self.assertEqual(getattr(spot_data, attr),
+                             getattr(model_data, attr))
+
+        self.assertFalse(hasattr(spot_data, "__dict__"))
+        self.assertEqual(len(spot_data.images), 1)
+        self.assertEqual(spot_data.images[0].image_id, "1")
+        self.assertEqual(spot_data.images[0].creation_date,
+                         parse_datetime("Sun, 06 Nov 1994 08:49:37 GMT"))
+        self.assertEqual(spot_data.images[0].thumbnail_root,
+                         "/api/v1/spot/123/image/1/thumb")
+        self.assertEqual(len(spot_data.spot_availability), 7)
+        self.assertEqual(len(spot_data.extended_info),
+                         len(model_data.extended_info))
+
+        spot_data.images = []
+        self.assertEqual(spot_data.images, [])
+
+    def test_lightweight_spot_items(self):
+        spot_client = Spotseeker(lightweight=True)
+        spot_data = spot_client.get_spot_by_id('1')
+        self.assertEqual(len(spot_data.items), 2)
+        item1 = spot_data.items[0]
+        self.assertEqual(item1.item_id, 796)
+        self.assertEqual(item1.name, "C-19074")
+        self.assertEqual(item1.category, "Digital Camera")
+        self.assertEqual(len(item1.images), 1)
+        self.assertEqual(item1.images[0].image_id, 1)
+        self.assertEqual(len(item1.extended_info), 3)
+
+        spots = spot_client.all_spots()
+        self.assertEqual(len(spots), 3)
@@ -1,3 +1,21 @@
 from django.utils import unittest
 
 from spotseeker_restclient.test.spot import SpotseekerTest
+from spotseeker_restclient.test.live import LiveDAOTest, \
+    CircuitBreakerTest, DeadlineTest
+from spotseeker_restclient.test.cache import MemoryCacheTest, \
+    MemoryStoreTest, DjangoCacheTest, ETagCacheTest, CacheEntryTest
+from spotseeker_restclient.test.dao import DAOTest
+from spotseeker_restclient.test.replica import SpotReplicaTest, \
+    ReplicaSyncTest
+from spotseeker_restclient.test.geo_index import SpotGeoIndexTest
+from spotseeker_restclient.test.availability import AvailabilityIndexTest
+from spotseeker_restclient.test.attribute_index import AttributeIndexTest
+from spotseeker_restclient.test.mock import ResourceIndexTest
+from spotseeker_restclient.test.cache_manager import CacheManagerTest
+from spotseeker_restclient.test.cache_maintenance import CacheMaintenanceTest
+from spotseeker_restclient.test.instrumentation import InstrumentationTest, \
+    ExporterTest
+from spotseeker_restclient.test.scheduler import RequestSchedulerTest, \
+    LiveSchedulerTest
+from spotseeker_restclient.test.image_cache import ImageCacheTest